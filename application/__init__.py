@@ -7,11 +7,33 @@ from flask_wtf.csrf import CSRFProtect
 from flask_login import LoginManager
 from config import DevConfig, ProdConfig
 from flask_mail import Mail
+from flask_compress import Compress
+from application.similarity_store import SimilarityStore
+from application.recommender import Recommender
+from application.rating_model import RatingModel
+from application.recipe_catalogue import RecipeCatalogue
+from application.schema_cache import reflect_metadata
+from application.query_stats import QueryStats
+from application.metrics import Metrics
+from application.http_cache import ConditionalGet, PageCache
 
 
 # Database
 db = SQLAlchemy()
 
+# SQL statement counts and timings per request (see query_stats.py)
+query_stats = QueryStats()
+
+# Prometheus metrics at /metrics (see metrics.py)
+metrics = Metrics()
+
+# Response compression and conditional GET (see http_cache.py)
+compress = Compress()
+conditional_get = ConditionalGet()
+
+# Rendered pages of anonymous users (see http_cache.py)
+page_cache = PageCache()
+
 # Security
 csrf = CSRFProtect()
 talisman = Talisman()
@@ -23,6 +45,16 @@ login.login_view = "auth.signin"
 # Mail
 mail = Mail()
 
+# Content similarity (memory-mapped, see similarity_store.py)
+similarity_store = SimilarityStore()
+
+# Recipe data (memory-mapped, see recipe_catalogue.py)
+recipe_catalogue = RecipeCatalogue()
+
+# Personalized recommendations (see recommender.py)
+recommender = Recommender()
+rating_model = RatingModel()
+
 
 def create_app(testing=True, debug=True):
     """App factory"""
@@ -37,7 +69,12 @@ def create_app(testing=True, debug=True):
 
     # Initialize extensions
     csrf.init_app(app)
+    metrics.init_app(app)
     db.init_app(app)
+    query_stats.init_app(app)
+    compress.init_app(app)
+    conditional_get.init_app(app)  # before talisman, see ConditionalGet
+    page_cache.init_app(app)
     if testing | debug:
         talisman.init_app(
             app,
@@ -54,11 +91,18 @@ def create_app(testing=True, debug=True):
         )
     login.init_app(app)
     mail.init_app(app)
+    similarity_store.init_app(app)
+    recipe_catalogue.init_app(app)
+    recommender.init_app(app)
+    rating_model.init_app(app)
 
     with app.app_context():
 
-        # Create models from existing DB
-        db.Model.metadata.reflect(db.engine)
+        # Create models from existing DB (or from a snapshot of its schema,
+        # see schema_cache.py)
+        reflect_metadata(
+            db.Model.metadata, db.engine, app.config.get("SCHEMA_CACHE_PATH")
+        )
 
         # Create Routes
         from application.main import bp as main_bp
@@ -69,6 +113,11 @@ def create_app(testing=True, debug=True):
 
         app.register_blueprint(auth_bp, url_prefix="/auth")
 
+        # Command line interface
+        from application import cli
+
+        cli.register(app)
+
         return app
 
 
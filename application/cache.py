@@ -0,0 +1,235 @@
+""" In-process caches """
+import functools
+import time
+from collections import OrderedDict
+from threading import Event, Lock, get_ident
+
+
+class LRUCache:
+    """
+    Thread-safe least recently used cache with a maximum number of
+    entries and an optional time to live (in seconds) per entry.
+    Counts cache hits and misses (see also on_lookup).
+    """
+
+    def __init__(self, maxsize=128, ttl=None, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self.lookup_callbacks = []
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        DESCRIPTION:
+            Returns the cached value for key and marks it as most recently
+            used. Expired entries are removed and count as a miss.
+        INPUT:
+            key (hashable): Cache key
+            default: Returned when key is not cached (default=None)
+        OUTPUT:
+            Cached value or default
+        """
+        hit = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > self.timer():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    hit = True
+                else:
+                    del self._entries[key]
+            if not hit:
+                self.misses += 1
+                value = default
+        for callback in self.lookup_callbacks:
+            callback(hit)
+        return value
+
+    def set(self, key, value):
+        """
+        DESCRIPTION:
+            Caches value under key, evicting the least recently used
+            entry when the cache is full.
+        INPUT:
+            key (hashable): Cache key
+            value: Value to cache
+        OUTPUT:
+            None
+        """
+        expires = None if self.ttl is None else self.timer() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes all entries and resets the hit and miss counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def on_lookup(self, callback):
+        """
+        Registers a function called after every get with one argument,
+        True for a hit and False for a miss (e.g. to export hit ratios)
+        """
+        self.lookup_callbacks.append(callback)
+
+    def stats(self):
+        """
+        DESCRIPTION:
+            Cache statistics, e.g. for logging or monitoring.
+        OUTPUT:
+            Dictionary with keys "hits", "misses", "size" and "maxsize"
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+
+class _Call:
+    """A function call in progress, see SingleFlight"""
+
+    def __init__(self):
+        self.thread = get_ident()
+        self.done = Event()
+        self.waiters = 0
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs
+    the function, callers arriving while it runs wait for it and get
+    the same result (or exception) instead of running it again. E.g.
+    many simultaneous requests for a recipe that just went viral cause
+    a single content based search.
+
+    Calls are coalesced between the threads of a process (e.g. the
+    threads of a gunicorn worker, see gunicorn.conf.py). Callers that
+    waited timeout seconds (default=None, no limit) run the function
+    themselves.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.coalesced = 0
+        self.timeouts = 0
+        self._calls = {}
+        self._lock = Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        DESCRIPTION:
+            Calls function(*args, **kwargs), or waits for the call in
+            progress with the same key.
+        INPUT:
+            key (hashable): e.g. function name and arguments
+            function: Function to call
+        OUTPUT:
+            result: Return value of function
+            shared (Boolean): True if other callers got the same result
+                (mutable results must then be copied before changing them)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+            elif call.thread == get_ident():
+                # Recursive call of the same thread, waiting would deadlock
+                call = None
+                leader = False
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+
+        if call is None:
+            return function(*args, **kwargs), False
+        if not leader:
+            if not call.done.wait(self.timeout):
+                with self._lock:
+                    self.timeouts += 1
+                return function(*args, **kwargs), False
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = function(*args, **kwargs)
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                shared = call.waiters > 0
+            call.done.set()
+        return call.result, shared
+
+    def stats(self):
+        """
+        DESCRIPTION:
+            Statistics, e.g. for logging or monitoring.
+        OUTPUT:
+            Dictionary with keys "in_flight" (calls in progress),
+            "coalesced" (calls that waited for another caller) and
+            "timeouts" (waiting calls that gave up and ran themselves)
+        """
+        return {
+            "in_flight": len(self._calls),
+            "coalesced": self.coalesced,
+            "timeouts": self.timeouts,
+        }
+
+
+def single_flight(copy=None):
+    """
+    DESCRIPTION:
+        Method decorator coalescing concurrent calls with equal arguments
+        (see SingleFlight) for objects with a SingleFlight attribute
+        "in_flight".
+    INPUT:
+        copy (function): Applied to the result for every caller if the
+            result was shared, e.g. to copy rows that callers may change
+            (default=None, results are shared as they are)
+    OUTPUT:
+        Decorator
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = (method.__name__, args, tuple(sorted(kwargs.items())))
+            result, shared = self.in_flight.do(key, method, self, *args, **kwargs)
+            if shared and copy is not None:
+                return copy(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+# eof
@@ -0,0 +1,192 @@
+""" Command line interface (flask <command>) """
+import time
+import click
+
+
+def register(app):
+    @app.cli.group()
+    def similarity():
+        """Content similarity store commands."""
+        pass
+
+    @similarity.command("build")
+    @click.argument("path", default=lambda: app.config["SIMILARITY_STORE_PATH"])
+    @click.option(
+        "--dtype",
+        type=click.Choice(["float32", "float16"]),
+        default="float32",
+        help="Data type of the similarity scores.",
+    )
+    def build_similarity_store(path, dtype):
+        """Export content similarity tables to a memory-mapped store."""
+        from application import db
+        from application.sql_queries import Sql_queries
+
+        if not path:
+            raise click.UsageError("No PATH given and SIMILARITY_STORE_PATH not set")
+        shape = Sql_queries(db.session).export_similarity_store(path, dtype)
+        click.echo("Exported {} x {} similarity arrays to {}".format(*shape, path))
+
+    @app.cli.group()
+    def profile():
+        """Performance profiling commands."""
+        pass
+
+    @profile.command()
+    @click.option("--top", default=20, show_default=True)
+    def imports(top):
+        """Show the slowest imports of app startup (python -X importtime)."""
+        from application.lazy import import_profile
+
+        start = time.perf_counter()
+        profile, modules = import_profile()
+        click.echo("Startup took {:.2f}s".format(time.perf_counter() - start))
+        click.echo("{:>12} {:>12}  module".format("self [us]", "cumul. [us]"))
+        for module, self_us, cumulative_us in profile[:top]:
+            click.echo("{:>12} {:>12}  {}".format(self_us, cumulative_us, module))
+        if modules:
+            click.echo("Imported at startup: {}".format(", ".join(modules)))
+
+    @app.cli.group()
+    def schema():
+        """Schema snapshot commands."""
+        pass
+
+    @schema.command()
+    @click.argument("path", default=lambda: app.config["SCHEMA_CACHE_PATH"])
+    def refresh(path):
+        """Reflect the DB schema and write a new snapshot."""
+        import os
+        from application import db
+        from application.schema_cache import reflect_metadata
+        from sqlalchemy import MetaData
+
+        if not path:
+            raise click.UsageError("No PATH given and SCHEMA_CACHE_PATH not set")
+        if os.path.exists(path):
+            os.remove(path)
+        metadata = MetaData()
+        reflect_metadata(metadata, db.engine, path)
+        click.echo("Saved {} tables to {}".format(len(metadata.tables), path))
+
+    @app.cli.group()
+    def catalogue():
+        """Recipe catalogue commands."""
+        pass
+
+    @catalogue.command("build")
+    @click.argument("path", default=lambda: app.config["RECIPE_CATALOGUE_PATH"])
+    def build_catalogue(path):
+        """Export the recipes table to a new memory-mapped catalogue build."""
+        from application import db
+        from application.sql_queries import Sql_queries
+
+        if not path:
+            raise click.UsageError("No PATH given and RECIPE_CATALOGUE_PATH not set")
+        version, Nrecipes = Sql_queries(db.session).export_recipe_catalogue(path)
+        click.echo(
+            "Exported {} recipes to {} (version {}), running apps reload it "
+            "within RECIPE_CATALOGUE_RELOAD_INTERVAL seconds".format(
+                Nrecipes, path, version
+            )
+        )
+
+    @app.cli.group()
+    def recommender():
+        """Personalized recommendation commands."""
+        pass
+
+    @recommender.command("build")
+    @click.argument("path", default=lambda: app.config["RECOMMENDER_PATH"])
+    @click.option(
+        "--neighbours",
+        default=50,
+        show_default=True,
+        help="Number of similar recipes to keep per recipe.",
+    )
+    def build_recommender(path, neighbours):
+        """Build the collaborative filtering model from the likes table."""
+        from application import db
+        from application.sql_queries import Sql_queries
+        from application.recommender import build_recommender
+
+        if not path:
+            raise click.UsageError("No PATH given and RECOMMENDER_PATH not set")
+        likes = Sql_queries(db.session).query_all_likes()
+        shape = build_recommender(path, likes, k=neighbours)
+        click.echo("Saved {} x {} recipe neighbours to {}".format(*shape, path))
+
+    @app.cli.group()
+    def likes():
+        """Likes table commands."""
+        pass
+
+    @likes.command()
+    def index():
+        """Remove duplicate likes and add a unique (userID, recipesID) index."""
+        from application import db
+        from application.sql_queries import Sql_queries
+
+        sq = Sql_queries(db.session)
+        removed = sq.build_likes_unique_index()
+        click.echo("Removed {} duplicate likes, created unique index".format(removed))
+        if removed and sq.has_user_categories():
+            sq.build_user_categories()
+            click.echo("Rebuilt user category counts")
+
+    @app.cli.group()
+    def categories():
+        """Cookbook category statistics commands."""
+        pass
+
+    @categories.command("build")
+    def build_categories():
+        """Create and fill the user_categories table from the likes table."""
+        from application import db
+        from application.sql_queries import Sql_queries
+
+        rows = Sql_queries(db.session).build_user_categories()
+        click.echo("Wrote {} user category counts".format(rows))
+
+    @app.cli.group()
+    def ratings():
+        """Rating prediction commands."""
+        pass
+
+    @ratings.command()
+    @click.argument("path", default=lambda: app.config["RATING_MODEL_PATH"])
+    @click.option("--factors", default=16, show_default=True)
+    @click.option("--iterations", default=10, show_default=True)
+    @click.option("--regularization", default=0.1, show_default=True)
+    def train(path, factors, iterations, regularization):
+        """Train the rating model on the likes table."""
+        from application import db
+        from application.sql_queries import Sql_queries
+        from application.rating_model import build_rating_model
+
+        if not path:
+            raise click.UsageError("No PATH given and RATING_MODEL_PATH not set")
+        start = time.perf_counter()
+        likes = Sql_queries(db.session).query_all_likes()
+        click.echo(
+            "Loaded {} likes in {:.2f}s".format(len(likes), time.perf_counter() - start)
+        )
+        history = build_rating_model(
+            path,
+            likes,
+            factors=factors,
+            iterations=iterations,
+            regularization=regularization,
+        )
+        for iteration, seconds, rmse in history:
+            click.echo(
+                "Iteration {}: {:.3f}s, training RMSE {:.4f}".format(
+                    iteration, seconds, rmse
+                )
+            )
+        click.echo(
+            "Saved model to {} in {:.2f}s".format(path, time.perf_counter() - start)
+        )
+
+
+# eof
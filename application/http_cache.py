@@ -0,0 +1,333 @@
+""" Conditional GET and page cache for anonymous pages """
+import hashlib
+import os
+import time
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from application.cache import LRUCache
+
+
+def anonymous_get():
+    """
+    True if the response to the current request may be cached: GET
+    requests of anonymous users without pending flash messages
+    """
+    return (
+        request.method == "GET"
+        and not current_user.is_authenticated
+        and not session.get("_flashes")
+    )
+
+
+class ConditionalGet:
+    """
+    Strong ETags for pages of anonymous users, so that repeat views are
+    answered with "304 Not Modified" before rendering anything.
+
+    A page's ETag is a hash of the data versions passed by the view (e.g.
+    the recipe catalogue version), the url, ETAG_VERSION and the parts of
+    the session that end up in the page (its CSRF token). It also changes
+    every half WTF_CSRF_TIME_LIMIT, so a page is never revalidated with an
+    expired CSRF token.
+
+    Must be initialized before Talisman: 304 responses are sent without
+    Content-Security-Policy, as browsers would otherwise replace the
+    cached page's header (and its script nonce) with a new one.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self.strip_csp)
+
+    @staticmethod
+    def strip_csp(response):
+        if response.status_code == 304:
+            response.headers.pop("Content-Security-Policy", None)
+        return response
+
+    @staticmethod
+    def page_etag(*versions):
+        """
+        DESCRIPTION:
+            ETag of the requested page.
+        INPUT:
+            versions: Anything else the page depends on, e.g.
+                recipe_catalogue.version or session["search_query"]
+        OUTPUT:
+            String, None if the page must not be cached (logged in
+            users, other methods than GET, pending flash messages)
+        """
+        if not anonymous_get():
+            return None
+        config = current_app.config
+        csrf_time_limit = config.get("WTF_CSRF_TIME_LIMIT", 3600)
+        csrf_period = (
+            int(time.time() // (csrf_time_limit / 2)) if csrf_time_limit else 0
+        )
+        parts = (
+            config.get("ETAG_VERSION"),
+            request.full_path,
+            session.get("csrf_token"),
+            csrf_period,
+        ) + versions
+        return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def matches(etag):
+        """
+        True if the client's cached page has this ETag (also when the
+        compression appended its algorithm, e.g. "<etag>:br")
+        """
+        if etag is None:
+            return False
+        if etag in request.if_none_match:
+            return True
+        return any(tag.startswith(etag + ":") for tag in request.if_none_match)
+
+    @staticmethod
+    def not_modified(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+    def with_etag(self, page, *versions):
+        """
+        DESCRIPTION:
+            Response for a rendered page with its ETag (computed after
+            rendering, which may create the session's CSRF token).
+        INPUT:
+            page (String): Rendered template
+            versions: As for page_etag
+        OUTPUT:
+            flask.Response
+        """
+        response = make_response(page)
+        etag = self.page_etag(*versions)
+        if etag is not None:
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+
+class MemoryBackend:
+    """Page cache backend: LRU cache of each worker process"""
+
+    def __init__(self, maxsize=512, ttl=None):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, page):
+        self.cache.set(key, page)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class FileBackend:
+    """
+    Page cache backend: one file per page in a directory shared by all
+    worker processes (e.g. on the same machine). Files are written to a
+    temporary file first and then moved into place, so readers never see
+    half written pages. Expired pages are removed when read, and every
+    write removes expired pages and the least recently written pages
+    beyond maxsize, so the directory never grows without bound.
+    """
+
+    def __init__(self, path, ttl=None, maxsize=512):
+        self.path = path
+        self.ttl = ttl
+        self.maxsize = maxsize
+        os.makedirs(path, exist_ok=True)
+
+    def filename(self, key):
+        return os.path.join(self.path, key + ".html")
+
+    def get(self, key):
+        filename = self.filename(key)
+        try:
+            if self.ttl is not None and os.path.getmtime(filename) + self.ttl < (
+                time.time()
+            ):
+                os.remove(filename)
+                return None
+            with open(filename, encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, page):
+        tmp_file = "{}.{}.tmp".format(self.filename(key), os.getpid())
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(page)
+        os.replace(tmp_file, self.filename(key))
+        self.sweep()
+
+    def sweep(self):
+        """Removes expired pages and the oldest pages beyond maxsize"""
+        pages = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".html"):
+                try:
+                    pages.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+        pages.sort(reverse=True)
+        cutoff = None if self.ttl is None else time.time() - self.ttl
+        for i, (mtime, filename) in enumerate(pages):
+            if i >= self.maxsize or (cutoff is not None and mtime < cutoff):
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+
+    def clear(self):
+        for filename in os.listdir(self.path):
+            if filename.endswith(".html"):
+                try:
+                    os.remove(os.path.join(self.path, filename))
+                except FileNotFoundError:
+                    pass
+
+
+class RedisBackend:
+    """
+    Page cache backend: Redis (or any server speaking its protocol),
+    shared by all workers and machines. Needs a client with get, set,
+    scan_iter and delete like redis.Redis.
+    """
+
+    def __init__(self, client, ttl=None, prefix="page:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, ttl=None):
+        """Connects with redis-py (only needed for this backend)"""
+        import redis
+
+        return cls(redis.Redis.from_url(url), ttl)
+
+    def get(self, key):
+        page = self.client.get(self.prefix + key)
+        return None if page is None else page.decode("utf-8")
+
+    def set(self, key, page):
+        self.client.set(self.prefix + key, page.encode("utf-8"), ex=self.ttl)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+class PageCache:
+    """
+    Cache of whole rendered pages of anonymous users (e.g. the compare
+    and search pages), so that bursts of anonymous traffic (crawlers,
+    shared links) skip the queries and rendering. Pages are keyed by
+    url and the data versions passed by the view (e.g. the recipe
+    catalogue version), so new catalogue builds are never served from
+    old pages.
+
+    The only per-response parts of these pages, the CSP script nonce
+    and the CSRF token, are stored as placeholders and filled in for
+    every response.
+
+    The backend is set with PAGE_CACHE: "memory" (per worker process),
+    "file" (directory PAGE_CACHE_PATH shared by all workers), "redis"
+    (server at PAGE_CACHE_URL) or "" (disabled).
+    """
+
+    nonce_placeholder = "__page_cache_csp_nonce__"
+    csrf_placeholder = "__page_cache_csrf_token__"
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.lookup_callbacks = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        kind = app.config.get("PAGE_CACHE")
+        ttl = app.config.get("PAGE_CACHE_TTL")
+        if not kind:
+            self.backend = None
+        elif kind == "memory":
+            self.backend = MemoryBackend(app.config.get("PAGE_CACHE_SIZE", 512), ttl)
+        elif kind == "file":
+            self.backend = FileBackend(
+                app.config["PAGE_CACHE_PATH"],
+                ttl,
+                app.config.get("PAGE_CACHE_SIZE", 512),
+            )
+        elif kind == "redis":
+            self.backend = RedisBackend.from_url(app.config["PAGE_CACHE_URL"], ttl)
+        else:
+            raise ValueError("Unknown PAGE_CACHE backend {!r}".format(kind))
+
+    def key(self, *versions):
+        """
+        DESCRIPTION:
+            Cache key of the requested page.
+        INPUT:
+            versions: Anything else the page depends on, e.g.
+                recipe_catalogue.version or session["search_query"]
+        OUTPUT:
+            String, None if the page must not be cached (see anonymous_get)
+        """
+        if self.backend is None or not anonymous_get():
+            return None
+        parts = (current_app.config.get("ETAG_VERSION"), request.full_path) + versions
+        return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        DESCRIPTION:
+            Cached page with the nonce and CSRF token of this response.
+        INPUT:
+            key (String): see key (None always misses)
+        OUTPUT:
+            String, None if not cached
+        """
+        if key is None:
+            return None
+        page = self.backend.get(key)
+        for callback in self.lookup_callbacks:
+            callback(page is not None)
+        if page is None:
+            return None
+        return page.replace(self.nonce_placeholder, self.nonce()).replace(
+            self.csrf_placeholder, generate_csrf()
+        )
+
+    def set(self, key, page):
+        """Caches a page rendered for the current request (if key is not None)"""
+        if key is None or page is None:
+            return
+        nonce = self.nonce()
+        if nonce:
+            page = page.replace(nonce, self.nonce_placeholder)
+        self.backend.set(key, page.replace(generate_csrf(), self.csrf_placeholder))
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def on_lookup(self, callback):
+        """Registers a function called with True (hit) or False (miss)"""
+        self.lookup_callbacks.append(callback)
+
+    @staticmethod
+    def nonce():
+        """CSP nonce of the current response (set by Talisman)"""
+        return getattr(request, "csp_nonce", "")
+
+
+# eof
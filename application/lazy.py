@@ -0,0 +1,79 @@
+""" Lazily imported modules """
+import importlib
+import json
+import subprocess
+import sys
+import types
+
+
+# Imported on first use only (see LazyModule), not during app startup
+HEAVY_MODULES = ["altair", "numpy", "pandas", "scipy"]
+
+# Code run by import_profile
+STARTUP = "from application import create_app; create_app()"
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is only imported when one of its
+    attributes is first used, e.g.
+
+        pd = LazyModule("pandas")   # nothing imported yet
+        pd.DataFrame(...)           # imports pandas
+
+    Keeps the heavy scientific stack (pandas, numpy, altair) out of app
+    startup, so routes that never touch it (e.g. /about, /auth/signin)
+    are served by a worker without paying for its import. After the
+    import, the module's attributes are copied over, so later lookups
+    are plain attribute reads.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+    def __dir__(self):
+        return dir(importlib.import_module(self.__name__))
+
+    def __repr__(self):
+        return "<lazy module {!r}>".format(self.__name__)
+
+
+def import_profile(code=STARTUP):
+    """
+    DESCRIPTION:
+        Runs code in a fresh interpreter with "python -X importtime" and
+        collects how long every module took to import, e.g. to find what
+        slows down worker boot ("flask profile imports").
+    INPUT:
+        code (String): Python code to profile (default: app startup)
+    OUTPUT:
+        profile (list of tuples): (module, self time, cumulative time),
+            times in microseconds, slowest cumulative time first
+        modules (list of strings): Imported HEAVY_MODULES
+    """
+    check = "; import sys, json; print(json.dumps([m for m in {} if m in sys.modules]))"
+    check = check.format(json.dumps(HEAVY_MODULES))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code + check],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    profile = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:") :].split("|")
+        profile.append((module.strip(), int(self_us), int(cumulative_us)))
+    profile.sort(key=lambda p: p[2], reverse=True)
+    modules = json.loads(result.stdout.strip().splitlines()[-1])
+    return profile, modules
+
+
+# eof
@@ -1,5 +1,19 @@
-import altair as alt
-import numpy as np
+import json
+from application.cache import LRUCache
+from application.lazy import LazyModule
+from application.recipe_rows import column
+from application.sql_queries import EMISSIONS_DOMAIN
+
+alt = LazyModule("altair")
+np = LazyModule("numpy")
+
+
+# Name of the data referenced by the bar chart of bar_compare_emissions
+COMPARE_DATASET = "similar-recipes"
+
+# Serialized bar chart specs without data, see compare_chart_skeleton
+# (bounded, sort_by comes from the url)
+compare_skeletons = LRUCache(maxsize=64)
 
 
 def bar_compare_emissions(
@@ -17,11 +31,11 @@ def bar_compare_emissions(
         reference recipe.
 
     INPUT:
-        reference_recipe (DataFrame): Recipe dataframe row for the
-            reference recipe (to which everything else is compared)
+        reference_recipe (RecipeRow): Row of the reference recipe (to
+            which everything else is compared)
 
-        search_results (DataFrame): Recipe dataframe with rows being
-            the suggested similar recipes to the reference recipe.
+        search_results (list of RecipeRow): Suggested similar recipes to
+            the reference recipe.
 
         relative (Boolean): If true, emission scores are relative to
             the reference recipe, otherwise absolute emissions are
@@ -36,7 +50,7 @@ def bar_compare_emissions(
             log-scale (default='lin')
 
     OUTPUT:
-        Altair json object
+        Vega-lite json spec (String)
     """
 
     # determine scale
@@ -49,113 +63,161 @@ def bar_compare_emissions(
 
     if relative:
         # compute emissions relative to reference
-        source = search_results.copy()
-        source["emission change"] = (
-            np.ceil(100 * (search_results[voi].values - reference_recipe[voi])) / 100
-        )
-        source["emission_change"] = source["emission change"]
-
-        # create bar chart
-        bars = (
-            alt.Chart(source)
-            .transform_calculate(link=base_url + alt.datum.url + "?sort_by=" + sort_by)
-            .mark_bar()
-            .encode(
-                y=alt.Y(
-                    "title:N",
-                    axis=alt.Axis(orient="right", title=" ", labels=True),
-                    sort=list(range(source.shape[0])),
-                ),
-                x=alt.X("emission_change:Q", axis=alt.Axis(title=xlabel)),
-                tooltip=["title", "emission change"],
-                href="link:N",
-                color=alt.condition(
-                    alt.datum.emission_change > 0,
-                    alt.value("palevioletred"),  # The positive color
-                    alt.value("palegreen"),  # The negative color
-                ),
-            )
-            .properties(width=200, height=500, title="Similar recipes")
-            .configure_axis(
-                labelFontSize=16,
-                titleFontSize=16,
-                labelFontWeight="normal",
-                titleFontWeight="normal",
-                labelColor="gray",
-                titleColor="gray",
-            )
-            .configure_title(fontSize=22, fontWeight="normal", anchor="start")
-            .interactive()
+        changes = (
+            np.ceil(100 * (column(search_results, voi) - reference_recipe[voi])) / 100
         )
+        values = [
+            {
+                "title": row.title,
+                "url": row.url,
+                "emission change": float(change),
+                "emission_change": float(change),
+            }
+            for row, change in zip(search_results, changes)
+        ]
+
+        # splice data into the prebuilt bar chart
+        skeleton = compare_chart_skeleton(base_url, sort_by, voi, xlabel)
+        return add_datasets(skeleton, {COMPARE_DATASET: values})
 
     else:
         # TODO option for plotting absolute emission scores
         pass
 
-    return bars.to_json()
+
+def compare_chart_skeleton(base_url, sort_by, voi, xlabel):
+    """
+    DESCRIPTION:
+        Vega-lite spec of the bar chart of bar_compare_emissions without
+        its data, which is referenced by name (COMPARE_DATASET). Built
+        and validated with Altair only once per combination of inputs
+        (only the data differs between requests), see compare_skeletons.
+    INPUT:
+        base_url (String): Base url of the recipe search website
+        sort_by (String): Url GET query by which to sort recipes
+        voi (String): Variable of interest, "emissions" or "emissions_log10"
+        xlabel (String): x-axis title
+    OUTPUT:
+        String: JSON spec (without "datasets")
+    """
+    key = (base_url, sort_by, voi, xlabel)
+    skeleton = compare_skeletons.get(key)
+    if skeleton is not None:
+        return skeleton
+    bars = (
+        alt.Chart(alt.NamedData(COMPARE_DATASET))
+        .transform_calculate(link=base_url + alt.datum.url + "?sort_by=" + sort_by)
+        .mark_bar()
+        .encode(
+            y=alt.Y(
+                "title:N",
+                axis=alt.Axis(orient="right", title=" ", labels=True),
+                sort=None,  # keep the order of the data
+            ),
+            x=alt.X("emission_change:Q", axis=alt.Axis(title=xlabel)),
+            tooltip=["title:N", "emission change:Q"],
+            href="link:N",
+            color=alt.condition(
+                alt.datum.emission_change > 0,
+                alt.value("palevioletred"),  # The positive color
+                alt.value("palegreen"),  # The negative color
+            ),
+        )
+        .properties(width=200, height=500, title="Similar recipes")
+        .configure_axis(
+            labelFontSize=16,
+            titleFontSize=16,
+            labelFontWeight="normal",
+            titleFontWeight="normal",
+            labelColor="gray",
+            titleColor="gray",
+        )
+        .configure_title(fontSize=22, fontWeight="normal", anchor="start")
+        .interactive()
+    )
+    skeleton = json.dumps(bars.to_dict())
+    compare_skeletons.set(key, skeleton)
+    return skeleton
+
+
+def add_datasets(skeleton, datasets):
+    """
+    DESCRIPTION:
+        Adds data to a serialized vega-lite spec without parsing it again.
+    INPUT:
+        skeleton (String): JSON spec (object without "datasets")
+        datasets (dict): Dataset name -> list of records (dicts)
+    OUTPUT:
+        String: JSON spec
+    """
+    return '{}, "datasets": {}}}'.format(skeleton.rstrip()[:-1], json.dumps(datasets))
 
 
 def histogram_emissions(
-    data, title, base_url="https://sustainable-recipe-recommender.herokuapp.com/search/"
+    background,
+    data,
+    title,
+    base_url="https://sustainable-recipe-recommender.herokuapp.com/search/",
 ):
     """
     DESCRIPTION:
         Creates a histogram of emission scores of a list of reference
         recipes, with the distribution of all emission scores as the
-        background.
+        background. Both are binned beforehand, so the chart only holds
+        one record per bin (not per recipe).
 
     INPUT:
-        data (pandas.DataFrame): With columns
-            Emissions (Float): log10-scaled emission scores
+        background (pandas.DataFrame): Precomputed histogram of all
+            emission scores (see Sql_queries.query_emissions_histogram)
+            with columns
+            bin_start (Float): Lower edge of bin (log10-scaled)
+            bin_end (Float): Upper edge of bin (log10-scaled)
+            count (Integer): Number of recipes in bin
+        data (list of dicts): Precomputed histogram of the reference
+            recipes (see Sql_queries.query_cookbook_histogram) with keys
+            bin_start, bin_end and count as above, plus
+            titles (String): Titles of recipes in bin (for the tooltip)
             url (String): recipe url (e.g. "pineapple-shrimp-noodles")
-            Title (String): recipe title (e.g. "Pineapple shrimp noodles")
-            reference (boolean): True for all reference recipes to highlight
         title (String): Figure title
         base_url (String): Base url of the recipe search website
 
     OUTPUT:
         Altair json object
     """
-    alt.data_transformers.disable_max_rows()  # TODO find a better solution
-
     col = "#1f77b4"  # try different color?
+    xlabel = "log10(Emissions (kg CO2 eq.))"
+    xscale = alt.Scale(type="linear", domain=EMISSIONS_DOMAIN)
 
-    # background chart (histogram of all emissions)
-    source = data
+    # background chart (precomputed histogram of all emissions)
+    source = background
     bg_chart = (
         alt.Chart(source)
         .mark_area(
             color=col,
             opacity=0.3,
+            interpolate="step-after",
         )
         .encode(
-            alt.X(
-                "log10(Emissions):Q",
-                axis=alt.Axis(title="log10(Emissions (kg CO2 eq.))"),
-                scale=alt.Scale(type="linear", domain=(-1.0, 2.0)),
-                bin=alt.BinParams(maxbins=300),
-            ),
-            alt.Y(
-                "count(*):Q", axis=alt.Axis(title="Number of recipes (all)"), stack=None
-            ),
+            alt.X("bin_start:Q", axis=alt.Axis(title=xlabel), scale=xscale),
+            alt.Y("count:Q", axis=alt.Axis(title="Number of recipes (all)")),
         )
         .properties(width=800, height=300, title=title)
     )
 
-    # foreground chart - e.g. cookbook recipes
-    source = data.loc[data["reference"], :]
+    # foreground chart - e.g. cookbook recipes (precomputed histogram)
+    source = alt.Data(values=data)
     fg_chart = (
         alt.Chart(source)
         .transform_calculate(link=base_url + alt.datum.url + "?sort_by=" + "Similarity")
         .mark_bar(color=col)
         .encode(
-            x=alt.X(
-                "log10(Emissions):Q",
-                scale=alt.Scale(type="linear", domain=(-1.0, 2.0)),
-                bin=alt.BinParams(maxbins=200),
-            ),
-            y=alt.Y("count(*):Q", axis=None, stack=None),
-            tooltip=["Title", "Emissions"],
+            x=alt.X("bin_start:Q", axis=alt.Axis(title=xlabel), scale=xscale),
+            x2="bin_end:Q",
+            y=alt.Y("count:Q", axis=None),
+            tooltip=[
+                alt.Tooltip("titles:N", title="Recipes"),
+                alt.Tooltip("count:Q", title="Number of recipes"),
+            ],
             href="link:N",
         )
         .properties(width=800, height=300)
@@ -2,53 +2,136 @@
 from flask import redirect, url_for, flash
 from flask_login import current_user
 
+# Recommendation models
+from application import rating_model, recommender, similarity_store
+from application.recipe_rows import RecipeRow, select, sort_rows
+from collections import Counter
+
 
 def sort_search_results(results, sort_by):
     """
     DESCRIPTION:
-        Sorts results dataframe by column specified in sort_by
+        Sorts results by the field specified in sort_by
     INPUT:
-        results (DataFrame): Subset of recipes DataFrame containing
-            similar recipes to reference recipe to be diplayed
+        results (list of RecipeRow): Similar recipes to reference recipe
+            to be diplayed
 
-        sort_by (string): What metric to sort rows by. Can be one of
-            ['similarity', 'sustainability', 'rating'], or a user
-            specified column name. default = 'similarity'
+        sort_by (string): What metric to sort rows by. One of
+            ['similarity', 'sustainability', 'rating'] (case insensitive),
+            anything else (e.g. a url tampered with manually) sorts by
+            similarity.
     OUTPUT:
-        Updated results dataframe sorted as requested.
+        Updated results list sorted as requested.
     """
-    # When sort_by is empty, simply return input dataframe
-    # This can happen when the URL is tempered with manually
-    if not sort_by:
-        sort_by = "similarity"
-
-    # Otherwise try to sort
-    sort_by = sort_by.lower()
-    if sort_by == "similarity":
-        return results
+    sort_by = (sort_by or "similarity").lower()
     if sort_by == "sustainability":
-        return results.sort_values(by="emissions", ascending=True)
+        return sort_rows(results, "emissions")
     if sort_by == "rating":
-        return results.sort_values(by="rating", ascending=False)
-    else:
-        return results.sort_values(by=sort_by, ascending=False)
+        return sort_rows(results, "rating", descending=True)
+    return results
 
 
-def predict_user_ratings(df):
+def select_page(results, sort_by, page, Np, ordering=None):
+    """
+    DESCRIPTION:
+        Sorts all search results (not only those of one page) and selects
+        the recipes to show on the given page.
+    INPUT:
+        results (list of RecipeRow): Similar recipes to reference recipe,
+            ordered by similarity (without the reference recipe itself)
+        sort_by (string): see sort_search_results
+        page (Integer): Page number (starting at 0)
+        Np (Integer): Number of recipes per page
+        ordering (np.array): Precomputed row order of results for sort_by,
+            e.g. from the similarity store (default=None). If given, no
+            sorting is done at all.
+    OUTPUT:
+        List of (at most) Np rows
     """
-    TODO: Implement algo. Placeholder fills in 5 for all ratings
+    page_slice = slice(page * Np, (page + 1) * Np)
+    if ordering is not None and len(ordering) == len(results):
+        return select(results, ordering[page_slice])
+    return sort_search_results(results, sort_by)[page_slice]
 
+
+def add_user_overlay(sq, results):
+    """
     DESCRIPTION:
-        Takes DataFrame with output from Sql_queries.query_cookbook()
-        and predicts missing user ratings.
+        Adds the current user's ratings and bookmarks to results.
     INPUT:
-        df (pd.DataFrame)
+        sq: sql_queries object (see sql_queries.py)
+        results (list of RecipeRow): Recipes with field "recipesID"
     OUTPUT:
-        user_ratings (List): Updated ratings column converted to percentages
+        results (list of RecipeRow) with added fields "user_rating" (3 if
+            the user has not rated a recipe) and "bookmarked" (Boolean)
     """
-    df["user_rating"].fillna(value=5, inplace=True)
-    user_ratings = [round(v / 5 * 100) for v in df["user_rating"].values]
-    return user_ratings
+    overlay = sq.query_user_overlay(
+        current_user.userID, [row.recipesID for row in results]
+    )
+    for row in results:
+        user_rating, bookmarked = overlay.get(row.recipesID, (None, None))
+        row.user_rating = 3 if user_rating is None else user_rating
+        row.bookmarked = bool(bookmarked)
+    return results
+
+
+def predict_user_ratings(sq, results):
+    """
+    DESCRIPTION:
+        Predicts the current user's ratings of all recipes in results with
+        the rating model (see rating_model.py), in one matrix-vector
+        product.
+    INPUT:
+        sq: sql_queries object (see sql_queries.py)
+        results (list of RecipeRow): Recipes with field "recipesID"
+    OUTPUT:
+        results (list of RecipeRow) with added field "predicted_rating"
+            (between 1 and 5, NaN when no rating model is available)
+    """
+    likes = sq.query_user_likes(current_user.userID)
+    predictions = rating_model.predict(
+        [row.recipesID for row in results],
+        [like[0] for like in likes],
+        [like[1] for like in likes],
+    )
+    if predictions is None:
+        predictions = [float("nan")] * len(results)
+    for row, prediction in zip(results, predictions):
+        row.predicted_rating = float(prediction)
+    return results
+
+
+def get_recommendations(sq, userID, N=5):
+    """
+    DESCRIPTION:
+        Recommends recipes the user has not bookmarked or rated yet, based
+        on the recipes they have (see recommender.py).
+    INPUT:
+        sq: sql_queries object (see sql_queries.py)
+        userID (Integer): userID from users table
+        N (Integer): Maximum number of recommendations
+    OUTPUT:
+        recommendations (list of RecipeRow) with fields "recipesID",
+            "title" and "url", best recommendation first. Empty if there is
+            nothing to recommend (e.g. no model available or empty cookbook).
+    """
+    likes = sq.query_user_likes(userID)
+    recipesIDs, _ = recommender.recommend(
+        [like[0] for like in likes],
+        [like[1] for like in likes],
+        N=N,
+        similarity_store=similarity_store,
+    )
+    if len(recipesIDs) == 0:
+        return []
+    recipes = {
+        row[0]: row for row in sq.query_similar_recipes(tuple(recipesIDs.tolist()))
+    }
+    return [
+        RecipeRow(recipesID=i, title=recipes[i].title, url=recipes[i].url)
+        for i in recipesIDs.tolist()
+        if i in recipes
+    ]
 
 
 def add_or_remove_bookmark(sq, bookmark):
@@ -68,49 +151,100 @@ def add_or_remove_bookmark(sq, bookmark):
         if current_user.is_anonymous:
             flash("You need to sign in to be able to bookmark recipes.")
             return redirect(url_for("auth.signin"))
-        if sq.is_in_cookbook(current_user.userID, bookmark):
-            sq.remove_from_cookbook(current_user.userID, bookmark)
-        else:
-            sq.add_to_cookbook(current_user.userID, bookmark)
+        toggle_bookmark(sq, current_user.userID, bookmark)
+
+
+def toggle_bookmark(sq, userID, url):
+    """
+    DESCRIPTION:
+        Removes a recipe from the user's cookbook if it is in there,
+        otherwise adds it.
+    INPUT:
+        sq: sql_queries object (see sql_queries.py)
+        userID (Integer): userID from users table
+        url (String): recipe url (e.g. shrimp-noodle-bowl-1294)
+    OUTPUT:
+        Boolean: True if the recipe is bookmarked now, False if it was
+            removed, None if the url is invalid
+    """
+    removed = sq.remove_from_cookbook(userID, url)
+    if removed != "Recipe was not bookmarked to begin with":
+        return False
+    added = sq.add_to_cookbook(userID, url)
+    if added == "UserID or recipe url invalid":
+        return None
+    return True
+
+
+def parse_batch_operations(payload, max_operations):
+    """
+    DESCRIPTION:
+        Validates the JSON body of a batch rating / bookmark request, e.g.
+        {"operations": [{"url": "shrimp-noodle-bowl-1294", "rating": 5},
+                        {"url": "chicken-curry-281", "bookmarked": false}]}
+    INPUT:
+        payload: Parsed JSON body (request.get_json())
+        max_operations (Integer): Maximum number of operations
+    OUTPUT:
+        operations (list of tuples): (url, rating, bookmarked) tuples,
+            rating and bookmarked are None if not given
+    RAISES:
+        ValueError with a message for the client if the payload is invalid
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get("operations"), list):
+        raise ValueError("Expected an object with a list of operations")
+    if len(payload["operations"]) > max_operations:
+        raise ValueError("At most {} operations per request".format(max_operations))
+    operations = []
+    for i, op in enumerate(payload["operations"]):
+        if not isinstance(op, dict) or not isinstance(op.get("url"), str):
+            raise ValueError("Operation {}: url missing".format(i))
+        rating = op.get("rating")
+        bookmarked = op.get("bookmarked")
+        if rating is not None and (
+            isinstance(rating, bool) or rating not in (1, 2, 3, 4, 5)
+        ):
+            raise ValueError("Operation {}: rating must be 1 to 5".format(i))
+        if bookmarked is not None and not isinstance(bookmarked, bool):
+            raise ValueError("Operation {}: bookmarked must be a boolean".format(i))
+        if rating is None and bookmarked is None:
+            raise ValueError("Operation {}: nothing to change".format(i))
+        operations.append((op["url"], rating, bookmarked))
+    return operations
 
 
-def get_favorite_recipes(df, N):
+def get_favorite_recipes(cookbook, N):
     """
     DESCRIPTION:
         retrieves the N most favorite recipes. For now favorite
         recipes are those with a "thumbs up", i.e. rating equal to 5.
     INPUT:
-        df (pandas.DataFrame): "cookbook" dataframe (see profile in routes.py)
-        N (Integer): Maximum number of titles to return
+        cookbook (list of RecipeRow): see Sql_queries.query_cookbook
+        N (Integer): Maximum number of recipes to return
     OUTPUT:
-        df_fav (pandas.DataFrame) with columns "title", "user_rating" and
-             "url", sorted by user_rating (descending), and clipped at row N.
+        favorites (list of RecipeRow): Liked recipes in cookbook order,
+            clipped at N
     """
-    return df.sort_values(by="user_rating", ascending=False).loc[
-        df["user_rating"] == 5, ["title", "user_rating", "url"]
-    ][0:N]
+    return [row for row in cookbook if row.user_rating == 5][0:N]
 
 
-def get_favorite_categories(df, N):
+def get_favorite_categories(cookbook, N):
     """
     DESCRIPTION:
-        takes a dataframe with cookbook recipes as input and return a list
-        of two-element tuples with category and number of occurrences. Over
-        the whole categories column.
+        takes cookbook recipes as input and counts the occurrences of
+        every category over all recipes (see also
+        Sql_queries.query_cookbook_summary).
     INPUT:
-        df (pandas.DataFrame): "cookbook" dataframe (see profile in routes.py)
+        cookbook (list of RecipeRow): see Sql_queries.query_cookbook
         N (Integer): Maximum number of categories to return
     OUTPUT:
-        List of tuples (e.g. [('dinner', 18), ('vegetarian', 10)])
-    """
-    category_list = []
-    for item in df["categories"]:
-        category_list.extend(item.split(";"))
-    count_table = [(el, category_list.count(el)) for el in set(category_list)]
-    count_table.sort(reverse=True, key=lambda x: x[1])
-    labels = [item[0] for item in count_table]
-    counts = [item[1] for item in count_table]
-    return labels[0:N], counts[0:N]
+        labels (List): N most frequent categories (e.g. ['dinner', 'vegan'])
+        counts (List): Corresponding number of occurrences (e.g. [18, 10])
+    """
+    counts = Counter(
+        category for row in cookbook for category in row.categories.split(";")
+    ).most_common(N)
+    return [c[0] for c in counts], [c[1] for c in counts]
 
 
 # eof
@@ -2,7 +2,7 @@
 
 # Flask modules and forms
 from flask import render_template, request, redirect, url_for
-from flask import session, flash
+from flask import session, flash, jsonify, abort, current_app
 from flask_login import login_required, current_user
 
 # User made modules
@@ -15,16 +15,32 @@ from application.auth.forms import (
     VerifyEmailRequestForm,
 )
 from application.sql_queries import Sql_queries
+from application.cache import LRUCache
 from application.auth.email import send_verification_email
 
 # Database
-from application import db
+from application import db, similarity_store, recipe_catalogue, metrics
+from application import conditional_get, page_cache
 from application.main import bp
 
 
 # Use only one Sql_queries instance
 sq = Sql_queries(db.session)
 
+# Search results, the trigram index and histograms hold recipe data, rebuild
+# them after catalogue updates (histograms of older versions are never used
+# again)
+recipe_catalogue.on_reload(sq.search_cache.clear)
+recipe_catalogue.on_reload(sq.reset_trigram_index)
+recipe_catalogue.on_reload(sq.emissions_histograms.clear)
+metrics.observe_cache(sq.search_cache, "content_based_search")
+
+# Bar charts of compare_recipes by (reference recipe, page, sort_by)
+compare_charts = LRUCache(maxsize=1024, ttl=3600)
+recipe_catalogue.on_reload(compare_charts.clear)
+metrics.observe_cache(compare_charts, "compare_charts")
+metrics.observe_cache(page_cache, "pages")
+
 
 @bp.route("/")
 @bp.route("/home", methods=["GET", "POST"])
@@ -43,38 +59,44 @@ def home():
 def search_results(search_term):
 
     session["search_query"] = search_term
-    like_form = EmptyForm()
-    search_form = SearchForm()
 
     # exact match? Suggest alternatives!
     if sq.exact_recipe_match(search_term):
         return redirect(url_for("main.compare_recipes", search_term=search_term))
+
+    # Unchanged since the last visit (anonymous users only)
+    etag = conditional_get.page_etag(recipe_catalogue.version)
+    if conditional_get.matches(etag):
+        return conditional_get.not_modified(etag)
+
+    # Rendered before for another anonymous visitor?
+    page_key = page_cache.key(recipe_catalogue.version)
+    html = page_cache.get(page_key)
+    if html is None:
+        html = render_search_results(search_term)
+        page_cache.set(page_key, html)
+    if html is not None:
+        return conditional_get.with_etag(html, recipe_catalogue.version)
+
+
+def render_search_results(search_term):
+    """Renders the fuzzy search results page (None without results)"""
+    like_form = EmptyForm()
+    search_form = SearchForm()
+
     # fuzzy search
     results = sq.search_recipes(search_term)
 
     if len(results) > 0:
 
-        # Retrieve or predict user ratings
-        # TODO: Currently user_ratings isn't used at all
-        # - put in helper fun, used in compare_recipes and search_results
+        # Include user ratings, bookmarks and predicted ratings
         if current_user.is_authenticated:
-            urls = list(results["url"].values)
-
-            # Include user ratings in results
-            user_results = sq.query_user_ratings(current_user.userID, urls)
-            results = results.merge(
-                user_results[["user_rating", "recipesID"]], how="left", on="recipesID"
-            )
-            results["user_rating"].fillna(3, inplace=True)
-
-            # Include bookmarks in results
-            df_bookmarks = sq.query_bookmarks(current_user.userID, urls)
-            results = results.merge(df_bookmarks, how="left", on="recipesID")
-            results["bookmarked"].fillna(False, inplace=True)
+            results = hf.add_user_overlay(sq, results)
+            results = hf.predict_user_ratings(sq, results)
 
         # ratings and emissions need to be passed separately for JS
-        ratings = list(results["perc_rating"].values)
-        emissions = [v for v in results["perc_sustainability"].values]
+        ratings = [row.perc_rating for row in results]
+        emissions = [row.perc_sustainability for row in results]
 
         return render_template(
             "explore.html",
@@ -93,6 +115,25 @@ def compare_recipes(search_term, Np=20):
     if sq.exact_recipe_match(search_term) is False:
         return redirect(url_for("main.search_results", search_term=search_term))
 
+    # Unchanged since the last visit (anonymous users only, the page links
+    # back to the last search)
+    versions = (recipe_catalogue.version, session.get("search_query"))
+    etag = conditional_get.page_etag(*versions)
+    if conditional_get.matches(etag):
+        return conditional_get.not_modified(etag)
+
+    # Rendered before for another anonymous visitor?
+    page_key = page_cache.key(*versions)
+    html = page_cache.get(page_key)
+    if html is None:
+        html = render_compare_recipes(search_term, Np)
+        page_cache.set(page_key, html)
+    return conditional_get.with_etag(html, *versions)
+
+
+def render_compare_recipes(search_term, Np):
+    """Renders the page of a recipe and its Np most similar recipes"""
+
     # Forms
     search_form = SearchForm()
     like_form = EmptyForm()
@@ -109,41 +150,33 @@ def compare_recipes(search_term, Np=20):
     # Get top 199 most similar recipes
     results = sq.content_based_search(search_term)
 
-    # Retrieve bookmarks and likes
+    # Include user ratings, bookmarks and predicted ratings
     if current_user.is_authenticated:
-        urls = list(results["url"].values)
-
-        # Include user ratings in results
-        user_results = sq.query_user_ratings(current_user.userID, urls)
-        results = results.merge(
-            user_results[["user_rating", "recipesID"]], how="left", on="recipesID"
-        )
-        results["user_rating"].fillna(3, inplace=True)
-
-        # Include bookmarks in results
-        df_bookmarks = sq.query_bookmarks(current_user.userID, urls)
-        results = results.merge(df_bookmarks, how="left", on="recipesID")
-        results["bookmarked"].fillna(False, inplace=True)
+        results = hf.add_user_overlay(sq, results)
+        results = hf.predict_user_ratings(sq, results)
 
     # Disentangle reference recipe and similar recipes
-    ref_recipe = results.iloc[0]
-    results = results.iloc[1::, :]
+    ref_recipe = results[0]
+    results = results[1:]
 
-    # Select only the top Np recipes for one page
-    results = results[(0 + page * Np) : ((page + 1) * Np)]
-
-    # Sort by similarity, sustainability or rating
-    results = hf.sort_search_results(results, sort_by)
+    # Sort by similarity, sustainability or rating and select only the
+    # top Np recipes for one page
+    ordering = similarity_store.ordering(int(ref_recipe["recipesID"]), sort_by)
+    results = hf.select_page(results, sort_by, page, Np, ordering=ordering)
 
     # Pass ratings & emissions jointly for ref recipe and results
-    ratings = list(results["perc_rating"].values)
+    ratings = [row.perc_rating for row in results]
     ratings = [ref_recipe["perc_rating"]] + ratings
-    emissions = [v for v in results["perc_sustainability"].values]
+    emissions = [row.perc_sustainability for row in results]
     emissions = [ref_recipe["perc_sustainability"]] + emissions
-    similarity = [round(v * 100) for v in results["similarity"].values]
+    similarity = [round(row.similarity * 100) for row in results]
 
     # make figures
-    bp = ap.bar_compare_emissions(ref_recipe, results, sort_by=sort_by)
+    chart_key = (ref_recipe["recipesID"], page, sort_by)
+    bp = compare_charts.get(chart_key)
+    if bp is None:
+        bp = ap.bar_compare_emissions(ref_recipe, results, sort_by=sort_by)
+        compare_charts.set(chart_key, bp)
 
     return render_template(
         "compare_recipes.html",
@@ -156,6 +189,7 @@ def compare_recipes(search_term, Np=20):
         search_form=search_form,
         search_term=search_term,
         page=page,
+        sort_by=sort_by,
         bp=bp,
     )
 
@@ -171,59 +205,58 @@ def cookbook(Np=20):
     like_form = EmptyForm()
     bookmark_form = EmptyForm()
 
-    # Pagination
+    # Pagination (page number, or recipesID of the last recipe on the
+    # previous page when clicking "Next")
     page = request.args.get("page")
     page = int(page) if page else 0
+    after = request.args.get("after")
+    after = int(after) if after else None
 
-    # TODO cookbook search
-
-    # Get bookmarked recipes
-    cookbook = sq.query_cookbook(current_user.userID)
-
-    # Descriptive statistics to show to user
-    Nrecipes = cookbook.shape[0]
-    Nliked = sum(cookbook["user_rating"] == 5)
-    Ndisliked = sum(cookbook["user_rating"] == 1)
-    fav_recipes = hf.get_favorite_recipes(cookbook, 3)
-    fav_categ, fav_categ_cnt = hf.get_favorite_categories(cookbook, 7)
-    mean_cookbook_emissions = round(
-        sum(cookbook["emissions"]) / (cookbook.shape[0] + 0.00001), 2
-    )
-    recommendations = [""]  # TODO write helper func
-
-    # Prepare figure data
-    df_hist = sq.query_all_recipe_emissions()
-    df_hist["reference"] = df_hist.url.isin(cookbook["url"])
-    df_hist.rename(
-        columns={
-            "emissions_log10": "log10(Emissions)",
-            "emissions": "Emissions",
-            "title": "Title",
-        },
-        inplace=True,
-    )
-
-    # Sort by similarity, sustainability or rating
+    # Sort by sustainability, user rating or average rating
     sort_by = request.args.get("sort_by")
     if not sort_by:
         sort_by = "Sustainability"
-    cookbook = hf.sort_search_results(cookbook, sort_by)
-    Npages = cookbook.shape[0] // Np + 1
 
-    # Select only the top Np recipes for one page
-    cookbook = cookbook[(0 + page * Np) : ((page + 1) * Np)]
+    # TODO cookbook search
+
+    # Get one page of bookmarked recipes
+    cookbook = sq.query_cookbook(
+        current_user.userID,
+        sort_by=sort_by,
+        limit=Np,
+        offset=0 if after is not None else page * Np,
+        after=after,
+    )
+
+    # Descriptive statistics to show to user
+    summary = sq.query_cookbook_summary(current_user.userID, 3, 7)
+    Nrecipes = summary["Nrecipes"]
+    Nliked = summary["Nliked"]
+    Ndisliked = summary["Ndisliked"]
+    fav_recipes = summary["favorites"]
+    fav_categ = [categ for categ, _ in summary["categories"]]
+    fav_categ_cnt = [cnt for _, cnt in summary["categories"]]
+    mean_cookbook_emissions = round(summary["mean_emissions"], 2)
+    recommendations = hf.get_recommendations(sq, current_user.userID, 5)
+    Npages = Nrecipes // Np + 1
+    last_recipe = cookbook[-1].recipesID if cookbook else None
+
+    # Prepare figure data (all recipes are only needed as a histogram,
+    # binned in the database)
+    cookbook_histogram = sq.query_cookbook_histogram(current_user.userID)
 
     # TODO create separate route for personalized recommendations, see
     # https://github.com/sbuergers/sustainable-recipe-recommender-website/issues/3#issuecomment-717503064
-    # user_ratings = hf.predict_user_ratings(cookbook)
 
     # Variables to sort by
-    avg_ratings = list(cookbook["perc_rating"].values)
-    emissions = [v for v in cookbook["perc_sustainability"].values]
+    avg_ratings = [row.perc_rating for row in cookbook]
+    emissions = [row.perc_sustainability for row in cookbook]
 
     # Make figures
     hist_title = "Emissions distribution of cookbook recipes"
-    hist_emissions = ap.histogram_emissions(df_hist, hist_title)
+    hist_emissions = ap.histogram_emissions(
+        sq.query_emissions_histogram(), cookbook_histogram, hist_title
+    )
 
     return render_template(
         "cookbook.html",
@@ -243,6 +276,8 @@ def cookbook(Np=20):
         bookmark_form=bookmark_form,
         page=page,
         Npages=Npages,
+        sort_by=sort_by,
+        last_recipe=last_recipe,
         hist_emissions=hist_emissions,
     )
 
@@ -380,4 +415,43 @@ def unlike_recipe(recipe_url):
     return redirect(url_for("main.home"))
 
 
+# JSON variants of the like / dislike / unlike and bookmark actions above,
+# used by static/recipe_actions.js to update recipe cards in place
+@bp.route("/api/<action>/<recipe_url>", methods=["POST"])
+@login_required
+def api_rate_recipe(action, recipe_url):
+    ratings = {"like": 5, "dislike": 1, "unlike": 3}
+    if action not in ratings:
+        abort(404)
+    if not sq.rate_recipe(current_user.userID, recipe_url, ratings[action]):
+        abort(404)
+    return jsonify(url=recipe_url, user_rating=ratings[action])
+
+
+@bp.route("/api/bookmark/<recipe_url>", methods=["POST"])
+@login_required
+def api_bookmark(recipe_url):
+    bookmarked = hf.toggle_bookmark(sq, current_user.userID, recipe_url)
+    if bookmarked is None:
+        abort(404)
+    return jsonify(url=recipe_url, bookmarked=bookmarked)
+
+
+@bp.route("/api/batch", methods=["POST"])
+@login_required
+def api_batch():
+    """
+    Many ratings and bookmark changes in one request and one DB statement
+    (e.g. mobile clients or imports, see hf.parse_batch_operations)
+    """
+    try:
+        operations = hf.parse_batch_operations(
+            request.get_json(silent=True),
+            current_app.config["BATCH_MAX_OPERATIONS"],
+        )
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(sq.apply_likes_batch(current_user.userID, operations))
+
+
 # eof
@@ -0,0 +1,183 @@
+""" Prometheus metrics """
+import hmac
+import ipaddress
+import os
+import time
+from flask import Response, abort, current_app, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy.pool import QueuePool
+
+
+# Set by the deployment (e.g. in the gunicorn environment) before the app
+# is imported, then every worker writes its metrics to files in this
+# directory and /metrics aggregates them
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+POOL_WAIT_BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by endpoint",
+    ["endpoint", "method"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS = Counter(
+    "http_requests_total",
+    "Finished requests by endpoint and status code",
+    ["endpoint", "method", "status"],
+)
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Requests currently being handled",
+    ["endpoint"],
+    multiprocess_mode="livesum",
+)
+POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time waited for a connection from the DB connection pool",
+    buckets=POOL_WAIT_BUCKETS,
+)
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total",
+    "Cache lookups by cache and result (hit or miss)",
+    ["cache", "result"],
+)
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that records how long every checkout waited for a
+    connection (including opening new connections), see POOL_WAIT.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - start)
+
+
+class Metrics:
+    """
+    Request latency histograms and counters per endpoint (e.g.
+    main.compare_recipes), in-flight requests, DB pool checkout wait
+    times and cache lookups, served in the Prometheus text format at
+    METRICS_PATH.
+
+    With several worker processes (gunicorn), the environment variable
+    PROMETHEUS_MULTIPROC_DIR must point to a directory shared by all
+    workers (gunicorn.conf.py sets it); /metrics then reports the sum over
+    all workers, no matter which worker serves it.
+
+    /metrics is only served to requests with the bearer token
+    METRICS_TOKEN ("Authorization: Bearer <token>"), or without a token
+    configured, to clients in METRICS_ALLOWED_NETWORKS (e.g. a scraper
+    on the same machine).
+
+    Enabled with METRICS.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get("METRICS"):
+            return
+
+        # Time connection checkouts (before the engine is created)
+        options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+        options.setdefault("poolclass", TimedQueuePool)
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.teardown_request(self.teardown_request)
+        app.add_url_rule(
+            app.config.get("METRICS_PATH", "/metrics"), "metrics", self.export
+        )
+
+    @staticmethod
+    def endpoint():
+        # Unmatched urls share one label (keeps the number of series small)
+        return request.endpoint or "none"
+
+    def start_request(self):
+        request.environ["metrics.start"] = time.perf_counter()
+        IN_PROGRESS.labels(self.endpoint()).inc()
+
+    def finish_request(self, response):
+        request.environ["metrics.status"] = response.status_code
+        return response
+
+    def teardown_request(self, exception=None):
+        """Records the request (also if it failed with an exception)"""
+        start = request.environ.pop("metrics.start", None)
+        if start is None:
+            return
+        endpoint = self.endpoint()
+        status = request.environ.get("metrics.status", 500)
+        IN_PROGRESS.labels(endpoint).dec()
+        REQUEST_LATENCY.labels(endpoint, request.method).observe(
+            time.perf_counter() - start
+        )
+        REQUESTS.labels(endpoint, request.method, str(status)).inc()
+
+    @staticmethod
+    def observe_cache(cache, name):
+        """
+        DESCRIPTION:
+            Counts hits and misses of an LRUCache (hit ratio e.g.
+            rate(cache_lookups_total{result="hit"}[5m]) divided by
+            rate(cache_lookups_total[5m])).
+        INPUT:
+            cache (LRUCache)
+            name (String): Value of the "cache" label
+        OUTPUT:
+            None
+        """
+        hits = CACHE_LOOKUPS.labels(name, "hit")
+        misses = CACHE_LOOKUPS.labels(name, "miss")
+        cache.on_lookup(lambda hit: (hits if hit else misses).inc())
+
+    @staticmethod
+    def authorized():
+        """True if the current request may read the metrics"""
+        token = current_app.config.get("METRICS_TOKEN")
+        if token:
+            return hmac.compare_digest(
+                request.headers.get("Authorization", ""), "Bearer " + token
+            )
+        try:
+            address = ipaddress.ip_address(request.remote_addr or "")
+        except ValueError:
+            return False
+        return any(
+            address in ipaddress.ip_network(network)
+            for network in current_app.config.get("METRICS_ALLOWED_NETWORKS", [])
+        )
+
+    def export(self):
+        """Metrics of this process, or of all workers in multiprocess mode"""
+        if not self.authorized():
+            abort(403)
+        if os.environ.get(MULTIPROC_DIR_ENV):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+# eof
@@ -77,6 +77,23 @@ class Consent(db.Model):
         return "<Consent {}>".format(self.consentID)
 
 
+class UserCategory(db.Model):
+    """Number of cookbook recipes per user and category (see sql_queries.py)"""
+
+    __table__ = db.Table(
+        "user_categories",
+        db.Model.metadata,
+        db.Column("userID", db.Integer, primary_key=True),
+        db.Column("category", db.Text, primary_key=True),
+        db.Column("count", db.Integer, nullable=False),
+        db.Index("ix_user_categories_count", "userID", "count"),
+        extend_existing=True,
+    )
+
+    def __repr__(self):
+        return "<UserCategory {} {}>".format(self.userID, self.category)
+
+
 class ContentSimilarity(db.Model):
     __table__ = db.Model.metadata.tables["content_similarity200"]
 
@@ -0,0 +1,231 @@
+""" Per-request SQL statement counts and timings """
+import collections
+import re
+import sys
+import time
+from flask import _request_ctx_stack, current_app, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Statements are tagged with the Sql_queries method that issued them
+SQL_QUERIES_MODULE = "application.sql_queries"
+
+# Literals and bind parameters are replaced by "?" to get a statement's shape
+_PARAMETERS = re.compile(r"%\([^)]*\)s|%s|'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+
+Statement = collections.namedtuple("Statement", ["method", "shape", "duration", "rows"])
+
+
+def statement_shape(statement):
+    """
+    DESCRIPTION:
+        Normalizes a SQL statement, so that statements that only differ in
+        their parameters (e.g. the same query for another recipe) are equal.
+    INPUT:
+        statement (String): SQL statement as sent to the database
+    OUTPUT:
+        String, e.g. "SELECT * FROM likes WHERE "userID" = ? AND ... IN (?)"
+    """
+    shape = _PARAMETERS.sub("?", statement)
+    shape = _LISTS.sub("(?)", shape)
+    return _SPACE.sub(" ", shape).strip()
+
+
+def calling_method():
+    """Name of the innermost Sql_queries method on the stack (or None)"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_globals.get("__name__") == SQL_QUERIES_MODULE:
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return None
+
+
+class RequestStats:
+    """
+    SQL statements issued while handling one request.
+    """
+
+    def __init__(self, route, repeat_threshold=None):
+        self.route = route
+        self.repeat_threshold = repeat_threshold
+        self.statements = []
+        self.shape_counts = collections.Counter()
+
+    def add(self, method, shape, duration, rows):
+        """
+        DESCRIPTION:
+            Records a statement.
+        INPUT:
+            method (String): Sql_queries method (None for other statements)
+            shape (String): see statement_shape
+            duration (Float): Seconds
+            rows (Integer): Rows fetched (or affected)
+        OUTPUT:
+            Boolean: True if the statement's shape was repeated more than
+                repeat_threshold times for the first time (likely N+1
+                queries issued in a loop)
+        """
+        self.statements.append(Statement(method, shape, duration, rows))
+        self.shape_counts[shape] += 1
+        return (
+            self.repeat_threshold is not None
+            and self.shape_counts[shape] == self.repeat_threshold + 1
+        )
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def duration(self):
+        return sum(s.duration for s in self.statements)
+
+    @property
+    def rows(self):
+        return sum(s.rows for s in self.statements)
+
+    def by_method(self):
+        """
+        DESCRIPTION:
+            Totals per Sql_queries method.
+        INPUT:
+            None
+        OUTPUT:
+            dict: method -> (statements, seconds, rows), most time first
+        """
+        totals = collections.defaultdict(lambda: [0, 0.0, 0])
+        for s in self.statements:
+            total = totals[s.method or "other"]
+            total[0] += 1
+            total[1] += s.duration
+            total[2] += s.rows
+        return dict(
+            sorted(
+                ((m, tuple(t)) for m, t in totals.items()),
+                key=lambda item: item[1][1],
+                reverse=True,
+            )
+        )
+
+    def server_timing(self):
+        """Value of the Server-Timing header, e.g. sql;dur=12.3;desc="4 queries" """
+        return 'sql;dur={:.1f};desc="{} queries, {} rows"'.format(
+            1000 * self.duration, self.count, self.rows
+        )
+
+
+class QueryStats:
+    """
+    Instrumentation of all SQL statements issued during requests, hooked
+    into SQLAlchemy's cursor execute events. For every request, the
+    number of statements, their latency and the rows they fetched are
+    recorded and tagged with the route and Sql_queries method that
+    issued them. Totals are added to the response as Server-Timing
+    header and logged (per method on debug level). A warning is logged
+    when a request repeats the same statement more than
+    QUERY_REPEAT_THRESHOLD times.
+
+    Enabled with QUERY_STATS.
+    """
+
+    def __init__(self, app=None):
+        self.listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get("QUERY_STATS"):
+            return
+        app.extensions["query_stats"] = self
+        app.after_request(self.finish_request)
+        if not self.listening:
+            event.listen(Engine, "before_cursor_execute", self.before_execute)
+            event.listen(Engine, "after_cursor_execute", self.after_execute)
+            event.listen(Engine, "handle_error", self.handle_error)
+            self.listening = True
+
+    @staticmethod
+    def enabled():
+        return has_request_context() and "query_stats" in current_app.extensions
+
+    def current(self):
+        """
+        DESCRIPTION:
+            Statistics of the current request (created on first use).
+        INPUT:
+            None
+        OUTPUT:
+            RequestStats (None outside of requests or when disabled)
+        """
+        if not self.enabled():
+            return None
+        # Kept on the request context (g may outlive a request, e.g. in tests)
+        ctx = _request_ctx_stack.top
+        stats = getattr(ctx, "query_stats", None)
+        if stats is None:
+            stats = RequestStats(
+                request.endpoint, current_app.config.get("QUERY_REPEAT_THRESHOLD")
+            )
+            ctx.query_stats = stats
+        return stats
+
+    def before_execute(self, conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def after_execute(self, conn, cursor, statement, parameters, context, many):
+        start = conn.info["query_start"].pop()
+        duration = time.perf_counter() - start
+        stats = self.current()
+        if stats is None:
+            return
+        shape = statement_shape(statement)
+        method = calling_method()
+        if stats.add(method, shape, duration, max(cursor.rowcount, 0)):
+            current_app.logger.warning(
+                "Possible N+1 queries in %s (%s): statement repeated more than "
+                "%d times: %.200s",
+                stats.route,
+                method or "other",
+                stats.repeat_threshold,
+                shape,
+            )
+
+    def handle_error(self, context):
+        """Drops the start time of a failed statement"""
+        if context.connection is not None and context.connection.info.get(
+            "query_start"
+        ):
+            context.connection.info["query_start"].pop()
+
+    def finish_request(self, response):
+        """Adds the Server-Timing header and logs the request's totals"""
+        stats = self.current()
+        response.headers.add("Server-Timing", stats.server_timing())
+        if stats.count == 0:
+            return response
+        logger = current_app.logger
+        logger.info(
+            "%s %s (%s): %d queries, %.1f ms, %d rows",
+            request.method,
+            request.path,
+            stats.route,
+            stats.count,
+            1000 * stats.duration,
+            stats.rows,
+        )
+        for method, (count, duration, rows) in stats.by_method().items():
+            logger.debug(
+                "    %s: %d queries, %.1f ms, %d rows",
+                method,
+                count,
+                1000 * duration,
+                rows,
+            )
+        return response
+
+
+# eof
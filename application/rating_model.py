@@ -0,0 +1,227 @@
+""" Latent factor model predicting user ratings """
+import os
+import time
+from application.lazy import LazyModule
+
+np = LazyModule("numpy")
+
+
+class RatingModel:
+    """
+    Predicts how a user would rate recipes from an offline trained matrix
+    factorization of the likes table (see build_rating_model):
+
+        rating = mean + recipe bias + user factors . recipe factors
+
+    Only recipe factors are stored. The factors of a user are computed on
+    request from their current ratings (one small least squares solve), so
+    predictions reflect ratings given after the last training run and work
+    for new users, too.
+    """
+
+    def __init__(self, app=None):
+        self.item_ids = None
+        self.item_factors = None
+        self.item_bias = None
+        self.mean = None
+        self.regularization = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Loads the model if RATING_MODEL_PATH points to one"""
+        path = app.config.get("RATING_MODEL_PATH")
+        if path and os.path.exists(path):
+            self.load(path)
+
+    @property
+    def loaded(self):
+        return self.item_ids is not None
+
+    def load(self, path):
+        """
+        DESCRIPTION:
+            Loads a model written by build_rating_model.
+        INPUT:
+            path (String): .npz file
+        OUTPUT:
+            None
+        """
+        with np.load(path) as model:
+            self.item_ids = model["item_ids"]
+            self.item_factors = model["item_factors"]
+            self.item_bias = model["item_bias"]
+            self.mean = float(model["mean"])
+            self.regularization = float(model["regularization"])
+
+    def close(self):
+        self.item_ids = None
+        self.item_factors = None
+        self.item_bias = None
+        self.mean = None
+        self.regularization = None
+
+    def positions(self, recipesIDs):
+        """
+        DESCRIPTION:
+            Looks up the rows of recipes in the model arrays.
+        INPUT:
+            recipesIDs (np.array): recipesIDs
+        OUTPUT:
+            pos (np.array): Row of every recipe in item_factors
+            known (np.array of bool): False for recipes without factors
+        """
+        pos = np.searchsorted(self.item_ids, recipesIDs)
+        pos = np.minimum(pos, len(self.item_ids) - 1)
+        return pos, self.item_ids[pos] == recipesIDs
+
+    def user_factors(self, recipesIDs, ratings):
+        """
+        DESCRIPTION:
+            Computes the latent factors of a user from their ratings.
+        INPUT:
+            recipesIDs (array-like): recipesIDs rated by the user
+            ratings (array-like): Corresponding ratings (None is ignored)
+        OUTPUT:
+            factors (np.array of float64)
+        """
+        rated = np.array([r is not None for r in ratings], dtype=bool)
+        recipesIDs = np.asarray(recipesIDs, dtype=np.int64)[rated]
+        ratings = np.array([r for r in ratings if r is not None], dtype=np.float64)
+        factors = np.zeros(self.item_factors.shape[1])
+        if len(recipesIDs) == 0:
+            return factors
+        pos, known = self.positions(recipesIDs)
+        pos, ratings = pos[known], ratings[known]
+        if len(pos) == 0:
+            return factors
+        Q = self.item_factors[pos].astype(np.float64)
+        residuals = ratings - self.mean - self.item_bias[pos]
+        A = Q.T @ Q + self.regularization * len(pos) * np.eye(Q.shape[1])
+        return np.linalg.solve(A, Q.T @ residuals)
+
+    def predict(self, recipesIDs, user_recipesIDs=(), user_ratings=()):
+        """
+        DESCRIPTION:
+            Predicts the ratings of one user for many recipes at once.
+        INPUT:
+            recipesIDs (array-like): recipesIDs to predict ratings for
+            user_recipesIDs (array-like): recipesIDs rated by the user
+            user_ratings (array-like): Corresponding ratings
+        OUTPUT:
+            predictions (np.array of float): Ratings between 1 and 5, or
+                None if the model is not loaded
+        """
+        if not self.loaded:
+            return None
+        recipesIDs = np.asarray(recipesIDs, dtype=np.int64)
+        if len(recipesIDs) == 0:
+            return np.empty(0)
+        p = self.user_factors(user_recipesIDs, user_ratings)
+        pos, known = self.positions(recipesIDs)
+        predictions = self.mean + np.where(
+            known, self.item_bias[pos] + self.item_factors[pos] @ p, 0
+        )
+        return np.clip(predictions, 1, 5)
+
+
+def _solve_factors(R, C, fixed, regularization):
+    """
+    DESCRIPTION:
+        One half step of alternating least squares: solves the ridge
+        regression of every row of the sparse rating matrix R on the
+        fixed factors of its columns. The normal equations of all rows
+        are built with two sparse matrix products and solved as one
+        batch.
+    INPUT:
+        R (scipy.sparse.csr_matrix): Residual ratings, rows x columns
+        C (scipy.sparse.csr_matrix): 1 where R holds a rating, else 0
+        fixed (np.array): Factors of the columns, columns x k
+        regularization (Float): Scaled by the number of ratings per row
+    OUTPUT:
+        factors (np.array): Factors of the rows, rows x k
+    """
+    k = fixed.shape[1]
+    counts = np.asarray(C.sum(axis=1)).ravel()
+
+    # Sum of outer products of the fixed factors rated in each row
+    outer = (fixed[:, :, None] * fixed[:, None, :]).reshape(-1, k * k)
+    A = np.asarray(C @ outer).reshape(-1, k, k)
+    A += regularization * np.maximum(counts, 1)[:, None, None] * np.eye(k)
+    b = np.asarray(R @ fixed)
+    return np.linalg.solve(A, b[:, :, None])[:, :, 0]
+
+
+def build_rating_model(
+    path, likes, factors=16, iterations=10, regularization=0.1, seed=0
+):
+    """
+    DESCRIPTION:
+        Trains the rating model with alternating least squares and saves
+        it to disk. Recipe biases are fitted first (shrunk mean of the
+        ratings minus the global mean), the latent factors are then
+        fitted to the remaining residuals. Bookmarks without rating are
+        ignored.
+    INPUT:
+        path (String): Output .npz file
+        likes (iterable): (userID, recipesID, rating) tuples, e.g. all
+            rows of the likes table
+        factors (Integer): Number of latent factors (default=16)
+        iterations (Integer): Number of ALS iterations (default=10)
+        regularization (Float): L2 regularization (default=0.1)
+        seed (Integer): Seed of the random initialization (default=0)
+    OUTPUT:
+        history (list of tuples): (iteration, seconds, training RMSE) for
+            every iteration
+    """
+    import scipy.sparse as sparse
+
+    likes = [like for like in likes if like[2] is not None]
+    if not likes:
+        raise ValueError("No ratings to train on")
+    userIDs = np.array([like[0] for like in likes], dtype=np.int64)
+    recipesIDs = np.array([like[1] for like in likes], dtype=np.int64)
+    ratings = np.array([like[2] for like in likes], dtype=np.float64)
+    users, user_idx = np.unique(userIDs, return_inverse=True)
+    item_ids, item_idx = np.unique(recipesIDs, return_inverse=True)
+
+    # Global mean and recipe biases (shrunk by one pseudo rating at the mean)
+    mean = ratings.mean()
+    counts = np.bincount(item_idx, minlength=len(item_ids))
+    sums = np.bincount(item_idx, weights=ratings - mean, minlength=len(item_ids))
+    item_bias = sums / (counts + 1)
+    residuals = ratings - mean - item_bias[item_idx]
+
+    shape = (len(users), len(item_ids))
+    R = sparse.csr_matrix((residuals, (user_idx, item_idx)), shape=shape)
+    C = sparse.csr_matrix((np.ones(len(likes)), (user_idx, item_idx)), shape=shape)
+    RT, CT = R.T.tocsr(), C.T.tocsr()
+    rng = np.random.default_rng(seed)
+    Q = rng.normal(scale=0.1, size=(len(item_ids), factors))
+
+    history = []
+    for iteration in range(1, iterations + 1):
+        start = time.perf_counter()
+        P = _solve_factors(R, C, Q, regularization)
+        Q = _solve_factors(RT, CT, P, regularization)
+        errors = residuals - np.einsum("ij,ij->i", P[user_idx], Q[item_idx])
+        rmse = float(np.sqrt(np.mean(errors**2)))
+        history.append((iteration, time.perf_counter() - start, rmse))
+
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    tmp_file = path + ".tmp.npz"
+    np.savez(
+        tmp_file,
+        item_ids=item_ids.astype(np.int32),
+        item_factors=Q.astype(np.float32),
+        item_bias=item_bias.astype(np.float32),
+        mean=mean,
+        regularization=regularization,
+    )
+    os.replace(tmp_file, path)
+    return history
+
+
+# eof
@@ -0,0 +1,327 @@
+""" Memory-mapped snapshot of the recipes table """
+import collections
+import hashlib
+import json
+import os
+import shutil
+import time
+from application.lazy import LazyModule
+
+np = LazyModule("numpy")
+
+
+# Columns of a catalogue row, in the order of Sql_queries.query_similar_recipes
+ROW_COLUMNS = [
+    "recipesID",
+    "title",
+    "ingredients",
+    "rating",
+    "calories",
+    "sodium",
+    "fat",
+    "protein",
+    "emissions",
+    "prop_ingredients",
+    "emissions_log10",
+    "url",
+    "servings",
+    "recipe_rawid",
+    "image_url",
+    "perc_rating",
+    "perc_sustainability",
+    "review_count",
+]
+
+# All columns stored in the catalogue (as exported by build_catalogue)
+COLUMNS = ROW_COLUMNS + ["categories"]
+
+STRING_COLUMNS = ["title", "ingredients", "url", "servings", "image_url", "categories"]
+INTEGER_COLUMNS = ["recipesID", "recipe_rawid"]
+
+Row = collections.namedtuple("Row", ROW_COLUMNS)
+
+
+class RecipeCatalogue:
+    """
+    Read-only, columnar copy of the recipes table. Numeric columns are
+    float64 arrays (NaN for NULL) and string columns are one utf-8 byte
+    array plus offsets each, all indexed by recipesID (like the
+    similarity store). Urls are found by binary search over the recipes
+    sorted by url. The .npy files are memory-mapped read-only, so all
+    worker processes share the same pages.
+
+    Every build is written to its own version directory, and the file
+    CURRENT names the version in use. reload (called at most every
+    RECIPE_CATALOGUE_RELOAD_INTERVAL seconds before requests) switches
+    to a new build without restarting the workers.
+    """
+
+    current_file = "CURRENT"
+    meta_file = "meta.json"
+
+    def __init__(self, app=None):
+        self.path = None
+        self.version = None
+        self.arrays = {}
+        self.reload_interval = None
+        self.last_check = 0.0
+        self.reload_callbacks = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Loads the catalogue if RECIPE_CATALOGUE_PATH points to a built one
+        and checks for new builds before requests
+        """
+        path = app.config.get("RECIPE_CATALOGUE_PATH")
+        self.reload_interval = app.config.get("RECIPE_CATALOGUE_RELOAD_INTERVAL")
+        if path and os.path.exists(os.path.join(path, self.current_file)):
+            self.load(path)
+        if path:
+            self.path = path
+            app.before_request(self.check_reload)
+
+    @property
+    def loaded(self):
+        return self.version is not None
+
+    def load(self, path):
+        """
+        DESCRIPTION:
+            Memory-maps the arrays of the current build of a catalogue
+            written with build_catalogue.
+        INPUT:
+            path (String): Catalogue directory (containing CURRENT)
+        OUTPUT:
+            None
+        """
+        with open(os.path.join(path, self.current_file)) as f:
+            version = f.read().strip()
+        directory = os.path.join(path, version)
+        arrays = {}
+        for filename in os.listdir(directory):
+            if filename.endswith(".npy"):
+                arrays[filename[: -len(".npy")]] = np.load(
+                    os.path.join(directory, filename), mmap_mode="r"
+                )
+        self.path = path
+        self.arrays = arrays
+        self.version = version
+        self.last_check = time.monotonic()
+
+    def close(self):
+        self.version = None
+        self.arrays = {}
+
+    def reload(self):
+        """
+        DESCRIPTION:
+            Switches to the current build if it differs from the loaded
+            one, and calls the functions registered with on_reload (e.g.
+            to clear caches of results built from the catalogue).
+        INPUT:
+            None
+        OUTPUT:
+            Boolean: True if a new build was loaded
+        """
+        self.last_check = time.monotonic()
+        if not self.path:
+            return False
+        try:
+            with open(os.path.join(self.path, self.current_file)) as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return False
+        if version == self.version:
+            return False
+        self.load(self.path)
+        for callback in self.reload_callbacks:
+            callback()
+        return True
+
+    def check_reload(self):
+        """Calls reload if the last check is older than the reload interval"""
+        if self.reload_interval is None:
+            return
+        if time.monotonic() - self.last_check >= self.reload_interval:
+            self.reload()
+
+    def on_reload(self, callback):
+        """Registers a function (without arguments) called after reloads"""
+        self.reload_callbacks.append(callback)
+
+    def __contains__(self, recipesID):
+        present = self.arrays["present"]
+        return 0 <= recipesID < present.shape[0] and bool(present[recipesID])
+
+    def string(self, column, recipesID):
+        """
+        DESCRIPTION:
+            Reads one value of a string column.
+        INPUT:
+            column (String): e.g. "title"
+            recipesID (Integer): recipesID from recipes table
+        OUTPUT:
+            String, or None for NULL
+        """
+        if self.arrays[column + ".null"][recipesID]:
+            return None
+        offsets = self.arrays[column + ".offsets"]
+        start, end = offsets[recipesID], offsets[recipesID + 1]
+        return self.arrays[column + ".data"][start:end].tobytes().decode("utf-8")
+
+    def numbers(self, column):
+        """
+        DESCRIPTION:
+            Returns a numeric column of all recipes.
+        INPUT:
+            column (String): e.g. "emissions_log10"
+        OUTPUT:
+            np.array of float64, indexed by recipesID (NaN for NULL and
+                missing recipes)
+        """
+        return self.arrays[column]
+
+    def recipes_id(self, url):
+        """
+        DESCRIPTION:
+            Finds a recipe by url (binary search over the url order).
+        INPUT:
+            url (String): Url string from recipes table
+        OUTPUT:
+            recipesID (Integer), or None if there is no such recipe
+        """
+        key = url.encode("utf-8")
+        order = self.arrays["url.order"]
+        offsets = self.arrays["url.offsets"]
+        data = self.arrays["url.data"]
+        low, high = 0, order.shape[0]
+        while low < high:
+            mid = (low + high) // 2
+            recipesID = int(order[mid])
+            value = data[offsets[recipesID] : offsets[recipesID + 1]].tobytes()
+            if value < key:
+                low = mid + 1
+            elif value > key:
+                high = mid
+            else:
+                return recipesID
+        return None
+
+    def rows(self, recipesIDs):
+        """
+        DESCRIPTION:
+            Reads whole recipe rows, like Sql_queries.query_similar_recipes.
+        INPUT:
+            recipesIDs (iterable): recipesIDs from recipes table
+        OUTPUT:
+            rows (list of Row namedtuples): In the given order, unknown
+                recipesIDs are left out
+        """
+        rows = []
+        for recipesID in recipesIDs:
+            recipesID = int(recipesID)
+            if recipesID not in self:
+                continue
+            values = []
+            for column in ROW_COLUMNS:
+                if column == "recipesID":
+                    values.append(recipesID)
+                elif column in STRING_COLUMNS:
+                    values.append(self.string(column, recipesID))
+                else:
+                    value = float(self.arrays[column][recipesID])
+                    if np.isnan(value):
+                        value = None
+                    elif column in INTEGER_COLUMNS:
+                        value = int(value)
+                    values.append(value)
+            rows.append(Row(*values))
+        return rows
+
+
+def build_catalogue(path, rows, keep=2):
+    """
+    DESCRIPTION:
+        Writes a RecipeCatalogue to disk. The arrays go to a new version
+        directory (named after a hash of their content), then CURRENT is
+        replaced atomically, so running workers never map a half written
+        build. Only the newest <keep> builds are kept.
+    INPUT:
+        path (String): Catalogue directory (created if necessary)
+        rows (iterable): Tuples with the values of COLUMNS, e.g. all rows
+            of the recipes table
+        keep (Integer): Number of builds to keep (default=2)
+    OUTPUT:
+        version (String): Version of the new build
+    """
+    rows = list(rows)
+    if not rows:
+        raise ValueError("No recipes to build a catalogue from")
+    recipesIDs = np.array([row[0] for row in rows], dtype=np.int64)
+    size = int(recipesIDs.max()) + 1
+
+    arrays = {"present": np.zeros(size, dtype=bool)}
+    arrays["present"][recipesIDs] = True
+    for i, column in enumerate(COLUMNS[1:], start=1):
+        if column in STRING_COLUMNS:
+            values = [None] * size
+            for recipesID, row in zip(recipesIDs, rows):
+                values[recipesID] = row[i]
+            encoded = [b"" if v is None else str(v).encode("utf-8") for v in values]
+            lengths = np.array([len(e) for e in encoded], dtype=np.int64)
+            arrays[column + ".offsets"] = np.concatenate(([0], np.cumsum(lengths)))
+            arrays[column + ".data"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+            arrays[column + ".null"] = np.array([v is None for v in values])
+        else:
+            array = np.full(size, np.nan)
+            array[recipesIDs] = [
+                np.nan if row[i] is None else float(row[i]) for row in rows
+            ]
+            arrays[column] = array
+    url = COLUMNS.index("url")
+    urls = [(str(row[url]).encode("utf-8"), row[0]) for row in rows if row[url]]
+    arrays["url.order"] = np.array([r for _, r in sorted(urls)], dtype=np.int32)
+
+    digest = hashlib.sha1()
+    for name in sorted(arrays):
+        digest.update(name.encode("utf-8"))
+        digest.update(np.ascontiguousarray(arrays[name]).tobytes())
+    version = digest.hexdigest()[:16]
+
+    directory = os.path.join(path, version)
+    if not os.path.exists(directory):
+        tmp_directory = os.path.join(path, "tmp_" + version)
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(tmp_directory)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_directory, name + ".npy"), array)
+        meta = {"version": version, "recipes": len(rows), "built": time.time()}
+        with open(os.path.join(tmp_directory, RecipeCatalogue.meta_file), "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_directory, directory)
+    else:
+        os.utime(os.path.join(directory, RecipeCatalogue.meta_file))
+
+    tmp_file = os.path.join(path, "tmp_" + RecipeCatalogue.current_file)
+    with open(tmp_file, "w") as f:
+        f.write(version)
+    os.replace(tmp_file, os.path.join(path, RecipeCatalogue.current_file))
+
+    # Remove old builds (mapped files stay readable until unmapped)
+    builds = [
+        os.path.join(path, name)
+        for name in os.listdir(path)
+        if os.path.exists(os.path.join(path, name, RecipeCatalogue.meta_file))
+    ]
+    builds.sort(
+        key=lambda b: os.path.getmtime(os.path.join(b, RecipeCatalogue.meta_file))
+    )
+    for build in builds[:-keep]:
+        if os.path.basename(build) != version:
+            shutil.rmtree(build, ignore_errors=True)
+    return version
+
+
+# eof
@@ -0,0 +1,179 @@
+""" Lightweight recipe rows for the request path """
+import math
+from application.lazy import LazyModule
+
+np = LazyModule("numpy")
+
+
+class RecipeRow:
+    """
+    One recipe of a search result, the cookbook etc. as a small slotted
+    object instead of a pandas DataFrame row: building a page of results
+    takes microseconds instead of milliseconds of DataFrame construction
+    and column type conversion.
+
+    Values can be read as row.title or row["title"]. Fields that were
+    never set (e.g. user_rating for anonymous users) raise AttributeError
+    or KeyError, which Jinja templates treat as undefined.
+    """
+
+    __slots__ = (
+        "recipesID",
+        "title",
+        "ingredients",
+        "rating",
+        "calories",
+        "sodium",
+        "fat",
+        "protein",
+        "emissions",
+        "prop_ing",
+        "prop_ingredients",
+        "emissions_log10",
+        "url",
+        "servings",
+        "index",
+        "image_url",
+        "perc_rating",
+        "perc_sustainability",
+        "review_count",
+        "similarity",
+        "categories",
+        "ghg",
+        "rank",
+        "userID",
+        "username",
+        "created",
+        "user_rating",
+        "bookmarked",
+        "predicted_rating",
+    )
+
+    def __init__(self, **values):
+        for field, value in values.items():
+            setattr(self, field, value)
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field)
+
+    def __setitem__(self, field, value):
+        setattr(self, field, value)
+
+    def __contains__(self, field):
+        return hasattr(self, field)
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def fields(self):
+        """Names of all set fields"""
+        return [field for field in self.__slots__ if hasattr(self, field)]
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.fields()}
+
+    def copy(self):
+        """Shallow copy (e.g. before adding user specific fields)"""
+        row = RecipeRow.__new__(RecipeRow)
+        for field in self.fields():
+            setattr(row, field, getattr(self, field))
+        return row
+
+    def __eq__(self, other):
+        return isinstance(other, RecipeRow) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return "<RecipeRow {} {!r}>".format(
+            self.get("recipesID"), self.get("url", self.get("title"))
+        )
+
+
+def to_float(value):
+    """Numeric DB value (e.g. Decimal) to float, None to NaN"""
+    return math.nan if value is None else float(value)
+
+
+def to_int(value):
+    """Integer DB value to int, None stays None"""
+    return None if value is None else int(value)
+
+
+def to_str(value):
+    """String DB value to str (like pandas' astype("str"))"""
+    return str(value)
+
+
+def to_rows(records, converters):
+    """
+    DESCRIPTION:
+        Builds RecipeRows from query results.
+    INPUT:
+        records (iterable): Tuples (e.g. RowProxy objects)
+        converters (list of tuples): (field, function) for every value of
+            a record, e.g. [("recipesID", to_int), ("title", to_str)].
+            function may be None to keep the value unchanged.
+    OUTPUT:
+        rows (list of RecipeRow)
+    """
+    rows = []
+    for record in records:
+        row = RecipeRow.__new__(RecipeRow)
+        for (field, convert), value in zip(converters, record):
+            setattr(row, field, value if convert is None else convert(value))
+        rows.append(row)
+    return rows
+
+
+def column(rows, field, dtype=None):
+    """
+    DESCRIPTION:
+        Collects one field of all rows into an array (missing fields and
+        None become NaN for numeric arrays).
+    INPUT:
+        rows (list of RecipeRow)
+        field (String): e.g. "emissions"
+        dtype: numpy dtype (default=None, float64; use object for strings)
+    OUTPUT:
+        np.array
+    """
+    if dtype is object:
+        return np.array([row.get(field) for row in rows], dtype=object)
+    values = [row.get(field) for row in rows]
+    return np.array(
+        [math.nan if v is None else v for v in values],
+        dtype=np.float64 if dtype is None else dtype,
+    )
+
+
+def sort_rows(rows, field, descending=False):
+    """
+    DESCRIPTION:
+        Sorts rows by a numeric field with one stable argsort. Rows with
+        NaN (or without the field) come last in both directions, like
+        pandas' sort_values.
+    INPUT:
+        rows (list of RecipeRow)
+        field (String): e.g. "emissions"
+        descending (Boolean): default=False
+    OUTPUT:
+        rows (list of RecipeRow): New list, same row objects
+    """
+    keys = column(rows, field)
+    order = np.argsort(-keys if descending else keys, kind="stable")
+    return [rows[i] for i in order]
+
+
+def copy_rows(rows):
+    """Copies of rows, e.g. of cached or shared results before changing them"""
+    return [row.copy() for row in rows]
+
+
+def select(rows, positions):
+    """Rows at the given positions (e.g. a page of a precomputed order)"""
+    return [rows[i] for i in positions]
+
+
+# eof
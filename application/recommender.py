@@ -0,0 +1,215 @@
+""" Item-item collaborative filtering recommender """
+import os
+from application.lazy import LazyModule
+
+np = LazyModule("numpy")
+
+
+def preferences(ratings):
+    """
+    DESCRIPTION:
+        Converts user ratings from the likes table into preference weights:
+        liked (5) -> 1, disliked (1) -> -1, anything else (bookmarked but
+        not rated, or neutral) -> 0.5.
+    INPUT:
+        ratings (array-like): Ratings, can contain None
+    OUTPUT:
+        np.array of float32
+    """
+    ratings = np.array([-1 if r is None else r for r in ratings], dtype=np.float32)
+    return np.where(ratings == 5, 1.0, np.where(ratings == 1, -1.0, 0.5)).astype(
+        np.float32
+    )
+
+
+class Recommender:
+    """
+    Personalized recommendations from an offline built artifact (see
+    build_recommender). For every recipe someone has interacted with, the
+    artifact holds its most similar recipes based on the users who liked,
+    disliked or bookmarked both (item-item collaborative filtering).
+    A recommendation is a lookup of the neighbours of the user's recipes
+    and a weighted sum over them, optionally blended with the content
+    similarity of the SimilarityStore.
+    """
+
+    def __init__(self, app=None):
+        self.item_ids = None
+        self.neighbours = None
+        self.scores = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Loads the artifact if RECOMMENDER_PATH points to one"""
+        path = app.config.get("RECOMMENDER_PATH")
+        if path and os.path.exists(path):
+            self.load(path)
+
+    @property
+    def loaded(self):
+        return self.item_ids is not None
+
+    def load(self, path):
+        """
+        DESCRIPTION:
+            Loads an artifact written by build_recommender.
+        INPUT:
+            path (String): .npz file
+        OUTPUT:
+            None
+        """
+        with np.load(path) as artifact:
+            self.item_ids = artifact["item_ids"]
+            self.neighbours = artifact["neighbours"]
+            self.scores = artifact["scores"]
+
+    def close(self):
+        self.item_ids = None
+        self.neighbours = None
+        self.scores = None
+
+    def collaborative_neighbours(self, recipesIDs):
+        """
+        DESCRIPTION:
+            Looks up the collaborative filtering neighbours of recipes.
+        INPUT:
+            recipesIDs (np.array): recipesIDs
+        OUTPUT:
+            rows (np.array): Index into recipesIDs for every returned row
+            neighbours (np.array of int32): recipesIDs of neighbours, one
+                row per recipe known to the model (padded with -1)
+            scores (np.array of float32): Corresponding similarity scores
+        """
+        if not self.loaded or len(recipesIDs) == 0:
+            return np.empty(0, dtype=np.int64), np.empty((0, 0)), np.empty((0, 0))
+        pos = np.searchsorted(self.item_ids, recipesIDs)
+        pos = np.minimum(pos, len(self.item_ids) - 1)
+        rows = np.flatnonzero(self.item_ids[pos] == recipesIDs)
+        return rows, self.neighbours[pos[rows]], self.scores[pos[rows]]
+
+    def recommend(
+        self, recipesIDs, ratings, N=10, similarity_store=None, alpha=0.7, Nc=50
+    ):
+        """
+        DESCRIPTION:
+            Recommends recipes for a user, given all recipes the user has
+            interacted with. Scores are the preference weighted sums of
+            collaborative filtering similarities (weight alpha) and content
+            similarities (weight 1 - alpha, using the Nc most similar
+            recipes from the similarity store, if given and loaded).
+            Recipes the user has already seen are never recommended.
+        INPUT:
+            recipesIDs (array-like): recipesIDs the user has interacted with
+            ratings (array-like): Corresponding ratings from the likes table
+            N (Integer): Max number of recommendations (default=10)
+            similarity_store (SimilarityStore): Content similarity (optional)
+            alpha (Float): Weight of collaborative filtering (default=0.7)
+            Nc (Integer): Number of content neighbours per recipe
+        OUTPUT:
+            recommendations (np.array of int32): recipesIDs, best first
+            scores (np.array of float): Corresponding scores
+        """
+        recipesIDs = np.asarray(recipesIDs, dtype=np.int64)
+        weights = preferences(ratings)
+        candidates, candidate_scores = [], []
+
+        # Collaborative filtering
+        rows, neighbours, scores = self.collaborative_neighbours(recipesIDs)
+        if len(rows):
+            candidates.append(neighbours.ravel())
+            candidate_scores.append((alpha * weights[rows, None] * scores).ravel())
+
+        # Content similarity
+        if similarity_store is not None and similarity_store.loaded:
+            for recipesID, weight in zip(recipesIDs, weights):
+                CS_ids, CS = similarity_store.lookup(int(recipesID))
+                if CS_ids is not None:
+                    candidates.append(CS_ids[1 : Nc + 1])
+                    candidate_scores.append((1 - alpha) * weight * CS[1 : Nc + 1])
+
+        if not candidates:
+            return np.empty(0, dtype=np.int32), np.empty(0)
+
+        # Sum up scores per candidate, leave out padding and seen recipes
+        candidates, inverse = np.unique(np.concatenate(candidates), return_inverse=True)
+        totals = np.bincount(
+            inverse,
+            weights=np.concatenate(candidate_scores).astype(np.float64),
+            minlength=len(candidates),
+        )
+        keep = (candidates >= 0) & ~np.isin(candidates, recipesIDs) & (totals > 0)
+        candidates, totals = candidates[keep], totals[keep]
+        if len(candidates) > N:
+            top = np.argpartition(-totals, N - 1)[:N]
+            candidates, totals = candidates[top], totals[top]
+        order = np.argsort(-totals, kind="stable")
+        return candidates[order].astype(np.int32), totals[order]
+
+
+def build_recommender(path, likes, k=50):
+    """
+    DESCRIPTION:
+        Builds the item-item collaborative filtering artifact. Users'
+        preferences (see preferences) form a sparse user x recipe matrix,
+        the cosine similarity between all pairs of recipe columns is
+        computed as one sparse matrix product, and the k most similar
+        recipes of every recipe are kept.
+    INPUT:
+        path (String): Output .npz file
+        likes (iterable): (userID, recipesID, rating) tuples, e.g. all
+            rows of the likes table
+        k (Integer): Number of neighbours to keep per recipe (default=50)
+    OUTPUT:
+        shape (tuple): (number of recipes, k)
+    """
+    import scipy.sparse as sparse
+
+    likes = list(likes)
+    userIDs = np.array([like[0] for like in likes], dtype=np.int64)
+    recipesIDs = np.array([like[1] for like in likes], dtype=np.int64)
+    weights = preferences([like[2] for like in likes])
+    users, user_idx = np.unique(userIDs, return_inverse=True)
+    item_ids, item_idx = np.unique(recipesIDs, return_inverse=True)
+
+    # Sparse user x recipe matrix (duplicate entries are summed up)
+    X = sparse.csr_matrix(
+        (weights, (user_idx, item_idx)), shape=(len(users), len(item_ids))
+    )
+
+    # Cosine similarity between recipes
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=0))).ravel()
+    norms[norms == 0] = 1
+    X = X @ sparse.diags(1 / norms)
+    S = (X.T @ X).tocsr()
+    S.setdiag(0)
+    S.eliminate_zeros()
+
+    # Keep the k most similar recipes per recipe
+    neighbours = np.full((len(item_ids), k), -1, dtype=np.int32)
+    scores = np.zeros((len(item_ids), k), dtype=np.float32)
+    for i in range(len(item_ids)):
+        start, end = S.indptr[i], S.indptr[i + 1]
+        cols, data = S.indices[start:end], S.data[start:end]
+        if len(data) > k:
+            top = np.argpartition(-data, k - 1)[:k]
+            cols, data = cols[top], data[top]
+        order = np.argsort(-data, kind="stable")
+        neighbours[i, : len(order)] = item_ids[cols[order]]
+        scores[i, : len(order)] = data[order]
+
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    tmp_file = path + ".tmp.npz"
+    np.savez(
+        tmp_file,
+        item_ids=item_ids.astype(np.int32),
+        neighbours=neighbours,
+        scores=scores,
+    )
+    os.replace(tmp_file, path)
+    return neighbours.shape
+
+
+# eof
@@ -0,0 +1,96 @@
+""" Cached table reflection for fast app startup """
+import os
+import pickle
+import sqlalchemy
+from sqlalchemy import MetaData, text
+
+
+# Bump when the snapshot layout changes
+SNAPSHOT_FORMAT = 1
+
+
+def schema_hash(connectable):
+    """
+    DESCRIPTION:
+        Hash of the database schema (columns and indexes of all tables in
+        the current schema), computed in a single query.
+    INPUT:
+        connectable: SQLAlchemy engine or connection
+    OUTPUT:
+        String (md5 hex digest)
+    """
+    query = text(
+        """
+        SELECT MD5(
+            COALESCE((
+                SELECT STRING_AGG(
+                    CONCAT_WS(':', table_name, column_name, data_type,
+                        is_nullable, column_default, character_maximum_length,
+                        numeric_precision, numeric_scale),
+                    ',' ORDER BY table_name, ordinal_position)
+                FROM information_schema.columns
+                WHERE table_schema = CURRENT_SCHEMA()
+            ), '')
+            || '|' ||
+            COALESCE((
+                SELECT STRING_AGG(indexdef, ',' ORDER BY tablename, indexname)
+                FROM pg_indexes
+                WHERE schemaname = CURRENT_SCHEMA()
+            ), '')
+        )
+        """
+    )
+    return connectable.execute(query).scalar()
+
+
+def reflect_metadata(metadata, engine, path=None):
+    """
+    DESCRIPTION:
+        Reflects all tables of the database into metadata, like
+        metadata.reflect(engine). If path is given, the reflected tables
+        are pickled to it together with the schema hash, and later calls
+        copy the tables from that snapshot instead of reflecting them
+        table by table (one query for the hash instead of several per
+        table). The snapshot is refreshed whenever the hash changes.
+    INPUT:
+        metadata (sqlalchemy.MetaData): e.g. db.Model.metadata
+        engine: SQLAlchemy engine
+        path (String): Snapshot file (default=None, always reflect)
+    OUTPUT:
+        Boolean: True if the tables were loaded from the snapshot
+    """
+    if not path:
+        metadata.reflect(engine)
+        return False
+
+    current_hash = schema_hash(engine)
+    version = (SNAPSHOT_FORMAT, sqlalchemy.__version__, current_hash)
+    snapshot = None
+    if os.path.exists(path):
+        try:
+            with open(path, "rb") as f:
+                snapshot = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+            snapshot = None
+    if snapshot is None or snapshot.get("version") != version:
+        snapshot = {"version": version, "metadata": MetaData()}
+        snapshot["metadata"].reflect(engine)
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        tmp_file = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_file, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, path)
+        cached = False
+    else:
+        cached = True
+
+    # Copy tables in dependency order, so foreign keys resolve
+    for table in snapshot["metadata"].sorted_tables:
+        if table.key not in metadata.tables:
+            table.tometadata(metadata)
+    return cached
+
+
+# eof
@@ -0,0 +1,165 @@
+""" Memory-mapped content similarity store """
+import os
+from application.lazy import LazyModule
+
+np = LazyModule("numpy")
+
+
+class SimilarityStore:
+    """
+    Content similarity of every recipe to its most similar recipes, read
+    from .npy files instead of the wide content_similarity200(_ids) tables.
+    Row i of both arrays belongs to the recipe with recipesID i. The files
+    are memory-mapped read-only, so all worker processes share the same
+    pages and a lookup is a zero-copy slice.
+
+    Optionally, the store also holds precomputed orderings of the similar
+    recipes (e.g. by emissions), see build_store.
+    """
+
+    ids_file = "content_similarity_ids.npy"
+    scores_file = "content_similarity.npy"
+    ordering_file = "content_similarity_order_{}.npy"
+
+    def __init__(self, app=None):
+        self.ids = None
+        self.scores = None
+        self.orderings = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Loads the store if SIMILARITY_STORE_PATH points to a built store"""
+        path = app.config.get("SIMILARITY_STORE_PATH")
+        if path and os.path.exists(os.path.join(path, self.ids_file)):
+            self.load(path)
+
+    @property
+    def loaded(self):
+        return self.ids is not None
+
+    def load(self, path):
+        """
+        DESCRIPTION:
+            Memory-maps the arrays of a store built with build_store.
+        INPUT:
+            path (String): Directory containing the .npy files
+        OUTPUT:
+            None
+        """
+        self.ids = np.load(os.path.join(path, self.ids_file), mmap_mode="r")
+        self.scores = np.load(os.path.join(path, self.scores_file), mmap_mode="r")
+        self.orderings = {}
+        for filename in os.listdir(path):
+            name = filename[len("content_similarity_order_") : -len(".npy")]
+            if filename == self.ordering_file.format(name):
+                self.orderings[name] = np.load(
+                    os.path.join(path, filename), mmap_mode="r"
+                )
+
+    def close(self):
+        self.ids = None
+        self.scores = None
+        self.orderings = {}
+
+    def lookup(self, recipesID):
+        """
+        DESCRIPTION:
+            Returns the most similar recipes of a recipe.
+        INPUT:
+            recipesID (Integer): recipesID from recipes table
+        OUTPUT:
+            ids (np.array of int32): recipesIDs of similar recipes,
+                ordered by similarity in descending order (the recipe
+                itself comes first)
+            scores (np.array of float): Corresponding similarity scores
+            Both are None if the recipe is not in the store.
+        """
+        if not 0 <= recipesID < self.ids.shape[0] or self.ids[recipesID, 0] < 0:
+            return None, None
+        return self.ids[recipesID], self.scores[recipesID]
+
+    def ordering(self, recipesID, sort_by):
+        """
+        DESCRIPTION:
+            Returns the precomputed order of the similar recipes of a
+            recipe (leaving out the recipe itself) for a sort option.
+        INPUT:
+            recipesID (Integer): recipesID from recipes table
+            sort_by (String): Sort option, e.g. "Sustainability"
+        OUTPUT:
+            positions (np.array of int16): Positions into ids[1:] of the
+                recipe's similar recipes (see lookup), in sorted order.
+                None if not available.
+        """
+        if not self.loaded or not sort_by:
+            return None
+        orderings = self.orderings.get(sort_by.lower())
+        if orderings is None or not 0 <= recipesID < orderings.shape[0]:
+            return None
+        return orderings[recipesID]
+
+
+def build_store(
+    path, ids_rows, scores_rows, shape, score_dtype="float32", sort_keys=None
+):
+    """
+    DESCRIPTION:
+        Writes the content similarity arrays of a SimilarityStore to disk.
+        Rows of recipes without similarity data are filled with -1 (ids)
+        and 0 (scores). Arrays are written to temporary files first and
+        then moved into place, so a running app never maps a half
+        written file.
+
+        For every sort key, an array with the order of each recipe's
+        similar recipes (ascending by key, ties keep similarity order) is
+        written as well, so any sort order can be served by a slice.
+    INPUT:
+        path (String): Output directory (created if necessary)
+        ids_rows (iterable): (recipeID, id_1, ..., id_k) tuples, as in
+            table content_similarity200_ids
+        scores_rows (iterable): (recipeID, score_1, ..., score_k) tuples,
+            as in table content_similarity200
+        shape (tuple): (max recipesID + 1, k)
+        score_dtype (String): "float32" or "float16" (default="float32")
+        sort_keys (dict): Maps sort option (e.g. "sustainability") to an
+            array with the sort key of every recipe, indexed by recipesID
+            (default=None). Use negative values to sort descending.
+    OUTPUT:
+        None
+    """
+    os.makedirs(path, exist_ok=True)
+    outputs = [
+        (SimilarityStore.ids_file, ids_rows, np.int32, -1),
+        (SimilarityStore.scores_file, scores_rows, score_dtype, 0),
+    ]
+    for filename, rows, dtype, fill in outputs:
+        tmp_file = os.path.join(path, "tmp_" + filename)
+        array = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=dtype, shape=shape)
+        array[:] = fill
+        for row in rows:
+            array[int(row[0])] = np.abs(np.asarray(row[1:], dtype=np.float64))
+        array.flush()
+        del array
+        os.replace(tmp_file, os.path.join(path, filename))
+
+    if sort_keys:
+        ids = np.load(os.path.join(path, SimilarityStore.ids_file), mmap_mode="r")
+        for name, keys in sort_keys.items():
+            filename = SimilarityStore.ordering_file.format(name)
+            tmp_file = os.path.join(path, "tmp_" + filename)
+            array = np.lib.format.open_memmap(
+                tmp_file, mode="w+", dtype=np.int16, shape=(shape[0], shape[1] - 1)
+            )
+            keys = np.asarray(keys, dtype=np.float64)
+            for start in range(0, shape[0], 4096):
+                neighbours = ids[start : start + 4096, 1:]
+                array[start : start + 4096] = np.argsort(
+                    keys[neighbours], axis=1, kind="stable"
+                )
+            array.flush()
+            del array
+            os.replace(tmp_file, os.path.join(path, filename))
+
+
+# eof
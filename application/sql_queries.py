@@ -1,28 +1,130 @@
 """ Class for advanced SQL queries without DB changes """
-import pandas as pd
-from sqlalchemy import text, bindparam, String, Integer, Numeric
-from application.models import User, Recipe, Like, Consent
+from sqlalchemy import inspect, text, bindparam, String, Integer, Numeric
+from application.models import (
+    User,
+    Recipe,
+    Like,
+    Consent,
+    UserCategory,
+    ContentSimilarity,
+    ContentSimilarityID,
+)
+from application.trigram_index import TrigramIndex
+from application.similarity_store import build_store
+from application.recipe_catalogue import COLUMNS, build_catalogue
+from application import similarity_store, recipe_catalogue
+from application.cache import LRUCache, SingleFlight, single_flight
+from application.recipe_rows import to_rows, to_float, to_int, to_str, copy_rows
 import datetime
+from application.lazy import LazyModule
+
+pd = LazyModule("pandas")
+np = LazyModule("numpy")
+
+# Bins of the histograms of log10 emissions of all recipes and of a
+# cookbook, drawn on top of each other (see query_emissions_histogram and
+# query_cookbook_histogram)
+EMISSIONS_BINS = 150
+EMISSIONS_DOMAIN = (-1.0, 2.0)
 
 
 class Sql_queries:
-    def __init__(self, session):
+    def __init__(self, session, cache_size=256, cache_ttl=3600):
         """
         Make DB connection via session object available to all queries
         session: (Flask-)SQLAlchemy session object
+        cache_size: Max number of recipes whose content based search
+            results are cached (see content_based_search)
+        cache_ttl: Time in seconds after which cached results expire
         """
         self.session = session
 
-    def fuzzy_search(self, search_term, search_column="url", N=160):
+        # Content based search results by recipe url
+        self.search_cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+
+        # Searches in progress, shared by concurrent identical searches
+        # (callers stop waiting after 30 s and search themselves)
+        self.in_flight = SingleFlight(timeout=30)
+
+        # Built on first use, see trigram_candidates
+        self.trigram_index = None
+
+        # Emissions histograms of all recipes, see query_emissions_histogram
+        self.emissions_histograms = {}
+
+        # Checked until it exists, see has_user_categories
+        self.user_categories_exists = False
+
+        # Checked on first use, see has_likes_unique_index
+        self.likes_unique_index_exists = None
+
+        # Built on first use, see query_content_based_search
+        self.content_based_search_sql = None
+
+    def build_trigram_index(self):
+        """
+        DESCRIPTION:
+            Builds an in-process trigram index over the url and title
+            of all recipes in the recipes table.
+        INPUT:
+            None
+        OUTPUT:
+            TrigramIndex object (see trigram_index.py)
+        """
+        query = text(
+            """
+            SELECT "recipesID", "url", "title"
+            FROM public.recipes
+            """
+        )
+        rows = self.session.execute(query).fetchall()
+        return TrigramIndex(
+            [row[0] for row in rows], [row[1] + " " + row[2] for row in rows]
+        )
+
+    def reset_trigram_index(self):
+        """
+        DESCRIPTION:
+            Drops the trigram index, e.g. after recipes were added to the
+            recipes table. It is built again on the next search.
+        INPUT:
+            None
+        OUTPUT:
+            None
+        """
+        self.trigram_index = None
+
+    def trigram_candidates(self, search_term, N=300):
+        """
+        DESCRIPTION:
+            Returns the recipesIDs of the N recipes whose url and title
+            share the most trigrams with the search_term. The trigram
+            index is built the first time this is called.
+        INPUT:
+            search_term (str): Search term
+            N (int): Max number of candidates to return
+        OUTPUT:
+            candidates (tuple): recipesIDs ordered by trigram similarity
+                in descending order
+        """
+        if self.trigram_index is None:
+            self.trigram_index = self.build_trigram_index()
+        return tuple(int(c) for c in self.trigram_index.candidates(search_term, N))
+
+    def fuzzy_search(self, search_term, search_column="url", N=160, N_candidates=300):
         """
         DESCRIPTION:
             Searches in recipes table column url for strings that include the
             search_term. If none do, returns the top N results ordered
-            by edit distance in ascending order.
+            by edit distance in ascending order. Edit distances are only
+            computed for the N_candidates recipes sharing the most
+            trigrams with the search_term.
         INPUT:
             search_term (str): String to look for in search_column
             search_column (str): Column to search (default="url")
             N (int): Max number of results to return
+            N_candidates (int): Max number of trigram candidates to rank
+                by edit distance (default=300)
         OUTPUT:
             results (list of RowProxy objects): query results
         """
@@ -49,8 +151,32 @@ class Sql_queries:
         )
         results = self.session.execute(query).fetchall()
 
-        # If no results contain the search_term
+        # If no results contain the search_term, rank the trigram candidates
+        # by edit distance
         if not results:
+            candidates = self.trigram_candidates(search_term, max(N, N_candidates))
+            if len(candidates) >= N:
+                query = text(
+                    """
+                    SELECT "recipesID", "title", "url", "perc_rating",
+                        "perc_sustainability", "review_count", "image_url",
+                        "emissions", "prop_ingredients",
+                        LEVENSHTEIN("url", :search_term) AS "rank"
+                    FROM public.recipes
+                    WHERE "recipesID" IN :candidates
+                    ORDER BY "rank" ASC
+                    LIMIT :N
+                    """,
+                    bindparams=[
+                        bindparam("search_term", value=search_term, type_=String),
+                        bindparam("candidates", value=candidates, type_=Integer),
+                        bindparam("N", value=N, type_=Integer),
+                    ],
+                )
+                return self.session.execute(query).fetchall()
+
+            # Too few candidates (e.g. search term shares no trigrams with
+            # any recipe), fall back on ranking the whole table
             query = text(
                 """
                 SELECT "recipesID", "title", "url", "perc_rating",
@@ -101,6 +227,7 @@ class Sql_queries:
         results = self.session.execute(query).fetchall()
         return results
 
+    @single_flight()
     def free_search(self, search_term, N=160):
         """
         DESCRIPTION:
@@ -178,8 +305,11 @@ class Sql_queries:
         INPUT:
             CS_ids (tuple): Tuple of recipe IDs
         OUTPUT:
-            recipes_sql (list of RowProxy objects): DB query result
+            recipes_sql (list of RowProxy objects): DB query result (rows
+                of the recipe catalogue if loaded, see recipe_catalogue.py)
         """
+        if recipe_catalogue.loaded:
+            return recipe_catalogue.rows(CS_ids)
         query = text(
             """
             SELECT "recipesID", "title", "ingredients",
@@ -196,12 +326,194 @@ class Sql_queries:
         recipes_sql = self.session.execute(query).fetchall()
         return recipes_sql
 
+    def build_content_based_search_sql(self):
+        """
+        DESCRIPTION:
+            Builds the SQL statement used by query_content_based_search.
+            The 200 similarity columns of content_similarity200_ids and
+            content_similarity200 are unnested side by side (keeping their
+            order as "rank") and joined to the recipes table.
+        INPUT:
+            None
+        OUTPUT:
+            String: SQL statement with bind parameter :search_term
+        """
+
+        def quote(column):
+            return '"' + column.name.replace('"', '""') + '"'
+
+        id_columns = [
+            "ids." + quote(c)
+            for c in ContentSimilarityID.__table__.columns
+            if c.name != "recipeID"
+        ]
+        score_columns = [
+            "cs." + quote(c)
+            for c in ContentSimilarity.__table__.columns
+            if c.name != "recipeID"
+        ]
+        return """
+            SELECT r."recipesID", r."title", r."ingredients",
+                r."rating", r."calories", r."sodium", r."fat",
+                r."protein", r."emissions", r."prop_ingredients",
+                r."emissions_log10", r."url", r."servings", r."recipe_rawid",
+                r."image_url", r."perc_rating", r."perc_sustainability",
+                r."review_count", ABS(sim.score) AS "similarity"
+            FROM public.content_similarity200_ids ids
+            JOIN public.content_similarity200 cs
+                ON cs."recipeID" = ids."recipeID"
+            CROSS JOIN LATERAL UNNEST(
+                ARRAY[{ids}],
+                ARRAY[{scores}]
+            ) WITH ORDINALITY AS sim(id, score, rank)
+            JOIN public.recipes r ON r."recipesID" = ABS(sim.id)
+            WHERE ids."recipeID" = (
+                SELECT "recipesID" FROM public.recipes
+                WHERE "url" = :search_term)
+            ORDER BY sim.rank
+            """.format(
+            ids=", ".join(id_columns), scores=", ".join(score_columns)
+        )
+
+    def query_content_based_search(self, search_term):
+        """
+        DESCRIPTION:
+            Fetches the reference recipe (given by its url) and its 199
+            most similar recipes, including their similarity scores, in
+            a single query.
+        INPUT:
+            search_term (str): url identifier for recipe (in recipes['url'])
+        OUTPUT:
+            recipes_sql (list of RowProxy objects): DB query result, ordered
+                by similarity in descending order (reference recipe first)
+        """
+        if self.content_based_search_sql is None:
+            self.content_based_search_sql = self.build_content_based_search_sql()
+        query = text(
+            self.content_based_search_sql,
+            bindparams=[bindparam("search_term", value=search_term, type_=String)],
+        )
+        return self.session.execute(query).fetchall()
+
+    def query_content_based_search_store(self, search_term):
+        """
+        DESCRIPTION:
+            Same as query_content_based_search, but reads the similar
+            recipes and their similarity scores from the memory-mapped
+            similarity store instead of the content_similarity tables.
+        INPUT:
+            search_term (str): url identifier for recipe (in recipes['url'])
+        OUTPUT:
+            recipes_sql (list of tuples): Recipe rows with similarity
+                score appended, ordered by similarity in descending order
+                (reference recipe first)
+        """
+        recipesID = self.query_recipes_id(search_term)
+        if recipesID is None:
+            return []
+        CS_ids, CS = similarity_store.lookup(recipesID)
+        if CS_ids is None:
+            return []
+
+        # Restore similarity order of recipe rows
+        recipes_sql = self.query_similar_recipes(tuple(int(i) for i in CS_ids))
+        recipes_by_id = {row[0]: row for row in recipes_sql}
+        return [
+            tuple(recipes_by_id[CSid]) + (float(s),)
+            for CSid, s in zip(CS_ids.tolist(), CS.tolist())
+            if CSid in recipes_by_id
+        ]
+
+    def query_recipes_id(self, url):
+        """
+        DESCRIPTION:
+            Looks up the recipesID of a recipe url (in the recipe catalogue
+            if loaded, otherwise in the recipes table).
+        INPUT:
+            url (String): Url string from recipes table
+        OUTPUT:
+            recipesID (Integer), or None if there is no such recipe
+        """
+        if recipe_catalogue.loaded:
+            return recipe_catalogue.recipes_id(url)
+        query = text(
+            """
+            SELECT "recipesID" FROM public.recipes
+            WHERE "url" = :url
+            """,
+            bindparams=[bindparam("url", value=url, type_=String)],
+        )
+        return self.session.execute(query).scalar()
+
+    def export_recipe_catalogue(self, path):
+        """
+        DESCRIPTION:
+            Exports the recipes table into a new build of the recipe
+            catalogue (see recipe_catalogue.py).
+        INPUT:
+            path (String): Catalogue directory
+        OUTPUT:
+            version (String): Version of the new build
+            Nrecipes (Integer): Number of exported recipes
+        """
+        query = text(
+            "SELECT {} FROM public.recipes".format(
+                ", ".join('"{}"'.format(column) for column in COLUMNS)
+            )
+        )
+        rows = self.session.execute(query).fetchall()
+        return build_catalogue(path, rows), len(rows)
+
+    def export_similarity_store(self, path, score_dtype="float32"):
+        """
+        DESCRIPTION:
+            Exports tables content_similarity200_ids and content_similarity200
+            into the .npy files of a similarity store (see
+            similarity_store.py). Rows are streamed from the DB. Also stores
+            the order of every recipe's similar recipes by emissions
+            (ascending, "sustainability") and by rating (descending,
+            "rating"), matching helper_functions.sort_search_results.
+        INPUT:
+            path (String): Output directory
+            score_dtype (String): "float32" or "float16" (default="float32")
+        OUTPUT:
+            shape (tuple): Shape of the exported arrays
+        """
+        max_id = self.session.execute(
+            text('SELECT MAX("recipeID") FROM public.content_similarity200_ids')
+        ).scalar()
+        shape = (int(max_id) + 1, len(ContentSimilarityID.__table__.columns) - 1)
+
+        # Sort keys of all recipes, indexed by recipesID (missing recipes
+        # are sorted last)
+        recipes = self.session.execute(
+            text('SELECT "recipesID", "emissions", "rating" FROM public.recipes')
+        ).fetchall()
+        recipesIDs = np.array([row[0] for row in recipes], dtype=np.int64)
+        emissions = np.full(recipesIDs.max() + 1, np.inf)
+        emissions[recipesIDs] = [np.nan if r[1] is None else r[1] for r in recipes]
+        ratings = np.full(recipesIDs.max() + 1, np.inf)
+        ratings[recipesIDs] = [np.nan if r[2] is None else -r[2] for r in recipes]
+
+        connection = self.session.connection().execution_options(stream_results=True)
+        build_store(
+            path,
+            connection.execute(text("SELECT * FROM public.content_similarity200_ids")),
+            connection.execute(text("SELECT * FROM public.content_similarity200")),
+            shape,
+            score_dtype=score_dtype,
+            sort_keys={"sustainability": emissions, "rating": ratings},
+        )
+        return shape
+
     def exact_recipe_match(self, search_term):
         """
         DESCRIPTION:
             Return True if search_term is in recipes table of
             cur database, False otherwise.
         """
+        if recipe_catalogue.loaded:
+            return recipe_catalogue.recipes_id(search_term) is not None
         query = text(
             """
             SELECT * FROM public.recipes
@@ -214,6 +526,7 @@ class Sql_queries:
         else:
             return False
 
+    @single_flight(copy=copy_rows)
     def content_based_search(self, search_term):
         """
         DESCRIPTION:
@@ -223,241 +536,601 @@ class Sql_queries:
         INPUT:
             search_term (str): url identifier for recipe (in recipes['url'])
         OUTPUT:
-            results (dataframe): Recipe dataframe similar to recipes, but
-                containing only the Nsim most similar recipes to the input.
-                Also contains additional column "similarity".
-        """
-        # Select recipe IDs of 200 most similar recipes to reference
-        CS_ids = self.query_content_similarity_ids(search_term)
-
-        # Also select the actual similarity scores
-        CS = self.query_content_similarity(search_term)
-
-        # Finally, select similar recipes themselves
-        # Get only those columns I actually use to speed things up
-        # Note that column names are actually different in sql and pandas
-        # So if you want to adjust this, adjust both!
-        # TODO: Make column names similar in pandas and sql!
-        col_sel = [
-            "recipesID",
-            "title",
-            "ingredients",
-            "rating",
-            "calories",
-            "sodium",
-            "fat",
-            "protein",
-            "emissions",
-            "prop_ing",
-            "emissions_log10",
-            "url",
-            "servings",
-            "index",
-            "image_url",
-            "perc_rating",
-            "perc_sustainability",
-            "review_count",
-        ]
-        recipes_sql = self.query_similar_recipes(CS_ids)
-
-        # Obtain a dataframe for further processing
-        results = pd.DataFrame(recipes_sql, columns=col_sel)
+            results (list of RecipeRow): The most similar recipes to the
+                input (reference recipe first), with additional field
+                "similarity" (see recipe_rows.py).
+        NOTES:
+            Results are cached per url (see self.search_cache). Callers get
+            copies of the rows, so user specific fields (e.g. ratings,
+            bookmarks) can be added without changing the cached results.
+            Concurrent searches for the same url wait for the first one
+            (see single_flight).
+        """
+        results = self.search_cache.get(search_term)
+        if results is None:
+            results = self.build_content_based_results(search_term)
+            self.search_cache.set(search_term, results)
+        return copy_rows(results)
 
-        # Add similarity scores to correct recipes (using recipesID again)
-        temp = pd.DataFrame({"CS_ids": CS_ids, "similarity": CS})
-        results = results.merge(
-            temp, left_on="recipesID", right_on="CS_ids", how="left"
-        )
+    # Fields and types of content based search results (in the order of
+    # query_content_based_search), see build_content_based_results
+    content_based_fields = [
+        ("recipesID", to_int),
+        ("title", to_str),
+        ("ingredients", to_str),
+        ("rating", to_float),
+        ("calories", to_float),
+        ("sodium", to_float),
+        ("fat", to_float),
+        ("protein", to_float),
+        ("emissions", to_float),
+        ("prop_ing", to_float),
+        ("emissions_log10", to_float),
+        ("url", to_str),
+        ("servings", to_str),
+        ("index", to_float),
+        ("image_url", to_str),
+        ("perc_rating", to_float),
+        ("perc_sustainability", to_float),
+        ("review_count", to_float),
+        ("similarity", to_float),
+    ]
 
-        # Assign data types (sql output might be decimal, should
-        # be float!)
-        numerics = [
-            "recipesID",
-            "rating",
-            "calories",
-            "sodium",
-            "fat",
-            "protein",
-            "emissions",
-            "prop_ing",
-            "emissions_log10",
-            "index",
-            "perc_rating",
-            "perc_sustainability",
-            "similarity",
-            "review_count",
-        ]
-        strings = ["title", "ingredients", "url", "servings", "image_url"]
-        for num in numerics:
-            results[num] = pd.to_numeric(results[num])
-        for s in strings:
-            results[s] = results[s].astype("str")
+    def build_content_based_results(self, search_term):
+        """
+        DESCRIPTION:
+            Uncached version of content_based_search.
+        INPUT:
+            search_term (str): url identifier for recipe (in recipes['url'])
+        OUTPUT:
+            results (list of RecipeRow): See content_based_search
+        """
+        # Select the 200 most similar recipes to reference, including their
+        # similarity scores (from the similarity store if available,
+        # otherwise in one query), already ordered by similarity
+        if similarity_store.loaded:
+            recipes_sql = self.query_content_based_search_store(search_term)
+        else:
+            recipes_sql = self.query_content_based_search(search_term)
 
-        # Order results by similarity
-        results = results.sort_values(by="similarity", ascending=False)
+        # Field names and types (sql output might be decimal, should be
+        # float!). Note that some field names differ from the sql columns.
+        # TODO: Make column names similar in rows and sql!
+        return to_rows(recipes_sql, self.content_based_fields)
 
-        return results
+    # Fields and types of free search results (in the order of
+    # free_search), see search_recipes
+    free_search_fields = [
+        ("recipesID", to_int),
+        ("title", to_str),
+        ("url", to_str),
+        ("perc_rating", to_float),
+        ("perc_sustainability", to_float),
+        ("review_count", to_float),
+        ("image_url", to_str),
+        ("ghg", to_float),
+        ("prop_ingredients", to_float),
+        ("rank", None),
+    ]
 
+    @single_flight(copy=copy_rows)
     def search_recipes(self, search_term, N=160):
         """
         DESCRIPTION:
             Does a free search for recipes based on user's search term. If an
-            exact match exists, does a content based search and returns the
-            resulting DataFrame.
+            exact match exists, does a content based search and returns its
+            results.
         INPUT:
             search_term (str): Search term input by user into search bar
             N (int): Max number of results to return
         OUTPUT:
-            df (pd.DataFrame): DataFrame with recipes as rows
+            results (list of RecipeRow): see recipe_rows.py
         """
         outp = self.free_search(search_term, N)
 
         if outp[0][2] == search_term:
             return self.content_based_search(search_term)
 
-        col_names = [
-            "recipesID",
-            "title",
-            "url",
-            "perc_rating",
-            "perc_sustainability",
-            "review_count",
-            "image_url",
-            "ghg",
-            "prop_ingredients",
-            "rank",
-        ]
-
-        results = pd.DataFrame(outp, columns=col_names)
-
-        # Assign data types (sql output might be decimal, should
-        # be float!)
-        numerics = [
-            "recipesID",
-            "perc_rating",
-            "ghg",
-            "prop_ingredients",
-            "perc_rating",
-            "perc_sustainability",
-            "review_count",
-        ]
-        strings = ["title", "url", "image_url"]
-        for num in numerics:
-            results[num] = pd.to_numeric(results[num])
-        for s in strings:
-            results[s] = results[s].astype("str")
-
         # Order results by rank / edit_dist
-        results = results.sort_values(by="rank", ascending=False)
+        results = to_rows(outp, self.free_search_fields)
+        results.sort(key=lambda row: row.rank, reverse=True)
         return results
 
-    def query_all_recipe_emissions(self):
+    def query_emissions_histogram(self, bins=EMISSIONS_BINS, domain=EMISSIONS_DOMAIN):
         """
         DESCRIPTION:
-            Retrieves emission scores from all recipes, their title and url.
+            Histogram of the log10 emission scores of all recipes, binned
+            in the database. Computed once and then cached.
         INPUT:
-            None
+            bins (Integer): Number of equally wide bins
+                (default=EMISSIONS_BINS)
+            domain (tuple): Range of log10 emissions covered by the bins,
+                recipes outside of it are left out (default=EMISSIONS_DOMAIN)
         OUTPUT:
-            df (pandas.DataFrame): With columns "recipesID", "emissions",
-                                   "emissions_log10", "url", "title"
+            df (pandas.DataFrame): One row per bin with columns "bin_start",
+                "bin_end" and "count"
         """
-        query = self.session.query(
-            Recipe.recipesID,
-            Recipe.emissions,
-            Recipe.emissions_log10,
-            Recipe.url,
-            Recipe.title,
-        )
-        return pd.read_sql(query.statement, self.session.bind)
+        key = (bins, domain, recipe_catalogue.version)
+        if key not in self.emissions_histograms and recipe_catalogue.loaded:
+            emissions = recipe_catalogue.numbers("emissions_log10")
+            emissions = emissions[(emissions >= domain[0]) & (emissions < domain[1])]
+            counts, edges = np.histogram(emissions, bins=bins, range=domain)
+            self.emissions_histograms[key] = pd.DataFrame(
+                {"bin_start": edges[:-1], "bin_end": edges[1:], "count": counts}
+            )
+        if key not in self.emissions_histograms:
+            query = text(
+                """
+                SELECT WIDTH_BUCKET("emissions_log10", :low, :high, :bins) AS bucket,
+                    COUNT(*)
+                FROM public.recipes
+                WHERE "emissions_log10" >= :low AND "emissions_log10" < :high
+                GROUP BY bucket
+                """,
+                bindparams=[
+                    bindparam("low", value=domain[0], type_=Numeric),
+                    bindparam("high", value=domain[1], type_=Numeric),
+                    bindparam("bins", value=bins, type_=Integer),
+                ],
+            )
+            counts = np.zeros(bins, dtype=np.int64)
+            for bucket, count in self.session.execute(query):
+                counts[bucket - 1] = count
+            edges = np.linspace(domain[0], domain[1], bins + 1)
+            self.emissions_histograms[key] = pd.DataFrame(
+                {"bin_start": edges[:-1], "bin_end": edges[1:], "count": counts}
+            )
+        return self.emissions_histograms[key]
 
-    def query_cookbook(self, userID):
+    # Fields and types of cookbook recipes, see query_cookbook
+    cookbook_fields = [
+        ("userID", to_int),
+        ("username", to_str),
+        ("created", None),
+        ("user_rating", to_float),
+        ("title", to_str),
+        ("url", to_str),
+        ("perc_rating", to_float),
+        ("perc_sustainability", to_float),
+        ("review_count", to_float),
+        ("image_url", to_str),
+        ("emissions", to_float),
+        ("prop_ingredients", to_float),
+        ("categories", to_str),
+        ("emissions_log10", to_float),
+        ("recipesID", to_int),
+    ]
+
+    # Sort key and direction of cookbook recipes for every sort option
+    # (see query_cookbook). Recipes without a value come last, ties are
+    # broken by recipesID.
+    cookbook_orders = {
+        "sustainability": ("r.emissions", "ASC"),
+        "user_rating": ("l.rating", "DESC"),
+        "perc_rating": ("r.perc_rating", "DESC"),
+    }
+
+    def query_cookbook(self, userID, sort_by=None, limit=None, offset=0, after=None):
         """
         DESCRIPTION:
-            Creates a pandas dataframe containing all recipes the given
-            user has liked / added to the cookbook.
+            Creates a list containing all recipes the given user has
+            liked / added to the cookbook, or one page of them.
         INPUT:
             userID (Integer)
+            sort_by (String): One of "Sustainability", "User_Rating" and
+                "Perc_Rating" (case insensitive). Other values (default=None)
+                sort by sustainability.
+            limit (Integer): Max number of recipes to return (default=None,
+                all recipes)
+            offset (Integer): Number of recipes to skip (default=0)
+            after (Integer): recipesID of the last recipe of the previous
+                page. If given, the page starts right after that recipe
+                (keyset pagination, cheaper than a large offset).
         OUTPUT:
-            cookbook (pd.DataFrame)
+            cookbook (list of RecipeRow): see recipe_rows.py
         """
+        key, direction = self.cookbook_orders.get(
+            (sort_by or "").lower(), self.cookbook_orders["sustainability"]
+        )
+        bindparams = [bindparam("userID", value=userID, type_=Integer)]
+        after_join = ""
+        after_clause = ""
+        if after is not None:
+            # Sort key of the last recipe of the previous page. Recipes
+            # without a sort key (NULLS LAST) only follow other such
+            # recipes, a row comparison would skip them.
+            after_join = """
+                CROSS JOIN (
+                    SELECT {key} AS key, r."recipesID" AS "recipesID"
+                    FROM users u
+                    JOIN likes l ON (u.username = l.username)
+                    JOIN recipes r ON (l."recipesID" = r."recipesID")
+                    WHERE u."userID" = :userID AND r."recipesID" = :after
+                ) a""".format(
+                key=key
+            )
+            after_clause = """
+            AND CASE WHEN a.key IS NULL
+                THEN {key} IS NULL AND r."recipesID" {op} a."recipesID"
+                ELSE {key} IS NULL OR ({key}, r."recipesID") {op} (a.key, a."recipesID")
+            END""".format(
+                key=key, op=">" if direction == "ASC" else "<"
+            )
+            bindparams.append(bindparam("after", value=after, type_=Integer))
+        limit_clause = ""
+        if limit is not None:
+            limit_clause = "LIMIT :limit OFFSET :offset"
+            bindparams.append(bindparam("limit", value=limit, type_=Integer))
+            bindparams.append(bindparam("offset", value=offset, type_=Integer))
         query = text(
             """
             SELECT u."userID", u.username,
                 l.created, l.rating,
                 r.title, r.url, r.perc_rating, r.perc_sustainability,
                 r.review_count, r.image_url, r.emissions, r.prop_ingredients,
-                r.categories
+                r.categories, r.emissions_log10, r."recipesID"
                 FROM users u
                 JOIN likes l ON (u.username = l.username)
                 JOIN recipes r ON (l."recipesID" = r."recipesID")
+                {after_join}
+            WHERE u."userID" = :userID {after_clause}
+            ORDER BY {key} {direction} NULLS LAST, r."recipesID" {direction}
+            {limit_clause}
+            """.format(
+                after_join=after_join,
+                after_clause=after_clause,
+                key=key,
+                direction=direction,
+                limit_clause=limit_clause,
+            ),
+            bindparams=bindparams,
+        )
+        return to_rows(self.session.execute(query), self.cookbook_fields)
+
+    def query_cookbook_summary(self, userID, N_favorites=3, N_categories=7):
+        """
+        DESCRIPTION:
+            Descriptive statistics of a user's cookbook, aggregated in the
+            database.
+        INPUT:
+            userID (Integer): userID from users table
+            N_favorites (Integer): Max number of favorite recipes
+            N_categories (Integer): Max number of favorite categories
+        OUTPUT:
+            summary (dict) with keys
+                Nrecipes (Integer): Number of recipes in cookbook
+                Nliked (Integer): Number of liked recipes (rating 5)
+                Ndisliked (Integer): Number of disliked recipes (rating 1)
+                mean_emissions (Float): Mean emissions of recipes (0 if the
+                    cookbook is empty)
+                favorites (list of RecipeRow): Most recently liked recipes
+                    with fields "title", "user_rating" and "url"
+                categories (List of tuples): Most frequent categories with
+                    their counts (e.g. [('dinner', 18), ('vegetarian', 10)])
+        """
+        params = [bindparam("userID", value=userID, type_=Integer)]
+        query = text(
+            """
+            SELECT COUNT(*),
+                COUNT(*) FILTER (WHERE l.rating = 5),
+                COUNT(*) FILTER (WHERE l.rating = 1),
+                COALESCE(AVG(r.emissions), 0)
+            FROM users u
+            JOIN likes l ON (u.username = l.username)
+            JOIN recipes r ON (l."recipesID" = r."recipesID")
             WHERE u."userID" = :userID
-            ORDER BY l.rating
             """,
-            bindparams=[bindparam("userID", value=userID, type_=Integer)],
+            bindparams=params,
         )
-        recipes = self.session.execute(query).fetchall()
-
-        # Convert to DataFrame
-        colsel = [
-            "userID",
-            "username",
-            "created",
-            "user_rating",
-            "title",
-            "url",
-            "perc_rating",
-            "perc_sustainability",
-            "review_count",
-            "image_url",
-            "emissions",
-            "prop_ingredients",
-            "categories",
-        ]
-        results = pd.DataFrame(recipes, columns=colsel)
-
-        # Assign data types
-        numerics = [
-            "userID",
-            "user_rating",
-            "perc_rating",
-            "perc_sustainability",
-            "review_count",
-            "emissions",
-            "prop_ingredients",
-        ]
-        strings = ["username", "title", "url", "image_url", "categories"]
-        datetimes = ["created"]
+        Nrecipes, Nliked, Ndisliked, mean_emissions = self.session.execute(
+            query
+        ).fetchone()
 
-        for num in numerics:
-            results[num] = pd.to_numeric(results[num])
-        for s in strings:
-            results[s] = results[s].astype("str")
-        for dt in datetimes:
-            results[dt] = pd.to_datetime(results[dt])
+        query = text(
+            """
+            SELECT r.title, l.rating, r.url
+            FROM users u
+            JOIN likes l ON (u.username = l.username)
+            JOIN recipes r ON (l."recipesID" = r."recipesID")
+            WHERE u."userID" = :userID AND l.rating = 5
+            ORDER BY l.created DESC
+            LIMIT :N
+            """,
+            bindparams=params + [bindparam("N", value=N_favorites, type_=Integer)],
+        )
+        favorites = to_rows(
+            self.session.execute(query),
+            [("title", to_str), ("user_rating", to_float), ("url", to_str)],
+        )
 
-        return results
+        # Favorite categories, maintained in table user_categories if it
+        # exists (see build_user_categories), otherwise counted from scratch
+        if self.has_user_categories():
+            query = text(
+                """
+                SELECT category, count
+                FROM public.user_categories
+                WHERE "userID" = :userID AND count > 0
+                ORDER BY count DESC, category
+                LIMIT :N
+                """,
+                bindparams=params + [bindparam("N", value=N_categories, type_=Integer)],
+            )
+        else:
+            query = text(
+                """
+                SELECT category, COUNT(*) AS count
+                FROM users u
+                JOIN likes l ON (u.username = l.username)
+                JOIN recipes r ON (l."recipesID" = r."recipesID")
+                CROSS JOIN LATERAL
+                    UNNEST(STRING_TO_ARRAY(r.categories, ';')) AS category
+                WHERE u."userID" = :userID
+                GROUP BY category
+                ORDER BY count DESC, category
+                LIMIT :N
+                """,
+                bindparams=params + [bindparam("N", value=N_categories, type_=Integer)],
+            )
+        categories = [tuple(row) for row in self.session.execute(query)]
+
+        return {
+            "Nrecipes": Nrecipes,
+            "Nliked": Nliked,
+            "Ndisliked": Ndisliked,
+            "mean_emissions": float(mean_emissions),
+            "favorites": favorites,
+            "categories": categories,
+        }
+
+    def has_user_categories(self):
+        """
+        DESCRIPTION:
+            Checks whether table user_categories exists. It is created
+            with build_user_categories ("flask categories build"). Only
+            its existence is remembered, so workers started before the
+            table was built pick it up.
+        INPUT:
+            None
+        OUTPUT:
+            Boolean
+        """
+        if not self.user_categories_exists:
+            self.user_categories_exists = self.session.get_bind().has_table(
+                "user_categories"
+            )
+        return self.user_categories_exists
+
+    def build_user_categories(self):
+        """
+        DESCRIPTION:
+            Creates table user_categories (if necessary) and fills it with
+            the number of recipes per category in every user's cookbook.
+            From then on it is kept up to date by add_to_cookbook,
+            remove_from_cookbook, rate_recipe and delete_account.
+        INPUT:
+            None
+        OUTPUT:
+            Integer: Number of rows written
+        """
+        UserCategory.__table__.create(bind=self.session.get_bind(), checkfirst=True)
+        self.session.execute(text("DELETE FROM public.user_categories"))
+        result = self.session.execute(
+            text(
+                """
+                INSERT INTO public.user_categories ("userID", category, count)
+                SELECT l."userID", category, COUNT(*)
+                FROM likes l
+                JOIN recipes r ON (l."recipesID" = r."recipesID")
+                CROSS JOIN LATERAL
+                    UNNEST(STRING_TO_ARRAY(r.categories, ';')) AS category
+                GROUP BY l."userID", category
+                """
+            )
+        )
+        self.session.commit()
+        self.user_categories_exists = True
+        return result.rowcount
+
+    def update_user_categories(self, userID, recipesID, sign):
+        """
+        DESCRIPTION:
+            Adds (sign=1) or subtracts (sign=-1) the categories of a recipe
+            to or from the user's category counts. Does not commit, so the
+            update is part of the transaction changing the likes table.
+            Does nothing if table user_categories does not exist.
+        INPUT:
+            userID (Integer): userID from users table
+            recipesID (Integer): recipesID from recipes table
+            sign (Integer): 1 or -1
+        OUTPUT:
+            None
+        """
+        if not self.has_user_categories():
+            return
+        query = text(
+            """
+            INSERT INTO public.user_categories ("userID", category, count)
+            SELECT :userID, category, :sign * COUNT(*)
+            FROM recipes r
+            CROSS JOIN LATERAL UNNEST(STRING_TO_ARRAY(r.categories, ';')) AS category
+            WHERE r."recipesID" = :recipesID
+            GROUP BY category
+            ON CONFLICT ("userID", category)
+            DO UPDATE SET count = user_categories.count + EXCLUDED.count
+            """,
+            bindparams=[
+                bindparam("userID", value=userID, type_=Integer),
+                bindparam("recipesID", value=recipesID, type_=Integer),
+                bindparam("sign", value=sign, type_=Integer),
+            ],
+        )
+        self.session.execute(query)
+        if sign < 0:
+            query = text(
+                """
+                DELETE FROM public.user_categories
+                WHERE "userID" = :userID AND count <= 0
+                """,
+                bindparams=[bindparam("userID", value=userID, type_=Integer)],
+            )
+            self.session.execute(query)
 
-    def query_bookmarks(self, userID, urls):
+    def user_categories_cte(self, source, sign):
         """
         DESCRIPTION:
-            For all recipes (given in list urls) check if it has
-            been bookmarked by the user (return boolean list).
+            SQL of a common table expression updating user_categories like
+            update_user_categories, for all likes rows returned by another
+            common table expression (e.g. by INSERT ... RETURNING). Empty
+            if table user_categories does not exist.
+        INPUT:
+            source (String): Name of a CTE with columns "userID" and
+                "recipesID"
+            sign (Integer): 1 or -1, or None if the source CTE has a
+                column "sign" holding it per row
+        OUTPUT:
+            String, to be appended to a WITH clause
+        """
+        if not self.has_user_categories():
+            return ""
+        count = "SUM(s.sign)" if sign is None else "{} * COUNT(*)".format(int(sign))
+        return """,
+            categories AS (
+                INSERT INTO public.user_categories ("userID", category, count)
+                SELECT s."userID", category, {count}
+                FROM {source} s
+                JOIN recipes r ON (r."recipesID" = s."recipesID")
+                CROSS JOIN LATERAL
+                    UNNEST(STRING_TO_ARRAY(r.categories, ';')) AS category
+                GROUP BY s."userID", category
+                ON CONFLICT ("userID", category)
+                DO UPDATE SET count = user_categories.count + EXCLUDED.count
+            )""".format(
+            source=source, count=count
+        )
+
+    def query_cookbook_histogram(
+        self, userID, bins=EMISSIONS_BINS, domain=EMISSIONS_DOMAIN, max_titles=5
+    ):
+        """
+        DESCRIPTION:
+            Histogram of the log10 emission scores of a user's cookbook,
+            binned in the database (one row per non-empty bin instead of
+            one per recipe). With the default bins and domain, the bins
+            line up with those of query_emissions_histogram. Recipes
+            outside of domain are left out.
         INPUT:
             userID (Integer): userID from users table
-            urls (List of strings): Url strings from recipes table
+            bins (Integer): Number of equally wide bins
+                (default=EMISSIONS_BINS)
+            domain (tuple): Range of log10 emissions
+                (default=EMISSIONS_DOMAIN)
+            max_titles (Integer): Maximum number of titles listed per bin
         OUTPUT:
-            Pandas DataFrame with columns 'recipesID' and 'bookmarked'
+            records (list of dicts): One per non-empty bin, lowest first,
+                with keys "bin_start", "bin_end", "count", "titles"
+                (String, e.g. "Pasta, Salad, ...") and "url" (recipe with
+                the lowest emissions in the bin)
         """
-        sql_query = (
-            self.session.query(Recipe, Like)
-            .join(Like, Like.recipesID == Recipe.recipesID, isouter=True)
-            .filter(Like.userID == userID, Recipe.url.in_(urls))
+        query = text(
+            """
+            SELECT WIDTH_BUCKET(r."emissions_log10", :low, :high, :bins) AS bucket,
+                COUNT(*),
+                (ARRAY_AGG(r.title ORDER BY r."emissions_log10", r."recipesID"))
+                    [1 : :max_titles],
+                (ARRAY_AGG(r.url ORDER BY r."emissions_log10", r."recipesID"))[1]
+            FROM users u
+            JOIN likes l ON (u.username = l.username)
+            JOIN recipes r ON (l."recipesID" = r."recipesID")
+            WHERE u."userID" = :userID
+                AND r."emissions_log10" >= :low AND r."emissions_log10" < :high
+            GROUP BY bucket
+            ORDER BY bucket
+            """,
+            bindparams=[
+                bindparam("userID", value=userID, type_=Integer),
+                bindparam("low", value=domain[0], type_=Numeric),
+                bindparam("high", value=domain[1], type_=Numeric),
+                bindparam("bins", value=bins, type_=Integer),
+                bindparam("max_titles", value=max_titles, type_=Integer),
+            ],
         )
-        df = pd.read_sql(sql_query.statement, self.session.bind)
+        edges = np.linspace(domain[0], domain[1], bins + 1)
+        records = []
+        for bucket, count, titles, url in self.session.execute(query):
+            names = list(titles)
+            if count > max_titles:
+                names.append("...")
+            records.append(
+                {
+                    "bin_start": float(edges[bucket - 1]),
+                    "bin_end": float(edges[bucket]),
+                    "count": int(count),
+                    "titles": ", ".join(names),
+                    "url": url,
+                }
+            )
+        return records
 
-        # I got 2 recipeID columns, keep only one!
-        df = df.loc[:, ~df.columns.duplicated()]
-        return df[["recipesID", "bookmarked"]]
+    def has_likes_unique_index(self):
+        """
+        DESCRIPTION:
+            Checks (once) whether the likes table has a unique index on
+            ("userID", "recipesID"), which the single statement write paths
+            of add_to_cookbook, remove_from_cookbook and rate_recipe need.
+            It is created with build_likes_unique_index ("flask likes
+            index").
+        INPUT:
+            None
+        OUTPUT:
+            Boolean
+        """
+        if self.likes_unique_index_exists is None:
+            inspector = inspect(self.session.get_bind())
+            columns = ["recipesID", "userID"]
+            self.likes_unique_index_exists = any(
+                sorted(index["column_names"]) == columns
+                for index in inspector.get_indexes("likes")
+                if index["unique"]
+            ) or any(
+                sorted(constraint["column_names"]) == columns
+                for constraint in inspector.get_unique_constraints("likes")
+            )
+        return self.likes_unique_index_exists
+
+    def build_likes_unique_index(self):
+        """
+        DESCRIPTION:
+            Removes duplicate rows from the likes table (keeping the most
+            recent row of every user and recipe) and creates a unique index
+            on ("userID", "recipesID").
+        INPUT:
+            None
+        OUTPUT:
+            Integer: Number of removed duplicates
+        """
+        result = self.session.execute(
+            text(
+                """
+                DELETE FROM public.likes a
+                USING public.likes b
+                WHERE a."userID" = b."userID"
+                AND a."recipesID" = b."recipesID"
+                AND a."likeID" < b."likeID"
+                """
+            )
+        )
+        self.session.execute(
+            text(
+                """
+                CREATE UNIQUE INDEX IF NOT EXISTS ix_likes_user_recipe
+                ON public.likes ("userID", "recipesID")
+                """
+            )
+        )
+        self.session.commit()
+        self.likes_unique_index_exists = True
+        return result.rowcount
 
     def is_in_cookbook(self, userID, url):
         """
@@ -490,8 +1163,43 @@ class Sql_queries:
             userID (Integer): userID from users table
             url (String): Url string from recipes table
         OUTPUT:
-            None
+            String: Feedback message
         """
+        if self.has_likes_unique_index():
+            query = text(
+                """
+                WITH target AS (
+                    SELECT u.username, u."userID", r."recipesID"
+                    FROM public.users u, public.recipes r
+                    WHERE u."userID" = :userID AND r.url = :url
+                    LIMIT 1
+                ),
+                added AS (
+                    INSERT INTO public.likes
+                        (username, bookmarked, "userID", "recipesID", created)
+                    SELECT username, TRUE, "userID", "recipesID", :created
+                    FROM target
+                    ON CONFLICT ("userID", "recipesID") DO NOTHING
+                    RETURNING "userID", "recipesID"
+                ){categories}
+                SELECT EXISTS (SELECT 1 FROM target), EXISTS (SELECT 1 FROM added)
+                """.format(
+                    categories=self.user_categories_cte("added", 1)
+                ),
+                bindparams=[
+                    bindparam("userID", value=userID, type_=Integer),
+                    bindparam("url", value=url, type_=String),
+                    bindparam("created", value=datetime.datetime.utcnow()),
+                ],
+            )
+            valid, added = self.session.execute(query).fetchone()
+            self.session.commit()
+            if not valid:
+                return "UserID or recipe url invalid"
+            if not added:
+                return "Cookbook entry already exists"
+            return "Cookbook entry added successfully"
+
         if self.is_in_cookbook(userID, url):
             return "Cookbook entry already exists"
         # Get username and recipesID
@@ -508,6 +1216,7 @@ class Sql_queries:
                 created=datetime.datetime.utcnow(),
             )
             self.session.add(like)
+            self.update_user_categories(userID, recipe.recipesID, 1)
             self.session.commit()
             return "Cookbook entry added successfully"
         return "UserID or recipe url invalid"
@@ -523,40 +1232,113 @@ class Sql_queries:
         OUTPUT:
             String: Feedback message
         """
+        if self.has_likes_unique_index():
+            query = text(
+                """
+                WITH removed AS (
+                    DELETE FROM public.likes l
+                    USING public.recipes r
+                    WHERE l."recipesID" = r."recipesID"
+                    AND l."userID" = :userID AND r.url = :url
+                    RETURNING l."userID", l."recipesID"
+                ){categories}
+                SELECT COUNT(*) FROM removed
+                """.format(
+                    categories=self.user_categories_cte("removed", -1)
+                ),
+                bindparams=[
+                    bindparam("userID", value=userID, type_=Integer),
+                    bindparam("url", value=url, type_=String),
+                ],
+            )
+            removed = self.session.execute(query).scalar()
+            self.session.commit()
+            if removed:
+                return "Removed recipe from cookbook successfully"
+            return "Recipe was not bookmarked to begin with"
+
         if self.is_in_cookbook(userID, url):
             recipe = Recipe.query.filter_by(url=url).first()
             like = Like.query.filter_by(
                 userID=userID, recipesID=recipe.recipesID
             ).first()
             self.session.delete(like)
+            self.update_user_categories(userID, recipe.recipesID, -1)
             self.session.commit()
             return "Removed recipe from cookbook successfully"
         return "Recipe was not bookmarked to begin with"
 
-    def query_user_ratings(self, userID, urls):
+    def query_user_overlay(self, userID, recipesIDs):
         """
         DESCRIPTION:
-            Query all rows in likes table with the given userID
-            for all elements in urls
+            Query the user's rating and bookmark status of the given
+            recipes in one query on the likes table.
         INPUT:
             userID (Integer): userID from users table
-            urls (List of strings): Url strings from recipes table
+            recipesIDs (List of Integers): recipesIDs from recipes table
         OUTPUT:
-            df (pandas.DataFrame): Has columns [likeID, userID, recipesID,
-                username, bookmarked, user_rating, created], can be empty.
-        NOTE:
-            A like entry may exist even if the user has not explicitly
-            rated a recipe - it may only have been bookmarked
+            overlay (dict): Maps recipesID to a (user_rating, bookmarked)
+                tuple, only for recipes with an entry in the likes table.
+                Both values can be None.
         """
-        recipesIDs = (
-            self.session.query(Recipe.recipesID).filter(Recipe.url.in_(urls)).all()
+        if len(recipesIDs) == 0:
+            return {}
+        query = text(
+            """
+            SELECT "recipesID", "rating", "bookmarked"
+            FROM public.likes
+            WHERE "userID" = :userID
+            AND "recipesID" IN :recipesIDs
+            """,
+            bindparams=[
+                bindparam("userID", value=userID, type_=Integer),
+                bindparam(
+                    "recipesIDs",
+                    value=tuple(int(i) for i in recipesIDs),
+                    type_=Numeric,
+                ),
+            ],
+        )
+        return {row[0]: (row[1], row[2]) for row in self.session.execute(query)}
+
+    def query_user_likes(self, userID):
+        """
+        DESCRIPTION:
+            Query recipesID and rating of all rows in likes table with the
+            given userID (bookmarked and/or rated recipes).
+        INPUT:
+            userID (Integer): userID from users table
+        OUTPUT:
+            likes (list of RowProxy objects): ("recipesID", "rating") rows
+        """
+        query = text(
+            """
+            SELECT "recipesID", "rating"
+            FROM public.likes
+            WHERE "userID" = :userID
+            """,
+            bindparams=[bindparam("userID", value=userID, type_=Integer)],
         )
-        likes_query = self.session.query(Like).filter(
-            Like.userID == userID, Like.recipesID.in_(recipesIDs)
+        return self.session.execute(query).fetchall()
+
+    def query_all_likes(self):
+        """
+        DESCRIPTION:
+            Query userID, recipesID and rating of all rows in likes table,
+            e.g. to train the recommender (see recommender.py).
+        INPUT:
+            None
+        OUTPUT:
+            likes (list of RowProxy objects): ("userID", "recipesID",
+                "rating") rows
+        """
+        query = text(
+            """
+            SELECT "userID", "recipesID", "rating"
+            FROM public.likes
+            """
         )
-        df = pd.read_sql(likes_query.statement, self.session.bind)
-        df.rename(columns={"rating": "user_rating"}, inplace=True)
-        return df
+        return self.session.execute(query).fetchall()
 
     def rate_recipe(self, userID, url, rating):
         """
@@ -566,8 +1348,41 @@ class Sql_queries:
             userID (Integer): userID from users table
             url (String): Recipe url tag
         OUTPUT:
-            None
+            Boolean: False if the userID or recipe url is invalid
         """
+        if self.has_likes_unique_index():
+            query = text(
+                """
+                WITH rated AS (
+                    INSERT INTO public.likes
+                        (username, bookmarked, "userID", "recipesID", created, rating)
+                    SELECT u.username, FALSE, u."userID", r."recipesID",
+                        :created, :rating
+                    FROM public.users u, public.recipes r
+                    WHERE u."userID" = :userID AND r.url = :url
+                    LIMIT 1
+                    ON CONFLICT ("userID", "recipesID")
+                    DO UPDATE SET rating = EXCLUDED.rating
+                    RETURNING "userID", "recipesID", (xmax = 0) AS inserted
+                ),
+                created AS (
+                    SELECT "userID", "recipesID" FROM rated WHERE inserted
+                ){categories}
+                SELECT COUNT(*) FROM rated
+                """.format(
+                    categories=self.user_categories_cte("created", 1)
+                ),
+                bindparams=[
+                    bindparam("userID", value=userID, type_=Integer),
+                    bindparam("url", value=url, type_=String),
+                    bindparam("rating", value=rating, type_=Integer),
+                    bindparam("created", value=datetime.datetime.utcnow()),
+                ],
+            )
+            rated = self.session.execute(query).scalar()
+            self.session.commit()
+            return rated > 0
+
         # Get recipeID
         recipeID = (
             self.session.query(Recipe.recipesID).filter(Recipe.url == url).first()
@@ -580,6 +1395,7 @@ class Sql_queries:
         if like:
             like.rating = rating
             self.session.commit()
+            return True
 
         # Like row not found, create new like entry (without bookmark)
         else:
@@ -595,7 +1411,169 @@ class Sql_queries:
                     rating=rating,
                 )
                 self.session.add(like)
+                self.update_user_categories(userID, recipe.recipesID, 1)
                 self.session.commit()
+                return True
+        return False
+
+    def apply_likes_batch(self, userID, operations):
+        """
+        DESCRIPTION:
+            Applies many ratings and bookmark changes of a user at once
+            (e.g. an import from another recipe app). Operations on the
+            same recipe are merged in order first, removing a bookmark
+            also drops an earlier rating. Removed bookmarks delete the
+            likes row, unless the recipe is (also) rated, which keeps the
+            row with its new rating and without bookmark. All remaining
+            changes are then written with a single INSERT ... ON CONFLICT (plus a DELETE
+            for removed bookmarks) in one statement and one commit.
+        INPUT:
+            userID (Integer): userID from users table
+            operations (iterable): (url, rating, bookmarked) tuples, where
+                rating (1-5) and bookmarked (Boolean) can be None to leave
+                them unchanged
+        OUTPUT:
+            result (dict): Number of "updated" (added or changed, rows
+                that already had the new values are not counted) and
+                "removed" likes rows, and "invalid" urls that matched no
+                recipe
+        """
+        changes = {}
+        for url, rating, bookmarked in operations:
+            change = changes.setdefault(url, [None, None])
+            if bookmarked is False:
+                change[:] = [None, False]
+            elif bookmarked:
+                change[1] = True
+            if rating is not None:
+                change[0] = rating
+        urls = list(changes)
+        ratings = [changes[url][0] for url in urls]
+        bookmarks = [changes[url][1] for url in urls]  # None: unchanged
+        removes = [changes[url] == [None, False] for url in urls]
+        if not urls:
+            return {"updated": 0, "removed": 0, "invalid": []}
+
+        if self.has_likes_unique_index():
+            query = text(
+                """
+                WITH ops AS (
+                    SELECT * FROM UNNEST(
+                        CAST(:urls AS TEXT[]),
+                        CAST(:ratings AS INTEGER[]),
+                        CAST(:bookmarks AS BOOLEAN[]),
+                        CAST(:removes AS BOOLEAN[])
+                    ) AS o(url, rating, bookmarked, remove)
+                ),
+                targets AS (
+                    SELECT DISTINCT ON (r."recipesID")
+                        u.username, u."userID", r."recipesID",
+                        o.rating, o.bookmarked, o.remove
+                    FROM ops o
+                    JOIN public.recipes r ON (r.url = o.url)
+                    JOIN public.users u ON (u."userID" = :userID)
+                ),
+                upserted AS (
+                    INSERT INTO public.likes
+                        (username, bookmarked, "userID", "recipesID", created, rating)
+                    SELECT username, COALESCE(bookmarked, FALSE), "userID",
+                        "recipesID", :created, rating
+                    FROM targets
+                    WHERE NOT remove
+                    ON CONFLICT ("userID", "recipesID")
+                    DO UPDATE SET
+                        rating = COALESCE(EXCLUDED.rating, likes.rating),
+                        bookmarked = COALESCE(
+                            (
+                                SELECT t.bookmarked FROM targets t
+                                WHERE t."recipesID" = EXCLUDED."recipesID"
+                            ),
+                            likes.bookmarked
+                        )
+                    WHERE (
+                        EXCLUDED.rating IS NOT NULL
+                        AND EXCLUDED.rating IS DISTINCT FROM likes.rating
+                    ) OR EXISTS (
+                        SELECT 1 FROM targets t
+                        WHERE t."recipesID" = EXCLUDED."recipesID"
+                        AND t.bookmarked IS NOT NULL
+                        AND t.bookmarked IS DISTINCT FROM likes.bookmarked
+                    )
+                    RETURNING "userID", "recipesID", (xmax = 0) AS inserted
+                ),
+                removed AS (
+                    DELETE FROM public.likes l
+                    USING targets t
+                    WHERE t.remove
+                    AND l."userID" = t."userID" AND l."recipesID" = t."recipesID"
+                    RETURNING l."userID", l."recipesID"
+                ),
+                changed AS (
+                    SELECT "userID", "recipesID", 1 AS sign
+                    FROM upserted WHERE inserted
+                    UNION ALL
+                    SELECT "userID", "recipesID", -1 AS sign FROM removed
+                ){categories}
+                SELECT
+                    (SELECT COUNT(*) FROM upserted),
+                    (SELECT COUNT(*) FROM removed),
+                    ARRAY(
+                        SELECT o.url FROM ops o
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM public.recipes r WHERE r.url = o.url
+                        )
+                    )
+                """.format(
+                    categories=self.user_categories_cte("changed", None)
+                ),
+                bindparams=[
+                    bindparam("userID", value=userID, type_=Integer),
+                    bindparam("urls", value=urls),
+                    bindparam("ratings", value=ratings),
+                    bindparam("bookmarks", value=bookmarks),
+                    bindparam("removes", value=removes),
+                    bindparam("created", value=datetime.datetime.utcnow()),
+                ],
+            )
+            updated, removed, invalid = self.session.execute(query).fetchone()
+            self.session.commit()
+            return {"updated": updated, "removed": removed, "invalid": invalid}
+
+        # Without unique index: one recipe at a time
+        known = {
+            row.url: row.recipesID
+            for row in self.session.query(Recipe.url, Recipe.recipesID).filter(
+                Recipe.url.in_(urls)
+            )
+        }
+        result = {"updated": 0, "removed": 0, "invalid": []}
+        for url, rating, bookmarked, remove in zip(urls, ratings, bookmarks, removes):
+            if url not in known:
+                result["invalid"].append(url)
+            elif remove:
+                message = self.remove_from_cookbook(userID, url)
+                if message == "Removed recipe from cookbook successfully":
+                    result["removed"] += 1
+            else:
+                # Unchanged likes rows are not counted, as in the upsert
+                like = Like.query.filter_by(userID=userID, recipesID=known[url]).first()
+                if (
+                    like
+                    and (rating is None or rating == like.rating)
+                    and (bookmarked is None or bookmarked == like.bookmarked)
+                ):
+                    continue
+                if rating is not None:
+                    self.rate_recipe(userID, url, rating)
+                elif bookmarked:
+                    self.add_to_cookbook(userID, url)
+                if bookmarked is not None:
+                    Like.query.filter_by(userID=userID, recipesID=known[url]).update(
+                        {"bookmarked": bookmarked}
+                    )
+                    self.session.commit()
+                result["updated"] += 1
+        return result
 
     def delete_account(self, userID):
         """
@@ -616,6 +1594,10 @@ class Sql_queries:
             # delete consent of user (in consent table)
             Consent.query.filter_by(userID=userID).delete()
 
+            # delete category counts of user (in user_categories table)
+            if self.has_user_categories():
+                UserCategory.query.filter_by(userID=userID).delete()
+
             # delete user (in users table)
             self.session.delete(user)
             self.session.commit()
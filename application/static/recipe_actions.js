@@ -0,0 +1,94 @@
+// Like / dislike / unlike and bookmark recipes without reloading the page
+// (see templates/recipe-macro.html). Falls back to the redirecting routes
+// whenever the JSON api does not answer with JSON (e.g. when signed out).
+
+function csrfToken() {
+    var input = document.querySelector('input[name="csrf_token"]');
+    return input ? input.value : "";
+}
+
+function postJSON(url) {
+    return fetch(url, {
+        method: "POST",
+        credentials: "same-origin",
+        headers: {"X-CSRFToken": csrfToken(), "Accept": "application/json"}
+    }).then(function(response) {
+        var type = response.headers.get("Content-Type") || "";
+        if (!response.ok || type.indexOf("application/json") === -1) {
+            throw new Error("No JSON response");
+        }
+        return response.json();
+    });
+}
+
+// Clicked button and current rating -> new rating (as in the templates)
+function targetRating(button, rating) {
+    if (button === "like") {
+        return rating === 5 ? 3 : 5;
+    }
+    return rating === 1 ? 3 : 1;
+}
+
+function showRating(container, rating) {
+    container.dataset.userRating = rating;
+    var like = container.querySelector('[data-button="like"] button');
+    var dislike = container.querySelector('[data-button="dislike"] button');
+    like.classList.toggle("btn-like-rated", rating === 5);
+    like.classList.toggle("btn-like-unrated", rating !== 5);
+    dislike.classList.toggle("btn-dislike-rated", rating === 1);
+    dislike.classList.toggle("btn-dislike-unrated", rating !== 1);
+}
+
+function showBookmark(link, bookmarked) {
+    var images = link.querySelectorAll("img");
+    var title = bookmarked ? "Remove recipe from cookbook" : "Add recipe to cookbook";
+    images[0].src = bookmarked ? "../static/cookbook_icon.png" : "../static/cookbook_icon_inactive.png";
+    images[1].src = bookmarked ? "../static/cookbook_icon_inactive.png" : "../static/cookbook_icon.png";
+    images[0].title = title;
+    images[1].title = title;
+}
+
+document.addEventListener("DOMContentLoaded", function() {
+
+    document.querySelectorAll("form.js-rate").forEach(function(form) {
+        form.addEventListener("submit", function(event) {
+            event.preventDefault();
+            var container = form.closest(".rating-buttons");
+            var rating = targetRating(
+                form.dataset.button, Number(container.dataset.userRating));
+            var action = {5: "like", 1: "dislike", 3: "unlike"}[rating];
+            postJSON(container.dataset[action])
+                .then(function(data) { showRating(container, data.user_rating); })
+                .catch(function() { form.submit(); });
+        });
+    });
+
+    document.querySelectorAll("a.js-bookmark").forEach(function(link) {
+        link.addEventListener("click", function(event) {
+            event.preventDefault();
+            postJSON(link.dataset.api)
+                .then(function(data) { showBookmark(link, data.bookmarked); })
+                .catch(function() { window.location = link.href; });
+        });
+    });
+
+    // Cookbook cards disappear once the bookmark is removed. The api
+    // toggles, so a recipe already removed elsewhere (e.g. another tab) is
+    // bookmarked again; the redirecting route then removes it and reloads.
+    document.querySelectorAll("form.js-remove-bookmark").forEach(function(form) {
+        form.addEventListener("submit", function(event) {
+            event.preventDefault();
+            postJSON(form.dataset.api)
+                .then(function(data) {
+                    if (data.bookmarked) {
+                        form.submit();
+                    } else {
+                        form.closest(".recipe-card").remove();
+                    }
+                })
+                .catch(function() { form.submit(); });
+        });
+    });
+});
+
+// eof
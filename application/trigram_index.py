@@ -0,0 +1,90 @@
+""" In-process trigram index for fuzzy recipe search """
+import re
+from application.lazy import LazyModule
+
+np = LazyModule("numpy")
+
+
+def trigrams(text):
+    """
+    DESCRIPTION:
+        Splits a string into its set of trigrams, following the conventions
+        of postgres' pg_trgm: the string is lower cased, non-alphanumeric
+        characters separate words, and every word is padded with two spaces
+        in front and one space at the end.
+    INPUT:
+        text (str): e.g. "pineapple-shrimp"
+    OUTPUT:
+        set of strings (e.g. {"  p", " pi", "pin", ..., "mp "})
+    """
+    grams = set()
+    for word in re.split(r"[^a-z0-9]+", text.lower()):
+        if not word:
+            continue
+        word = "  " + word + " "
+        grams.update(word[i : i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+class TrigramIndex:
+    def __init__(self, recipesIDs, texts):
+        """
+        DESCRIPTION:
+            Builds an inverted index mapping every trigram to the positions
+            of the documents (recipes) containing it.
+        INPUT:
+            recipesIDs (list of Integers): recipesID of every document
+            texts (list of strings): Text to index for every document,
+                e.g. url and title joined by a space
+        """
+        self.recipesIDs = np.asarray(recipesIDs, dtype=np.int32)
+        self.doc_sizes = np.zeros(len(self.recipesIDs), dtype=np.int32)
+        postings = {}
+        for pos, text in enumerate(texts):
+            grams = trigrams(text)
+            self.doc_sizes[pos] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(pos)
+        self.postings = {
+            gram: np.asarray(positions, dtype=np.int32)
+            for gram, positions in postings.items()
+        }
+
+    def __len__(self):
+        return len(self.recipesIDs)
+
+    def candidates(self, search_term, N=300):
+        """
+        DESCRIPTION:
+            Returns the recipesIDs of the (at most) N documents sharing the
+            most trigrams with search_term. Documents are ranked by trigram
+            similarity (shared / (query + document - shared)), like
+            pg_trgm's similarity() function. Documents without any shared
+            trigram are never returned.
+        INPUT:
+            search_term (str): Search term input by user
+            N (int): Max number of candidates to return
+        OUTPUT:
+            recipesIDs (np.array of int32): ordered by similarity in
+                descending order
+        """
+        grams = trigrams(search_term)
+        hits = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not hits:
+            return np.empty(0, dtype=np.int32)
+
+        shared = np.bincount(np.concatenate(hits), minlength=len(self))
+        matches = np.flatnonzero(shared)
+        similarity = shared[matches] / (
+            len(grams) + self.doc_sizes[matches] - shared[matches]
+        )
+
+        # Only sort the top N candidates
+        if len(matches) > N:
+            top = np.argpartition(-similarity, N - 1)[:N]
+            matches, similarity = matches[top], similarity[top]
+        order = np.argsort(-similarity, kind="stable")
+        return self.recipesIDs[matches[order]]
+
+
+# eof
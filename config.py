@@ -25,6 +25,72 @@ class Config:
         "pool_pre_ping": True,
     }
 
+    # Count and time SQL statements per request (Server-Timing header and
+    # logs), warn when a request repeats a statement more than
+    # QUERY_REPEAT_THRESHOLD times
+    QUERY_STATS = True
+    QUERY_REPEAT_THRESHOLD = 10
+
+    # Request latencies, DB pool waits and cache hit ratios in the
+    # Prometheus text format (aggregated over all gunicorn workers, see
+    # metrics.py). Served to scrapers sending the bearer token
+    # METRICS_TOKEN, or if it is not set, to clients in
+    # METRICS_ALLOWED_NETWORKS only
+    METRICS = True
+    METRICS_PATH = "/metrics"
+    METRICS_TOKEN = environ.get("METRICS_TOKEN")
+    METRICS_ALLOWED_NETWORKS = ["127.0.0.0/8", "::1/128"]
+
+    # Response compression (brotli or gzip, by the client's preference,
+    # ties in this order), smaller responses are sent uncompressed. A list
+    # of algorithms needs a recent Flask-Compress (see requirements.txt)
+    COMPRESS_ALGORITHM = ["br", "gzip"]
+    COMPRESS_LEVEL = 6
+    COMPRESS_BR_LEVEL = 4
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_MIMETYPES = [
+        "text/html",
+        "text/css",
+        "text/xml",
+        "application/json",
+        "application/javascript",
+    ]
+
+    # ETags of anonymous recipe and search pages change with the recipe
+    # data and with ETAG_VERSION (e.g. set to the release on deploys)
+    ETAG_VERSION = environ.get("ETAG_VERSION", "")
+
+    # Cache of rendered compare and search pages of anonymous users:
+    # "memory" (per worker), "file" (directory PAGE_CACHE_PATH shared by
+    # all workers), "redis" (server at PAGE_CACHE_URL, needs the redis
+    # package) or "" (off)
+    PAGE_CACHE = environ.get("PAGE_CACHE", "memory")
+    PAGE_CACHE_PATH = environ.get("PAGE_CACHE_PATH")
+    PAGE_CACHE_URL = environ.get("PAGE_CACHE_URL")
+    PAGE_CACHE_SIZE = 512  # pages per worker ("memory") or directory ("file")
+    PAGE_CACHE_TTL = 3600
+
+    # Snapshot of the reflected DB schema, refreshed when the schema
+    # changes (speeds up create_app, see schema_cache.py)
+    SCHEMA_CACHE_PATH = environ.get("SCHEMA_CACHE_PATH")
+
+    # Memory-mapped content similarity (built with "flask similarity build")
+    SIMILARITY_STORE_PATH = environ.get("SIMILARITY_STORE_PATH")
+
+    # Memory-mapped recipes table (built with "flask catalogue build"),
+    # new builds are picked up after at most RELOAD_INTERVAL seconds
+    RECIPE_CATALOGUE_PATH = environ.get("RECIPE_CATALOGUE_PATH")
+    RECIPE_CATALOGUE_RELOAD_INTERVAL = 60
+
+    # Collaborative filtering model (built with "flask recommender build")
+    RECOMMENDER_PATH = environ.get("RECOMMENDER_PATH")
+
+    # Rating prediction model (trained with "flask ratings train")
+    RATING_MODEL_PATH = environ.get("RATING_MODEL_PATH")
+
+    # Maximum number of operations per batch rating / bookmark request
+    BATCH_MAX_OPERATIONS = 1000
+
     # Email (TSL errors out)
     MAIL_SERVER = "smtp.gmail.com"
     MAIL_PORT = 465  # for TSL use 587, for ssl use 465
@@ -0,0 +1,37 @@
+""" gunicorn settings (read automatically from the working directory) """
+import os
+import tempfile
+
+
+# Workers write their metrics to files in this directory, so that /metrics
+# reports all workers (see application/metrics.py). Set before any worker
+# imports the app, as prometheus_client reads it on import.
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(tempfile.gettempdir(), "prometheus_multiproc"),
+)
+
+# Threads per worker (gthread workers): concurrent requests of a worker
+# share its caches and identical concurrent searches are run once (see
+# SingleFlight in application/cache.py)
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+
+def on_starting(server):
+    """Removes metrics files of a previous run (see application/metrics.py)"""
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        os.makedirs(path, exist_ok=True)
+        for filename in os.listdir(path):
+            os.remove(os.path.join(path, filename))
+
+
+def child_exit(server, worker):
+    """Drops the in-flight request gauges of a stopped worker"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
+
+
+# eof
@@ -0,0 +1,106 @@
+"""
+Unit tests for altair_plots.py
+"""
+import json
+import pytest
+from application import create_app
+from application.recipe_rows import RecipeRow
+
+
+# FIXTURES
+@pytest.fixture
+def ap():
+    """altair_plots module (importing application.main needs the app)"""
+    create_app(testing=True, debug=False)
+    import application.main.altair_plots as ap
+
+    return ap
+
+
+@pytest.fixture
+def recipes():
+    """Reference recipe and two similar recipes"""
+    reference = RecipeRow(recipesID=1, title="Pasta", url="pasta", emissions=1.0)
+    results = [
+        RecipeRow(recipesID=2, title="Salad", url="salad", emissions=0.504),
+        RecipeRow(recipesID=3, title="Steak", url="steak", emissions=3.0),
+    ]
+    return reference, results
+
+
+# TESTS
+class TestAltairPlots:
+    def test_bar_compare_emissions(self, ap, recipes):
+
+        ap.compare_skeletons.clear()
+        reference, results = recipes
+        spec = json.loads(ap.bar_compare_emissions(reference, results))
+        assert spec["data"] == {"name": ap.COMPARE_DATASET}
+        assert spec["datasets"] == {
+            ap.COMPARE_DATASET: [
+                {
+                    "title": "Salad",
+                    "url": "salad",
+                    "emission change": -0.49,
+                    "emission_change": -0.49,
+                },
+                {
+                    "title": "Steak",
+                    "url": "steak",
+                    "emission change": 2.0,
+                    "emission_change": 2.0,
+                },
+            ]
+        }
+        assert spec["mark"] == "bar"
+        assert spec["encoding"]["y"]["sort"] is None
+        assert spec["encoding"]["x"]["axis"]["title"] == "kg CO2 eq"
+        assert spec["transform"][0]["calculate"].endswith("'Similarity')")
+
+        # The skeleton is only built once per sort order
+        spec = json.loads(ap.bar_compare_emissions(reference, results[1:]))
+        assert len(spec["datasets"][ap.COMPARE_DATASET]) == 1
+        assert ap.compare_skeletons.stats()["misses"] == 1
+        assert ap.compare_skeletons.stats()["hits"] == 1
+        spec = json.loads(
+            ap.bar_compare_emissions(reference, results, sort_by="Rating")
+        )
+        assert spec["transform"][0]["calculate"].endswith("'Rating')")
+        assert ap.compare_skeletons.stats()["misses"] == 2
+
+    def test_histogram_emissions(self, ap):
+
+        import numpy as np
+        import pandas as pd
+
+        records = [
+            {
+                "bin_start": 0.0,
+                "bin_end": 0.02,
+                "count": 2,
+                "titles": "B, ...",
+                "url": "b",
+            },
+            {
+                "bin_start": 0.5,
+                "bin_end": 0.52,
+                "count": 1,
+                "titles": "C",
+                "url": "c",
+            },
+        ]
+
+        # One record per bin in the chart
+        background = pd.DataFrame(
+            {
+                "bin_start": np.linspace(-1.0, 1.99, 300),
+                "bin_end": np.linspace(-0.99, 2.0, 300),
+                "count": np.ones(300, dtype=int),
+            }
+        )
+        spec = json.loads(ap.histogram_emissions(background, records, "Title"))
+        assert [len(values) for values in spec["datasets"].values()] == [300]
+        assert spec["layer"][1]["data"]["values"] == records
+
+
+# eof
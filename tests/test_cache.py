@@ -0,0 +1,175 @@
+"""
+Unit tests for cache.py
+"""
+import threading
+import pytest
+from application.cache import LRUCache, SingleFlight, single_flight
+
+
+class FakeTimer:
+    """Manually advanced clock"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+# FIXTURES
+@pytest.fixture
+def timer():
+    return FakeTimer()
+
+
+# TESTS
+class TestLRUCache:
+    def test_get_and_set(self):
+
+        cache = LRUCache(maxsize=2)
+        assert cache.get("a") is None
+        assert cache.get("a", "default") == "default"
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+        assert cache.stats() == {"hits": 1, "misses": 2, "size": 1, "maxsize": 2}
+
+        cache.delete("a")
+        assert cache.get("a") is None
+        cache.clear()
+        assert cache.stats() == {"hits": 0, "misses": 0, "size": 0, "maxsize": 2}
+
+    def test_on_lookup(self, timer):
+
+        lookups = []
+        cache = LRUCache(maxsize=2, ttl=10, timer=timer)
+        cache.on_lookup(lookups.append)
+        cache.get("a")
+        cache.set("a", 1)
+        cache.get("a")
+        timer.now = 11
+        cache.get("a")
+        assert lookups == [False, True, False]
+
+    def test_eviction(self):
+
+        # least recently used entry is evicted first
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert len(cache) == 2
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+
+    def test_ttl(self, timer):
+
+        cache = LRUCache(maxsize=2, ttl=10, timer=timer)
+        cache.set("a", 1)
+        timer.now = 9.9
+        assert cache.get("a") == 1
+        timer.now = 10.0
+        assert cache.get("a") is None
+        assert len(cache) == 0
+        assert cache.stats()["misses"] == 1
+
+
+class Searches:
+    """Object with a slow search method, blocked until release is set"""
+
+    def __init__(self, timeout=None):
+        self.in_flight = SingleFlight(timeout)
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    @single_flight(copy=list)
+    def search(self, term, N=10):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if term == "error":
+            raise ValueError(term)
+        return [term] * N
+
+
+def run_concurrently(searches, term, callers):
+    """Starts callers threads searching for term, returns their results"""
+    results = [None] * callers
+
+    def call(i):
+        try:
+            results[i] = searches.search(term, N=2)
+        except ValueError as error:
+            results[i] = error
+
+    threads = [threading.Thread(target=call, args=(0,))]
+    threads[0].start()
+    searches.started.wait(5)
+    for i in range(1, callers):
+        threads.append(threading.Thread(target=call, args=(i,)))
+        threads[-1].start()
+    while searches.in_flight.stats()["coalesced"] < callers - 1:
+        threading.Event().wait(0.001)
+    searches.release.set()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+class TestSingleFlight:
+    def test_concurrent_calls(self):
+
+        # One call for all concurrent callers, each gets its own copy
+        searches = Searches()
+        results = run_concurrently(searches, "pasta", 5)
+        assert searches.calls == 1
+        assert results == [["pasta", "pasta"]] * 5
+        assert len({id(result) for result in results}) == 5
+        assert searches.in_flight.stats() == {
+            "in_flight": 0,
+            "coalesced": 4,
+            "timeouts": 0,
+        }
+
+        # Later calls run again, other arguments are not coalesced
+        assert searches.search("pasta", N=2) == ["pasta", "pasta"]
+        assert searches.search("pasta", N=3) == ["pasta"] * 3
+        assert searches.calls == 3
+
+    def test_errors(self):
+
+        searches = Searches()
+        results = run_concurrently(searches, "error", 3)
+        assert searches.calls == 1
+        assert all(isinstance(result, ValueError) for result in results)
+        assert searches.in_flight.stats()["in_flight"] == 0
+
+    def test_timeout(self):
+
+        # Waiting callers give up after the timeout and search themselves
+        searches = Searches(timeout=0.05)
+        leader = threading.Thread(target=searches.search, args=("pasta",))
+        leader.start()
+        searches.started.wait(5)
+        threading.Timer(0.2, searches.release.set).start()
+        assert searches.search("pasta") == ["pasta"] * 10
+        leader.join(5)
+        assert searches.calls == 2
+        assert searches.in_flight.stats()["timeouts"] == 1
+
+    def test_recursive_calls(self):
+
+        # A function calling itself with the same key does not deadlock
+        flight = SingleFlight()
+
+        def recursive(depth):
+            if depth == 0:
+                return "done"
+            return flight.do("key", recursive, depth - 1)[0]
+
+        assert flight.do("key", recursive, 2) == ("done", False)
+
+
+# eof
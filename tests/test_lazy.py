@@ -0,0 +1,42 @@
+"""
+Unit tests for lazy.py
+"""
+import sys
+from application.lazy import LazyModule, import_profile
+
+
+# TESTS
+class TestLazyModule:
+    def test_lazy_module(self):
+
+        # not imported before first use
+        sys.modules.pop("colorsys", None)
+        colorsys = LazyModule("colorsys")
+        assert "colorsys" not in sys.modules
+        assert "colorsys" in repr(colorsys)
+
+        # attributes of the module, afterwards stored on the stand-in
+        assert colorsys.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+        assert "colorsys" in sys.modules
+        assert "hsv_to_rgb" in vars(colorsys)
+        assert "hsv_to_rgb" in dir(colorsys)
+
+    def test_startup_imports(self):
+        """
+        Startup import profile: pandas, numpy, altair and scipy must not be
+        imported while creating the app (only by routes that need them)
+        """
+        profile, modules = import_profile()
+        assert modules == []
+        assert profile[0][0] == "application"
+        assert all(p[2] >= p[1] >= 0 for p in profile)
+
+        # but are imported as soon as they are used
+        profile, modules = import_profile(
+            "from application import create_app; create_app();"
+            " import application.main.altair_plots as ap; ap.alt.Chart"
+        )
+        assert "altair" in modules
+
+
+# eof
@@ -0,0 +1,132 @@
+"""
+Unit tests for metrics.py
+"""
+import os
+import subprocess
+import sys
+import pytest
+from prometheus_client import REGISTRY, CollectorRegistry, multiprocess
+from application import create_app
+
+
+# FIXTURES
+@pytest.fixture
+def app():
+    """Instantiate app context"""
+    app = create_app(testing=True, debug=False)
+    app_context = app.app_context()
+    app_context.push()
+    yield app
+    app_context.pop()
+
+
+@pytest.fixture
+def url():
+    return "pineapple-shrimp-noodle-bowls"
+
+
+def sample(name, registry=REGISTRY, **labels):
+    return registry.get_sample_value(name, labels) or 0
+
+
+# TESTS
+class TestMetrics:
+    def test_metrics(self, app, url):
+
+        from application import db
+        from application.metrics import TimedQueuePool
+
+        assert isinstance(db.engine.pool, TimedQueuePool)
+
+        labels = {"endpoint": "main.compare_recipes", "method": "GET"}
+        requests = sample("http_request_duration_seconds_count", **labels)
+        ok = sample("http_requests_total", status="200", **labels)
+        pool_waits = sample("db_pool_checkout_wait_seconds_count")
+        hits = sample("cache_lookups_total", cache="pages", result="hit")
+
+        client = app.test_client()
+        for _ in range(2):
+            assert client.get("/recipe/" + url).status_code == 200
+        assert client.get("/no/such/page").status_code == 404
+
+        assert sample("http_request_duration_seconds_count", **labels) == requests + 2
+        assert sample("http_requests_total", status="200", **labels) == ok + 2
+        assert sample(
+            "http_requests_total", endpoint="none", method="GET", status="404"
+        )
+        assert sample("http_requests_in_progress", endpoint="main.compare_recipes") == 0
+        assert sample("db_pool_checkout_wait_seconds_count") > pool_waits
+        assert sample("cache_lookups_total", cache="pages", result="hit") >= hits + 1
+
+        # Prometheus text format
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.content_type.startswith("text/plain")
+        text = response.get_data(as_text=True)
+        assert "# TYPE http_request_duration_seconds histogram" in text
+        assert (
+            'http_request_duration_seconds_bucket{endpoint="main.compare_recipes",'
+            in text
+        )
+
+    def test_access(self, app):
+
+        client = app.test_client()
+        remote = {"REMOTE_ADDR": "203.0.113.7"}
+
+        # Without token: local clients only
+        assert client.get("/metrics").status_code == 200
+        assert client.get("/metrics", environ_base=remote).status_code == 403
+
+        # With token: bearer token only
+        app.config["METRICS_TOKEN"] = "s3cret"
+        try:
+            assert client.get("/metrics").status_code == 403
+            headers = {"Authorization": "Bearer s3cret"}
+            r = client.get("/metrics", headers=headers, environ_base=remote)
+            assert r.status_code == 200
+            headers = {"Authorization": "Bearer wrong"}
+            r = client.get("/metrics", headers=headers, environ_base=remote)
+            assert r.status_code == 403
+        finally:
+            app.config["METRICS_TOKEN"] = None
+
+    def test_gunicorn_config(self):
+
+        # Sets the shared metrics directory for the workers
+        code = (
+            "import os, runpy; "
+            "runpy.run_path('gunicorn.conf.py'); "
+            "print(os.environ['PROMETHEUS_MULTIPROC_DIR'])"
+        )
+        env = {k: v for k, v in os.environ.items() if k != "PROMETHEUS_MULTIPROC_DIR"}
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            env=env,
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        assert result.stdout.strip().endswith("prometheus_multiproc")
+
+    def test_multiprocess(self, tmp_path, url):
+
+        # Two workers writing to the same metrics directory
+        code = (
+            "from application import create_app; "
+            "app = create_app(testing=True, debug=False); "
+            "assert app.test_client().get('/recipe/{}').status_code == 200"
+        ).format(url)
+        env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path))
+        for _ in range(2):
+            subprocess.run([sys.executable, "-c", code], env=env, check=True)
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=str(tmp_path))
+        labels = {"endpoint": "main.compare_recipes", "method": "GET"}
+        assert sample("http_request_duration_seconds_count", registry, **labels) == 2
+        assert sample("http_requests_total", registry, status="200", **labels) == 2
+        assert sample("db_pool_checkout_wait_seconds_count", registry) >= 2
+
+
+# eof
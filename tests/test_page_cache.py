@@ -0,0 +1,146 @@
+"""
+Unit tests for the page cache in http_cache.py
+"""
+import os
+import re
+import time
+import pytest
+from application import create_app
+from application.http_cache import FileBackend, MemoryBackend, RedisBackend
+
+
+class LocalRedis:
+    """In-process stand-in for a Redis server (get, set, scan_iter, delete)"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def scan_iter(self, pattern):
+        prefix = pattern.rstrip("*")
+        return [key for key in list(self.data) if key.startswith(prefix)]
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+# FIXTURES
+@pytest.fixture
+def app():
+    """Instantiate app context"""
+    app = create_app(testing=True, debug=False)
+    app_context = app.app_context()
+    app_context.push()
+    yield app
+    app_context.pop()
+
+
+@pytest.fixture
+def url():
+    return "/recipe/pineapple-shrimp-noodle-bowls"
+
+
+def script_nonces(response):
+    """Nonce of the CSP header and nonces of the script tags of a page"""
+    header = re.search(r"'nonce-([^']+)'", response.headers["Content-Security-Policy"])
+    tags = set(re.findall(r'<script nonce="([^"]+)"', response.get_data(as_text=True)))
+    return header.group(1), tags
+
+
+# TESTS
+class TestPageCache:
+    def test_backends(self, tmp_path):
+
+        backends = [
+            MemoryBackend(maxsize=2),
+            FileBackend(str(tmp_path / "pages")),
+            RedisBackend(LocalRedis()),
+        ]
+        for backend in backends:
+            assert backend.get("a") is None
+            backend.set("a", "<p>Crème brûlée</p>")
+            backend.set("b", "<p>Pasta</p>")
+            assert backend.get("a") == "<p>Crème brûlée</p>"
+            backend.clear()
+            assert backend.get("a") is None
+            assert backend.get("b") is None
+
+        # Expired files are removed
+        backend = FileBackend(str(tmp_path / "expiring"), ttl=-1)
+        backend.set("a", "<p>Pasta</p>")
+        assert backend.get("a") is None
+        assert not list((tmp_path / "expiring").iterdir())
+
+        # Writes remove the oldest pages beyond maxsize and expired pages
+        backend = FileBackend(str(tmp_path / "bounded"), ttl=3600, maxsize=2)
+        for i, key in enumerate(["a", "b", "c"]):
+            backend.set(key, "<p>Pasta</p>")
+            os.utime(backend.filename(key), (1000 + i, time.time() - 10 + i))
+        backend.set("d", "<p>Pasta</p>")
+        assert sorted(os.listdir(str(tmp_path / "bounded"))) == ["c.html", "d.html"]
+        os.utime(backend.filename("c"), (0, time.time() - 7200))
+        backend.maxsize = 3
+        backend.set("e", "<p>Pasta</p>")
+        assert sorted(os.listdir(str(tmp_path / "bounded"))) == ["d.html", "e.html"]
+
+    def test_cached_pages(self, app, url):
+
+        from application import page_cache
+
+        lookups = []
+        page_cache.on_lookup(lookups.append)
+        client = app.test_client()
+
+        # Second view is served from the cache (no similarity queries),
+        # with its own nonce
+        r1 = client.get(url)
+        r2 = client.get(url)
+        assert lookups == [False, True]
+        assert r1.status_code == r2.status_code == 200
+        nonce1, tags1 = script_nonces(r1)
+        nonce2, tags2 = script_nonces(r2)
+        assert nonce1 != nonce2
+        assert tags1 == {nonce1}
+        assert tags2 == {nonce2}
+        assert page_cache.nonce_placeholder not in r2.get_data(as_text=True)
+        assert page_cache.csrf_placeholder not in r2.get_data(as_text=True)
+        assert r2.headers["ETag"] == r1.headers["ETag"]
+        assert 'desc="1 queries' in r2.headers["Server-Timing"]
+
+        # Other pages and sort orders are cached separately
+        assert client.get(url + "?sort_by=Rating").status_code == 200
+        assert lookups[-1] is False
+
+        # Disabled
+        app.config["PAGE_CACHE"] = ""
+        page_cache.init_app(app)
+        client.get(url)
+        assert len(lookups) == 3
+
+    def test_not_cached(self, app, url):
+
+        from flask import flash
+
+        from application import page_cache
+
+        lookups = []
+        page_cache.on_lookup(lookups.append)
+
+        # Pages with flash messages are neither served from nor added to
+        # the cache
+        with app.test_request_context(url):
+            flash("Recipe added to cookbook")
+            assert page_cache.key("version") is None
+        with app.test_request_context(url, method="POST"):
+            assert page_cache.key("version") is None
+        with app.test_request_context(url):
+            assert page_cache.key("version") != page_cache.key("other version")
+        assert lookups == []
+
+
+# eof
@@ -0,0 +1,93 @@
+"""
+Unit tests for query_stats.py
+"""
+import logging
+import pytest
+from application import create_app
+from application.query_stats import statement_shape
+
+
+# FIXTURES
+@pytest.fixture
+def app():
+    """Instantiate app context"""
+    app = create_app(testing=True, debug=False)
+    app_context = app.app_context()
+    app_context.push()
+    yield app
+    app_context.pop()
+
+
+@pytest.fixture
+def pg(app):
+    """DB connection"""
+    from application import db
+    from application.sql_queries import Sql_queries
+
+    pg = Sql_queries(db.session)
+    pg.urls = [
+        "pineapple-shrimp-noodle-bowls",
+        "cheesy-chicken-and-broccoli-casserole",
+        "vegan-chocolate-chip-cookies",
+        "aspdoifqwpeoripoasdf",
+    ]
+    return pg
+
+
+# TESTS
+class TestQueryStats:
+    def test_statement_shape(self):
+
+        assert statement_shape(
+            'SELECT * FROM likes\n  WHERE "userID" = %(userID)s AND rating = 5'
+        ) == ('SELECT * FROM likes WHERE "userID" = ? AND rating = ?')
+        assert statement_shape(
+            "SELECT * FROM content_similarity200 WHERE url IN ('a', 'b''c', 'd')"
+        ) == statement_shape(
+            "SELECT * FROM content_similarity200 WHERE url IN (%(url_1)s)"
+        )
+
+    def test_request_stats(self, app, pg):
+
+        from application import query_stats
+
+        with app.test_request_context("/recipe/" + pg.urls[0]):
+            pg.exact_recipe_match(pg.urls[0])
+            pg.exact_recipe_match(pg.urls[-1])
+            stats = query_stats.current()
+            assert stats.count == 2
+            assert stats.rows == 1
+            assert stats.duration > 0
+            assert [s.method for s in stats.statements] == ["exact_recipe_match"] * 2
+            assert list(stats.by_method()) == ["exact_recipe_match"]
+            assert stats.server_timing().startswith("sql;dur=")
+            assert 'desc="2 queries, 1 rows"' in stats.server_timing()
+
+        # Nothing is recorded outside of requests
+        pg.exact_recipe_match(pg.urls[0])
+        assert query_stats.current() is None
+
+    def test_repeated_statements(self, app, pg, caplog):
+
+        from application import query_stats
+
+        app.config["QUERY_REPEAT_THRESHOLD"] = 2
+        with app.test_request_context("/"), caplog.at_level(logging.WARNING):
+            for url in pg.urls:
+                pg.exact_recipe_match(url)
+            assert query_stats.current().count == 4
+        warnings = [r for r in caplog.records if "N+1" in r.getMessage()]
+        assert len(warnings) == 1
+        assert "exact_recipe_match" in warnings[0].getMessage()
+
+    def test_server_timing(self, app, pg):
+
+        client = app.test_client()
+        response = client.get("/recipe/" + pg.urls[0])
+        assert response.status_code == 200
+        assert response.headers["Server-Timing"].startswith("sql;dur=")
+        response = client.get("/about")
+        assert 'desc="0 queries, 0 rows"' in response.headers["Server-Timing"]
+
+
+# eof
@@ -0,0 +1,84 @@
+"""
+Unit tests for rating_model.py
+"""
+import pytest
+import numpy as np
+from application.rating_model import RatingModel, build_rating_model
+
+
+# FIXTURES
+@pytest.fixture
+def likes():
+    """
+    Two groups of users with opposite taste: users 1-3 like recipes 10
+    and 11 and dislike 12 and 13, users 4-6 the other way around. User 7
+    has only bookmarked a recipe.
+    """
+    likes = []
+    for userID in range(1, 7):
+        group = userID <= 3
+        for recipesID in (10, 11, 12, 13):
+            liked = (recipesID <= 11) == group
+            likes.append((userID, recipesID, 5 if liked else 1))
+    likes.append((7, 10, None))
+    return likes
+
+
+@pytest.fixture
+def model(likes, tmp_path):
+    path = str(tmp_path / "rating_model.npz")
+    history = build_rating_model(
+        path, likes, factors=2, iterations=10, regularization=0.01
+    )
+    model = RatingModel()
+    model.load(path)
+    model.history = history
+    return model
+
+
+# TESTS
+class TestRatingModel:
+    def test_build(self, model, tmp_path):
+
+        assert model.loaded
+        assert model.item_ids.tolist() == [10, 11, 12, 13]
+        assert model.item_factors.shape == (4, 2)
+        assert model.mean == pytest.approx(3.0)
+        assert not list(tmp_path.glob("*.tmp.npz"))
+
+        # (iteration, seconds, RMSE) per iteration, ratings are fitted well
+        assert [h[0] for h in model.history] == list(range(1, 11))
+        assert all(h[1] >= 0 for h in model.history)
+        assert model.history[-1][2] < 0.1
+
+        model.close()
+        assert not model.loaded
+
+    def test_predict(self, model):
+
+        # a user liking 10 likely likes 11, too, but not 12 and 13
+        predictions = model.predict([11, 12, 13], [10], [5])
+        assert predictions[0] > 4
+        assert np.all(predictions[1:] < 2)
+        assert np.all((predictions >= 1) & (predictions <= 5))
+
+        # the other way around after disliking 10
+        predictions = model.predict([11, 12, 13], [10, 11], [1, None])
+        assert predictions[0] < 2
+        assert np.all(predictions[1:] > 4)
+
+        # without ratings or for unknown recipes, the mean is predicted
+        assert model.predict([10, 99]).tolist() == pytest.approx([3.0, 3.0])
+        assert model.predict([99], [10], [5]).tolist() == pytest.approx([3.0])
+        assert len(model.predict([])) == 0
+
+        # no model
+        assert RatingModel().predict([10], [10], [5]) is None
+
+    def test_no_ratings(self, tmp_path):
+
+        with pytest.raises(ValueError):
+            build_rating_model(str(tmp_path / "model.npz"), [(1, 10, None)])
+
+
+# eof
@@ -0,0 +1,112 @@
+"""
+Unit tests for recipe_catalogue.py
+"""
+import os
+import pytest
+import numpy as np
+from application.recipe_catalogue import COLUMNS, RecipeCatalogue, build_catalogue
+
+
+# FIXTURES
+def recipe(recipesID, url, title, emissions, categories="dinner;vegan"):
+    """Recipe row with the values of COLUMNS"""
+    row = dict.fromkeys(COLUMNS)
+    row.update(
+        recipesID=recipesID,
+        url=url,
+        title=title,
+        emissions=emissions,
+        emissions_log10=np.log10(emissions),
+        recipe_rawid=recipesID * 10,
+        categories=categories,
+    )
+    return tuple(row[column] for column in COLUMNS)
+
+
+@pytest.fixture
+def rows():
+    """Recipes 1, 2 and 5 (ids 0, 3 and 4 are missing)"""
+    return [
+        recipe(5, "zucchini-fritters", "Zucchini Fritters", 1.0),
+        recipe(1, "apple-pie", "Apple Pie", 10.0, categories=None),
+        recipe(2, "crème-brûlée", "Crème Brûlée", 3.0),
+    ]
+
+
+@pytest.fixture
+def catalogue(rows, tmp_path):
+    build_catalogue(str(tmp_path), rows)
+    catalogue = RecipeCatalogue()
+    catalogue.load(str(tmp_path))
+    return catalogue
+
+
+# TESTS
+class TestRecipeCatalogue:
+    def test_load(self, catalogue, tmp_path):
+
+        assert catalogue.loaded
+        assert isinstance(catalogue.numbers("emissions"), np.memmap)
+        assert not list(tmp_path.glob("tmp_*"))
+        assert (tmp_path / catalogue.version / "meta.json").exists()
+        assert 1 in catalogue and 5 in catalogue
+        assert 0 not in catalogue and 3 not in catalogue and 6 not in catalogue
+
+        catalogue.close()
+        assert not catalogue.loaded
+
+    def test_lookup(self, catalogue):
+
+        # urls (also with non-ascii characters)
+        assert catalogue.recipes_id("apple-pie") == 1
+        assert catalogue.recipes_id("crème-brûlée") == 2
+        assert catalogue.recipes_id("zucchini-fritters") == 5
+        assert catalogue.recipes_id("banana-bread") is None
+        assert catalogue.recipes_id("") is None
+
+        # rows in the given order, missing recipes left out
+        rows = catalogue.rows([2, 3, 1])
+        assert [row.recipesID for row in rows] == [2, 1]
+        assert rows[0].title == "Crème Brûlée"
+        assert rows[0].emissions == 3.0
+        assert rows[0].recipe_rawid == 20
+        assert rows[0].rating is None
+        assert rows[1][11] == "apple-pie"
+        assert catalogue.string("categories", 1) is None
+        assert catalogue.string("categories", 2) == "dinner;vegan"
+        assert np.isnan(catalogue.numbers("emissions")[3])
+
+    def test_reload(self, catalogue, rows, tmp_path):
+
+        reloads = []
+        catalogue.on_reload(lambda: reloads.append(catalogue.version))
+        version = catalogue.version
+
+        # same data, same version
+        assert build_catalogue(str(tmp_path), rows) == version
+        assert not catalogue.reload()
+
+        # new build is picked up by reload, old builds are removed
+        build_catalogue(str(tmp_path), rows[:2])
+        assert catalogue.reload()
+        assert catalogue.recipes_id("crème-brûlée") is None
+        assert reloads == [catalogue.version]
+        build_catalogue(str(tmp_path), rows[:1])
+        assert len([f for f in os.listdir(str(tmp_path)) if f != "CURRENT"]) == 2
+
+        # checks are throttled
+        catalogue.reload_interval = 3600
+        build_catalogue(str(tmp_path), rows)
+        catalogue.check_reload()
+        assert catalogue.recipes_id("crème-brûlée") is None
+        catalogue.reload_interval = 0
+        catalogue.check_reload()
+        assert catalogue.recipes_id("crème-brûlée") == 2
+
+    def test_no_recipes(self, tmp_path):
+
+        with pytest.raises(ValueError):
+            build_catalogue(str(tmp_path), [])
+
+
+# eof
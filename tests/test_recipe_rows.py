@@ -0,0 +1,106 @@
+"""
+Unit tests for recipe_rows.py
+"""
+import math
+import pytest
+from jinja2 import Template
+from application.recipe_rows import (
+    RecipeRow,
+    column,
+    select,
+    sort_rows,
+    to_float,
+    to_int,
+    to_rows,
+    to_str,
+)
+
+
+# FIXTURES
+@pytest.fixture
+def rows():
+    """Rows as returned by a search (emissions missing for one recipe)"""
+    return to_rows(
+        [
+            (1, "pasta", 2.5, None),
+            (2, "salad", None, 4),
+            (3, "curry", 1.5, 12),
+            (4, "soup", 2.5, 7),
+        ],
+        [
+            ("recipesID", to_int),
+            ("title", to_str),
+            ("emissions", to_float),
+            ("review_count", None),
+        ],
+    )
+
+
+# TESTS
+class TestRecipeRows:
+    def test_access(self, rows):
+
+        row = rows[0]
+        assert row == RecipeRow(
+            recipesID=1, title="pasta", emissions=2.5, review_count=None
+        )
+        assert row != RecipeRow(recipesID=1, title="pasta")
+        assert row.title == row["title"] == "pasta"
+        assert row.review_count is None
+        assert math.isnan(rows[1].emissions)
+        assert "user_rating" not in row
+        assert row.get("user_rating", 3) == 3
+        with pytest.raises(KeyError):
+            row["user_rating"]
+        with pytest.raises(AttributeError):
+            row.user_rating
+        with pytest.raises(AttributeError):
+            row.not_a_field = 1
+
+        # copies do not share user specific fields
+        copy = row.copy()
+        copy["user_rating"] = 5
+        assert copy.user_rating == 5
+        assert "user_rating" not in row
+        assert copy != row
+        del copy.user_rating
+        assert copy == row
+        assert row.to_dict() == {
+            "recipesID": 1,
+            "title": "pasta",
+            "emissions": 2.5,
+            "review_count": None,
+        }
+
+    def test_templates(self, rows):
+
+        template = Template(
+            "{% for df in results %}{{ df['title'] }}:"
+            "{{ df['user_rating'] if df['user_rating'] is defined else 3 }} "
+            "{% endfor %}"
+        )
+        rows[0].user_rating = 5
+        assert template.render(results=rows) == "pasta:5 salad:3 curry:3 soup:3 "
+
+    def test_sort_rows(self, rows):
+
+        ascending = sort_rows(rows, "emissions")
+        assert [r.recipesID for r in ascending] == [3, 1, 4, 2]
+        descending = sort_rows(rows, "emissions", descending=True)
+        assert [r.recipesID for r in descending] == [1, 4, 3, 2]
+        assert [r.recipesID for r in rows] == [1, 2, 3, 4]
+
+        # fields that are missing or None sort last
+        assert [r.recipesID for r in sort_rows(rows, "review_count")] == [2, 4, 3, 1]
+        assert [r.recipesID for r in sort_rows(rows, "user_rating")] == [1, 2, 3, 4]
+
+        assert select(rows, [3, 0]) == [rows[3], rows[0]]
+        assert list(column(rows, "title", dtype=object)) == [
+            "pasta",
+            "salad",
+            "curry",
+            "soup",
+        ]
+
+
+# eof
@@ -0,0 +1,91 @@
+"""
+Unit tests for recommender.py
+"""
+import pytest
+import numpy as np
+from application.recommender import Recommender, build_recommender, preferences
+from application.similarity_store import build_store, SimilarityStore
+
+
+# FIXTURES
+@pytest.fixture
+def recommender(tmp_path):
+    """
+    Users 1 and 2 like recipes 10 and 11, user 2 also likes 12,
+    user 3 dislikes 12 and likes 13.
+    """
+    likes = [
+        (1, 10, 5),
+        (1, 11, 5),
+        (2, 10, 5),
+        (2, 11, 5),
+        (2, 12, 5),
+        (3, 12, 1),
+        (3, 13, 5),
+    ]
+    path = str(tmp_path / "recommender.npz")
+    assert build_recommender(path, likes, k=2) == (4, 2)
+    recommender = Recommender()
+    recommender.load(path)
+    return recommender
+
+
+# TESTS
+class TestRecommender:
+    def test_preferences(self):
+
+        assert preferences([5, 1, 3, None]).tolist() == [1.0, -1.0, 0.5, 0.5]
+
+    def test_build(self, recommender, tmp_path):
+
+        assert recommender.loaded
+        assert recommender.item_ids.tolist() == [10, 11, 12, 13]
+        assert not list(tmp_path.glob("*.tmp.npz"))
+
+        # 10 and 11 have identical columns, 13 has no positive neighbour
+        assert recommender.neighbours[0, 0] == 11
+        assert recommender.scores[0, 0] == pytest.approx(1.0)
+        assert recommender.neighbours[3].tolist() == [12, -1]
+        assert recommender.scores[3, 0] < 0
+
+        recommender.close()
+        assert not recommender.loaded
+
+    def test_recommend(self, recommender):
+
+        # liking 10 suggests 11 first, then 12, never the recipe itself
+        recipesIDs, scores = recommender.recommend([10], [5])
+        assert recipesIDs.tolist() == [11, 12]
+        assert np.all(np.diff(scores) <= 0)
+        assert recommender.recommend([10], [5], N=1)[0].tolist() == [11]
+
+        # user 3 likes 13 but dislikes 12: liking 13 does not suggest 12,
+        # disliking 13 makes 12 more likely
+        assert 12 not in recommender.recommend([13], [5])[0].tolist()
+        assert recommender.recommend([10, 13], [5, 1])[0].tolist() == [12, 11]
+
+        # unknown recipes and empty cookbooks
+        assert len(recommender.recommend([99], [5])[0]) == 0
+        assert len(recommender.recommend([], [])[0]) == 0
+        assert len(Recommender().recommend([10], [5])[0]) == 0
+
+    def test_content_similarity(self, tmp_path):
+
+        build_store(
+            str(tmp_path),
+            [(1, 1, 3, 2), (3, 3, 1, 2)],
+            [(1, 1.0, 0.5, 0.25), (3, 1.0, 0.5, 0.125)],
+            (4, 3),
+        )
+        store = SimilarityStore()
+        store.load(str(tmp_path))
+
+        # without collaborative filtering data, content similarity is used
+        recipesIDs, scores = Recommender().recommend([1], [5], similarity_store=store)
+        assert recipesIDs.tolist() == [3, 2]
+        assert scores == pytest.approx([0.3 * 0.5, 0.3 * 0.25])
+        recipesIDs, _ = Recommender().recommend([1, 3], [5, 5], similarity_store=store)
+        assert recipesIDs.tolist() == [2]
+
+
+# eof
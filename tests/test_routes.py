@@ -81,6 +81,19 @@ def logout(test_client):
     return test_client.get(url_for("auth.logout"), follow_redirects=True)
 
 
+def user_likes(pg, userID, urls):
+    """(user_rating, bookmarked) of a user's likes rows by recipe url"""
+    urls_by_id = {pg.query_recipes_id(url): url for url in urls}
+    overlay = pg.query_user_overlay(userID, list(urls_by_id))
+    return {urls_by_id[recipesID]: like for recipesID, like in overlay.items()}
+
+
+def search_titles(r):
+    """Titles of the recipe cards of a page, in order"""
+    soup = BeautifulSoup(r.data, "html.parser")
+    return [div.text.strip() for div in soup.find_all("div", class_="search-title")]
+
+
 def route_meta_tag(r):
     """
     Given the html output from a test_client get or post call
@@ -178,6 +191,15 @@ class TestRoutesMain:
                 )
                 assert route_meta_tag(r) == "main.compare_recipes"
 
+        # Unknown sort options (tampered urls) sort by similarity
+        reference = url_for("main.compare_recipes", search_term=search_term)
+        expected = test_client.get(reference, query_string={"sort_by": "Similarity"})
+        for sort_by in ["title", "foo"]:
+            r = test_client.get(reference, query_string={"sort_by": sort_by})
+            assert r.status_code == 200
+            assert route_meta_tag(r) == "main.compare_recipes"
+            assert search_titles(r) == search_titles(expected)
+
         # There is no exact recipe match
         search_term = par.search_terms[1]
         r = test_client.get(
@@ -187,6 +209,113 @@ class TestRoutesMain:
         )
         assert route_meta_tag(r) == "main.search_results"
 
+    def test_predicted_rating(self, app):
+
+        from flask import render_template_string, session
+        from application.main.forms import EmptyForm
+        from application.recipe_rows import RecipeRow
+
+        template = (
+            "{% from 'recipe-macro.html' import ratingButtons with context %}"
+            "{{ ratingButtons(recipe, 'main.search_results', None, like_form) }}"
+        )
+        with app.test_request_context():
+            session["search_query"] = ""
+            recipe = RecipeRow(url="pasta", user_rating=3, predicted_rating=4.26)
+            html = render_template_string(
+                template, recipe=recipe, like_form=EmptyForm()
+            )
+            soup = BeautifulSoup(html, "html.parser")
+            assert soup.find(class_="predicted-rating").text.split() == ["4.3"]
+
+            # No prediction (anonymous users) or no rating model (NaN)
+            for recipe in [
+                RecipeRow(url="pasta"),
+                RecipeRow(url="pasta", predicted_rating=float("nan")),
+            ]:
+                html = render_template_string(
+                    template, recipe=recipe, like_form=EmptyForm()
+                )
+                assert "predicted-rating" not in html
+
+    def test_catalogue_reload(self, test_client):
+
+        from application import recipe_catalogue
+        from application.main.routes import sq
+
+        # Caches of catalogue data are emptied after reloads
+        sq.query_emissions_histogram()
+        assert sq.emissions_histograms
+        for callback in recipe_catalogue.reload_callbacks:
+            callback()
+        assert sq.emissions_histograms == {}
+        assert sq.search_cache.stats()["size"] == 0
+
+        # Recipes added before a reload can be found by fuzzy searches
+        # (changes are rolled back)
+        url = "zyxwvut-stew"
+        assert url not in [r.url for r in sq.fuzzy_search("zyxwvt-stew", N=5)]
+        try:
+            sq.session.execute(
+                """
+                INSERT INTO recipes ("recipesID", "title", "url")
+                SELECT MAX("recipesID") + 1, 'Zyxwvut Stew', :url FROM recipes
+                """,
+                {"url": url},
+            )
+            for callback in recipe_catalogue.reload_callbacks:
+                callback()
+            assert sq.trigram_index is None
+            results = sq.fuzzy_search("zyxwvt-stew", N=5)
+            assert results[0].url == url
+        finally:
+            sq.session.rollback()
+            sq.reset_trigram_index()
+
+    def test_conditional_get(self, test_client, user, par):
+
+        for url in [
+            url_for("main.compare_recipes", search_term=par.recipe_tag),
+            url_for("main.search_results", search_term=par.search_terms[1]),
+        ]:
+            # Repeat views of anonymous users are not rendered again
+            r = test_client.get(url)
+            assert r.status_code == 200
+            etag = r.headers["ETag"]
+            assert r.headers["Cache-Control"] == "private, no-cache"
+            r = test_client.get(url, headers={"If-None-Match": etag})
+            assert r.status_code == 304
+            assert r.data == b""
+            assert "Content-Security-Policy" not in r.headers
+            r = test_client.get(url, headers={"If-None-Match": '"outdated"'})
+            assert r.status_code == 200
+            assert r.headers["ETag"] == etag
+
+        # Other sort orders or pages are different pages
+        r = test_client.get(
+            url_for("main.compare_recipes", search_term=par.recipe_tag, page=1),
+            headers={"If-None-Match": etag},
+        )
+        assert r.status_code == 200
+
+        # Pages of logged in users are always rendered
+        login(test_client, user.name, user.pw)
+        url = url_for("main.compare_recipes", search_term=par.recipe_tag)
+        r = test_client.get(url)
+        assert "ETag" not in r.headers
+        logout(test_client)
+
+    def test_compression(self, test_client, par):
+
+        url = url_for("main.search_results", search_term=par.search_terms[1])
+        for encoding in ["br", "gzip"]:
+            r = test_client.get(url, headers={"Accept-Encoding": encoding})
+            assert r.status_code == 200
+            assert r.headers["Content-Encoding"] == encoding
+        r = test_client.get(url)
+        assert "Content-Encoding" not in r.headers
+        assert route_meta_tag(r) == "main.search_results"
+
     def test_cookbook(self, test_client, user):
         """Endpoint check"""
 
@@ -385,7 +514,7 @@ class TestRoutesMain:
 
         # Ensure recipe rating is 3 (default = unrated)
         pg.rate_recipe(user.userID, par.recipe_tag, 3)
-        rating = pg.query_user_ratings(user.userID, [par.recipe_tag]).user_rating[0]
+        rating = user_likes(pg, user.userID, [par.recipe_tag])[par.recipe_tag][0]
         assert rating == 3
 
         # logged out: Redirect to auth.signin
@@ -408,7 +537,7 @@ class TestRoutesMain:
             assert route_meta_tag(r) == "auth.signin"
 
         # Assert rating is still 3
-        rating = pg.query_user_ratings(user.userID, [par.recipe_tag]).user_rating[0]
+        rating = user_likes(pg, user.userID, [par.recipe_tag])[par.recipe_tag][0]
         assert rating == 3
 
         # logged in: Redirect back to origin
@@ -428,7 +557,7 @@ class TestRoutesMain:
             )
             assert r.status_code == 200
             assert route_meta_tag(r) == origin
-            rating = pg.query_user_ratings(user.userID, [par.recipe_tag]).user_rating[0]
+            rating = user_likes(pg, user.userID, [par.recipe_tag])[par.recipe_tag][0]
             assert rating == 5
 
         # coming from a random page that is not expected
@@ -454,7 +583,7 @@ class TestRoutesMain:
 
         # Ensure recipe rating is 3 (default = unrated)
         pg.rate_recipe(user.userID, par.recipe_tag, 3)
-        rating = pg.query_user_ratings(user.userID, [par.recipe_tag]).user_rating[0]
+        rating = user_likes(pg, user.userID, [par.recipe_tag])[par.recipe_tag][0]
         assert rating == 3
 
         # logged out: Redirect to auth.signin
@@ -477,7 +606,7 @@ class TestRoutesMain:
             assert route_meta_tag(r) == "auth.signin"
 
         # Assert rating is still 3
-        rating = pg.query_user_ratings(user.userID, [par.recipe_tag]).user_rating[0]
+        rating = user_likes(pg, user.userID, [par.recipe_tag])[par.recipe_tag][0]
         assert rating == 3
 
         # logged in: Redirect back to origin
@@ -497,7 +626,7 @@ class TestRoutesMain:
             )
             assert r.status_code == 200
             assert route_meta_tag(r) == origin
-            rating = pg.query_user_ratings(user.userID, [par.recipe_tag]).user_rating[0]
+            rating = user_likes(pg, user.userID, [par.recipe_tag])[par.recipe_tag][0]
             assert rating == 1
 
         # coming from a random page that is not expected
@@ -523,7 +652,7 @@ class TestRoutesMain:
 
         # Ensure recipe rating is 1 (disliked)
         pg.rate_recipe(user.userID, par.recipe_tag, 1)
-        rating = pg.query_user_ratings(user.userID, [par.recipe_tag]).user_rating[0]
+        rating = user_likes(pg, user.userID, [par.recipe_tag])[par.recipe_tag][0]
         assert rating == 1
 
         # logged out: Redirect to auth.signin
@@ -546,7 +675,7 @@ class TestRoutesMain:
             assert route_meta_tag(r) == "auth.signin"
 
         # Assert rating is still 3
-        rating = pg.query_user_ratings(user.userID, [par.recipe_tag]).user_rating[0]
+        rating = user_likes(pg, user.userID, [par.recipe_tag])[par.recipe_tag][0]
         assert rating == 1
 
         # logged in: Redirect back to origin
@@ -566,7 +695,7 @@ class TestRoutesMain:
             )
             assert r.status_code == 200
             assert route_meta_tag(r) == origin
-            rating = pg.query_user_ratings(user.userID, [par.recipe_tag]).user_rating[0]
+            rating = user_likes(pg, user.userID, [par.recipe_tag])[par.recipe_tag][0]
             assert rating == 3
 
         # coming from a random page that is not expected
@@ -582,6 +711,117 @@ class TestRoutesMain:
         )
         assert route_meta_tag(r) == "main.home"
 
+    def test_api_rate_recipe(self, test_client, pg, par):
+        """
+        JSON variant of like / dislike / unlike used by recipe_actions.js
+        to update a recipe card without reloading the page.
+        """
+        pg.rate_recipe(user.userID, par.recipe_tag, 3)
+
+        # logged out: Redirect to auth.signin, rating unchanged
+        logout(test_client)
+        r = test_client.post(
+            url_for("main.api_rate_recipe", action="like", recipe_url=par.recipe_tag),
+            follow_redirects=True,
+        )
+        assert route_meta_tag(r) == "auth.signin"
+        rating = user_likes(pg, user.userID, [par.recipe_tag])[par.recipe_tag][0]
+        assert rating == 3
+
+        # logged in: new rating as JSON
+        login(test_client, user.name, user.pw)
+        for (action, expected) in [("like", 5), ("dislike", 1), ("unlike", 3)]:
+            r = test_client.post(
+                url_for(
+                    "main.api_rate_recipe", action=action, recipe_url=par.recipe_tag
+                )
+            )
+            assert r.status_code == 200
+            assert r.get_json() == {"url": par.recipe_tag, "user_rating": expected}
+            likes = user_likes(pg, user.userID, [par.recipe_tag])
+            assert likes[par.recipe_tag][0] == expected
+
+        # unknown action
+        r = test_client.post(
+            url_for("main.api_rate_recipe", action="love", recipe_url=par.recipe_tag)
+        )
+        assert r.status_code == 404
+
+        # unknown recipe
+        r = test_client.post(
+            url_for("main.api_rate_recipe", action="like", recipe_url="no-such-recipe")
+        )
+        assert r.status_code == 404
+
+    def test_api_bookmark(self, test_client, pg, par):
+        """JSON variant of add_or_remove_bookmark"""
+
+        login(test_client, user.name, user.pw)
+        likes = user_likes(pg, user.userID, [par.recipe_tag])
+        bookmarked = bool(likes.get(par.recipe_tag, (None, False))[1])
+
+        # toggles twice, back to the initial state
+        for expected in [not bookmarked, bookmarked]:
+            r = test_client.post(
+                url_for("main.api_bookmark", recipe_url=par.recipe_tag)
+            )
+            assert r.status_code == 200
+            assert r.get_json() == {"url": par.recipe_tag, "bookmarked": expected}
+
+        # unknown recipe
+        r = test_client.post(url_for("main.api_bookmark", recipe_url="no-such-recipe"))
+        assert r.status_code == 404
+
+        # cookbook cards remove their bookmark with the api as well
+        pg.add_to_cookbook(user.userID, par.recipe_tag)
+        r = test_client.get(url_for("main.cookbook"))
+        soup = BeautifulSoup(r.data, "html.parser")
+        apis = [f["data-api"] for f in soup.find_all("form", "js-remove-bookmark")]
+        assert url_for("main.api_bookmark", recipe_url=par.recipe_tag) in apis
+        if not bookmarked:
+            pg.remove_from_cookbook(user.userID, par.recipe_tag)
+
+    def test_api_batch(self, test_client, pg, par):
+        """Many ratings and bookmark changes in one request"""
+
+        url = url_for("main.api_batch")
+        operations = [
+            {"url": par.recipe_tag, "rating": 1},
+            {"url": par.recipe_tag, "rating": 5, "bookmarked": True},
+            {"url": "no-such-recipe", "rating": 5},
+        ]
+
+        # logged out: Redirect to auth.signin
+        logout(test_client)
+        r = test_client.post(url, json={"operations": operations})
+        assert r.status_code == 302
+
+        # logged in
+        login(test_client, user.name, user.pw)
+        r = test_client.post(url, json={"operations": operations})
+        assert r.status_code == 200
+        assert r.get_json() == {
+            "updated": 1,
+            "removed": 0,
+            "invalid": ["no-such-recipe"],
+        }
+        rating = user_likes(pg, user.userID, [par.recipe_tag])[par.recipe_tag][0]
+        assert rating == 5
+
+        # invalid requests
+        for payload in [
+            None,
+            {"operations": "like"},
+            {"operations": [{"rating": 5}]},
+            {"operations": [{"url": par.recipe_tag, "rating": 7}]},
+            {"operations": [{"url": par.recipe_tag, "bookmarked": "yes"}]},
+            {"operations": [{"url": par.recipe_tag}]},
+            {"operations": [{"url": par.recipe_tag, "rating": 5}] * 1001},
+        ]:
+            r = test_client.post(url, json=payload)
+            assert r.status_code == 400
+            assert "error" in r.get_json()
+
 
 class TestRoutesAuth:
     def test_signup(self, test_client, user, pg):
@@ -0,0 +1,91 @@
+"""
+Unit tests for schema_cache.py
+"""
+import pickle
+import pytest
+from sqlalchemy import MetaData, event
+from application import create_app
+from application.schema_cache import reflect_metadata, schema_hash
+
+
+# FIXTURES
+@pytest.fixture
+def engine():
+    """DB engine of the app"""
+    from application import db
+
+    app = create_app(testing=True, debug=False)
+    with app.app_context():
+        yield db.engine
+
+
+def count_queries(engine, function, *args):
+    """Calls function and returns its result and the number of DB queries"""
+    queries = []
+
+    def listener(*args):
+        queries.append(args)
+
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        result = function(*args)
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    return result, len(queries)
+
+
+# TESTS
+class TestSchemaCache:
+    def test_reflect_metadata(self, engine, tmp_path):
+
+        path = str(tmp_path / "schema.pickle")
+        tables = ["consent", "content_similarity200", "likes", "recipes", "users"]
+
+        # without path: plain reflection
+        metadata = MetaData()
+        assert not reflect_metadata(metadata, engine)
+        assert not (tmp_path / "schema.pickle").exists()
+
+        # first call reflects and writes the snapshot
+        reflected = MetaData()
+        assert not reflect_metadata(reflected, engine, path)
+        assert (tmp_path / "schema.pickle").exists()
+        assert not list(tmp_path.glob("*.tmp"))
+
+        # later calls only query the schema hash
+        cached = MetaData()
+        loaded, queries = count_queries(engine, reflect_metadata, cached, engine, path)
+        assert loaded
+        assert queries == 1
+        assert sorted(cached.tables) == sorted(metadata.tables)
+        for name in tables:
+            assert [c.name for c in cached.tables[name].columns] == [
+                c.name for c in metadata.tables[name].columns
+            ]
+            assert [c.name for c in cached.tables[name].primary_key] == [
+                c.name for c in metadata.tables[name].primary_key
+            ]
+
+    def test_refresh(self, engine, tmp_path):
+
+        path = str(tmp_path / "schema.pickle")
+        reflect_metadata(MetaData(), engine, path)
+
+        # a snapshot of another schema is replaced
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+        snapshot["version"] = snapshot["version"][:2] + ("outdated",)
+        with open(path, "wb") as f:
+            pickle.dump(snapshot, f)
+        assert not reflect_metadata(MetaData(), engine, path)
+        with open(path, "rb") as f:
+            assert pickle.load(f)["version"][2] == schema_hash(engine)
+
+        # as is a broken one
+        with open(path, "wb") as f:
+            f.write(b"broken")
+        assert not reflect_metadata(MetaData(), engine, path)
+        assert reflect_metadata(MetaData(), engine, path)
+
+
+# eof
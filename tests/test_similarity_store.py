@@ -0,0 +1,72 @@
+"""
+Unit tests for similarity_store.py
+"""
+import pytest
+import numpy as np
+from application.similarity_store import SimilarityStore, build_store
+
+
+# FIXTURES
+@pytest.fixture
+def store(tmp_path):
+    """Store with similarity data for recipes 1 and 3 (but not 0 and 2)"""
+    ids_rows = [(1, 1, -3, 2), (3, 3, 1, -2)]
+    scores_rows = [(1, 1.0, 0.5, -0.25), (3, 1.0, 0.5, 0.125)]
+    sort_keys = {"sustainability": [0.0, 5.0, 1.0, 2.0]}
+    build_store(str(tmp_path), ids_rows, scores_rows, (4, 3), sort_keys=sort_keys)
+    store = SimilarityStore()
+    store.load(str(tmp_path))
+    return store
+
+
+# TESTS
+class TestSimilarityStore:
+    def test_load(self, store, tmp_path):
+
+        assert store.loaded
+        assert store.ids.dtype == np.int32
+        assert store.scores.dtype == np.float32
+        assert isinstance(store.ids, np.memmap)
+        assert not list(tmp_path.glob("tmp_*"))
+
+        store.close()
+        assert not store.loaded
+
+    def test_lookup(self, store):
+
+        # absolute ids and scores, ordered as in the DB tables
+        ids, scores = store.lookup(1)
+        assert ids.tolist() == [1, 3, 2]
+        assert scores.tolist() == [1.0, 0.5, 0.25]
+        ids, scores = store.lookup(3)
+        assert ids.tolist() == [3, 1, 2]
+
+        # recipes without similarity data
+        assert store.lookup(0) == (None, None)
+        assert store.lookup(2) == (None, None)
+        assert store.lookup(4) == (None, None)
+        assert store.lookup(-1) == (None, None)
+
+    def test_ordering(self, store):
+
+        # recipe 1: similar recipes [3, 2] have keys [2.0, 1.0]
+        assert store.ordering(1, "Sustainability").tolist() == [1, 0]
+        assert store.ordering(1, "sustainability").tolist() == [1, 0]
+
+        # recipe 3: similar recipes [1, 2] have keys [5.0, 1.0]
+        assert store.ordering(3, "Sustainability").tolist() == [1, 0]
+
+        # unknown sort options and recipes
+        assert store.ordering(1, "Rating") is None
+        assert store.ordering(1, None) is None
+        assert store.ordering(4, "Sustainability") is None
+
+    def test_float16(self, tmp_path):
+
+        build_store(str(tmp_path), [(0, 0)], [(0, 1.0)], (1, 1), "float16")
+        store = SimilarityStore()
+        store.load(str(tmp_path))
+        assert store.scores.dtype == np.float16
+
+
+# eof
@@ -1,9 +1,10 @@
 """
 Unit tests for sql_queries.py
 """
+import math
 import pytest
 import sqlalchemy
-import pandas as pd
+from collections import Counter
 from application import create_app
 from dotenv import load_dotenv
 
@@ -80,6 +81,59 @@ def create_dummy_account(pg):
     assert user.email == pg.dummy_email
 
 
+def user_likes(pg, userID, urls):
+    """(user_rating, bookmarked) of a user's likes rows by recipe url"""
+    urls_by_id = {pg.query_recipes_id(url): url for url in urls}
+    overlay = pg.query_user_overlay(userID, list(urls_by_id))
+    return {urls_by_id[recipesID]: like for recipesID, like in overlay.items()}
+
+
+def write_paths(pg):
+    """
+    Write paths of the likes table to test: the single statement upserts
+    need the unique index of "flask likes index" (which deletes duplicate
+    likes, so the tests never create it), the fallback always works
+    """
+    return [True, False] if pg.has_likes_unique_index() else [False]
+
+
+def check_cookbook_pages(pg):
+    """Cookbook order and pages (offset and keyset) of every sort option"""
+
+    # Ordered in the database, missing values last, ties by recipesID
+    for sort_by, column, sign in [
+        ("Sustainability", "emissions", 1),
+        ("User_Rating", "user_rating", -1),
+        ("Perc_Rating", "perc_rating", -1),
+    ]:
+        cookbook = pg.query_cookbook(pg.userID, sort_by=sort_by)
+        expected = sorted(
+            cookbook,
+            key=lambda r: (
+                math.isnan(r[column]),
+                0 if math.isnan(r[column]) else sign * r[column],
+                sign * r.recipesID,
+            ),
+        )
+        assert [r.recipesID for r in cookbook] == [r.recipesID for r in expected]
+
+        # Offset and keyset pagination return the same pages
+        Np = 2
+        after = None
+        for page in range((len(cookbook) + Np - 1) // Np):
+            by_offset = pg.query_cookbook(
+                pg.userID, sort_by=sort_by, limit=Np, offset=page * Np
+            )
+            by_key = pg.query_cookbook(
+                pg.userID, sort_by=sort_by, limit=Np, after=after
+            )
+            expected_ids = [r.recipesID for r in cookbook[page * Np : (page + 1) * Np]]
+            assert [r.recipesID for r in by_offset] == expected_ids
+            assert [r.recipesID for r in by_key] == expected_ids
+            after = by_key[-1].recipesID
+        assert pg.query_cookbook(pg.userID, sort_by, limit=Np, after=after) == []
+
+
 # TESTS
 class TestSqlQueries:
     def test_fuzzy_search(self, app, pg):
@@ -98,6 +152,16 @@ class TestSqlQueries:
         with pytest.raises(sqlalchemy.exc.DataError):
             pg.fuzzy_search(pg.fuzzy_search_term, N=pg.sql_inj1)
 
+    def test_trigram_candidates(self, pg):
+
+        # misspelled url still finds the correct recipe among candidates
+        result = pg.trigram_candidates("pinaple-shrimp-nodle-bowls", N=10)
+        assert len(result) == 10
+        assert pg.recipesID in result
+
+        # sql injections
+        assert isinstance(pg.trigram_candidates(pg.sql_inj1, N=2), tuple)
+
     def test_phrase_search(self, pg):
 
         # normal querries
@@ -174,6 +238,95 @@ class TestSqlQueries:
         result = pg.query_similar_recipes(CS_ids[0:2])
         assert len(result) == 2
 
+    def test_query_content_based_search(self, pg):
+
+        # normal querries (reference recipe first, ordered by similarity)
+        result = pg.query_content_based_search(pg.search_term)
+        assert 1 < len(result) <= 200
+        assert result[0][0] == pg.recipesID
+        assert result[0][-1] == 1.0
+        similarity = [row[-1] for row in result]
+        assert similarity == sorted(similarity, reverse=True)
+        CS_ids = pg.query_content_similarity_ids(pg.search_term)
+        assert [row[0] for row in result[0:10]] == list(CS_ids[0:10])
+
+        # sql injections
+        assert len(pg.query_content_based_search(pg.sql_inj1)) == 0
+        assert len(pg.query_content_based_search(pg.sql_inj2)) == 0
+
+    def test_recipe_catalogue(self, pg, tmp_path):
+
+        from application import recipe_catalogue
+
+        # expected results from the recipes table
+        CS_ids = pg.query_content_similarity_ids(pg.search_term)[0:20]
+        expected = pg.query_similar_recipes(CS_ids)
+        histogram = pg.query_emissions_histogram(bins=30)
+
+        # export recipes table and load it as memory-mapped catalogue
+        version, Nrecipes = pg.export_recipe_catalogue(str(tmp_path))
+        assert Nrecipes > 0
+        recipe_catalogue.load(str(tmp_path))
+        try:
+            assert recipe_catalogue.version == version
+            result = pg.query_similar_recipes(CS_ids)
+            result = {row[0]: row for row in result}
+            for row in expected:
+                for value, expected_value in zip(result[row[0]], row):
+                    if expected_value is None or isinstance(expected_value, str):
+                        assert value == expected_value
+                    else:
+                        assert value == pytest.approx(float(expected_value))
+            assert pg.query_recipes_id(pg.url) == pg.recipesID
+            assert pg.exact_recipe_match(pg.url)
+            assert not pg.exact_recipe_match(pg.urls_dont_exist[0])
+            assert not pg.exact_recipe_match(pg.sql_inj1)
+            assert (
+                pg.query_emissions_histogram(bins=30)["count"].sum()
+                == histogram["count"].sum()
+            )
+        finally:
+            recipe_catalogue.close()
+
+    def test_similarity_store(self, pg, tmp_path):
+
+        from application import similarity_store
+
+        # export similarity tables and load them as memory-mapped store
+        shape = pg.export_similarity_store(str(tmp_path))
+        assert shape[0] > pg.recipesID
+        similarity_store.load(str(tmp_path))
+
+        # search results are the same as when querying the similarity tables
+        try:
+            result = pg.query_content_based_search_store(pg.search_term)
+            expected = pg.query_content_based_search(pg.search_term)
+            assert [row[0] for row in result] == [row[0] for row in expected]
+            assert result[0][-1] == 1.0
+            result = pg.build_content_based_results(pg.search_term)
+            assert result[0].similarity == 1
+            assert pg.query_content_based_search_store(pg.sql_inj1) == []
+
+            # precomputed orderings match sorting all similar recipes
+            import application.main.helper_functions as hf
+
+            results = result[1:]
+            for sort_by, column in [
+                ("Sustainability", "emissions"),
+                ("Rating", "rating"),
+            ]:
+                ordering = similarity_store.ordering(pg.recipesID, sort_by)
+                expected = [
+                    row[column] for row in hf.sort_search_results(results, sort_by)
+                ]
+                for page in range(0, 10):
+                    page_results = hf.select_page(results, sort_by, page, 20, ordering)
+                    assert [row[column] for row in page_results] == expected[
+                        page * 20 : (page + 1) * 20
+                    ]
+        finally:
+            similarity_store.close()
+
     def test_exact_recipe_match(self, pg):
 
         assert pg.exact_recipe_match(pg.url) is True
@@ -182,8 +335,17 @@ class TestSqlQueries:
     def test_content_based_search(self, pg):
 
         result = pg.content_based_search(pg.search_term)
-        assert result.iloc[0]["similarity"] == 1.0
-        assert result.iloc[1]["similarity"] > 0.45
+        assert result[0].similarity == 1.0
+        assert result[1].similarity > 0.45
+
+        # second search is served from cache, changing results does not
+        # change the cache
+        result[0].user_rating = 5
+        cached = pg.content_based_search(pg.search_term)
+        assert pg.search_cache.stats()["hits"] == 1
+        assert pg.search_cache.stats()["misses"] == 1
+        assert "user_rating" not in cached[0]
+        assert [r.recipesID for r in cached] == [r.recipesID for r in result]
 
     def test_search_recipes(self, pg):
         # TODO test proper function of N parameter
@@ -191,46 +353,193 @@ class TestSqlQueries:
         # exact match
         res = pg.search_recipes(pg.search_term)
         assert res is not None
-        assert res["title"].tolist()[0].lower() == pg.search_term.replace("-", " ")
+        assert res[0].title.lower() == pg.search_term.replace("-", " ")
 
         # fuzzy match
         pg.search_recipes(pg.fuzzy_search_term)
         assert res is not None
-        assert res["title"].tolist()[0].lower() != pg.fuzzy_search_term.replace(
-            "-", " "
-        )
+        assert res[0].title.lower() != pg.fuzzy_search_term.replace("-", " ")
 
-    def test_query_all_recipe_emissions(self, pg):
+    def test_query_emissions_histogram(self, pg):
 
-        df = pg.query_all_recipe_emissions()
-        assert sorted(list(df.columns.values)) == [
-            "emissions",
-            "emissions_log10",
-            "recipesID",
-            "title",
-            "url",
+        import numpy as np
+
+        from application.sql_queries import EMISSIONS_BINS
+
+        df = pg.query_emissions_histogram()
+        assert list(df.columns) == ["bin_start", "bin_end", "count"]
+        assert df.shape[0] == EMISSIONS_BINS
+        assert df["bin_start"].iloc[0] == -1.0
+        assert df["bin_end"].iloc[-1] == 2.0
+
+        # Same counts as binning all recipes in numpy (up to values on bin edges)
+        emissions = [
+            float(row[0])
+            for row in pg.session.execute("SELECT emissions_log10 FROM recipes")
         ]
-        assert df.shape[0] > 36000
+        expected, _ = np.histogram(emissions, bins=EMISSIONS_BINS, range=(-1.0, 2.0))
+        assert np.abs(df["count"].values - expected).sum() <= 2
+
+        # Cached
+        assert pg.query_emissions_histogram() is df
 
     def test_query_cookbook(self, pg):
 
         result = pg.query_cookbook(pg.userID)
-        assert result["username"][0] == "asdfjlq;weruioasdnf"
+        assert result[0].username == "asdfjlq;weruioasdnf"
         assert len(result) < 50
         result = pg.query_cookbook(999999999)
         assert len(result) == 0
 
-    def test_query_bookmarks(self, pg):
+    def test_query_cookbook_pages(self, pg):
+
+        check_cookbook_pages(pg)
+
+        # Recipes without sort keys come last, also with keyset pagination
+        # (changes are rolled back)
+        try:
+            pg.session.execute(
+                """
+                UPDATE recipes SET emissions = NULL, perc_rating = NULL
+                WHERE "recipesID" IN (
+                    SELECT l."recipesID" FROM users u
+                    JOIN likes l ON (u.username = l.username)
+                    WHERE u."userID" = :userID
+                    ORDER BY l."recipesID" LIMIT 3
+                )
+                """,
+                {"userID": pg.userID},
+            )
+            pg.session.execute(
+                """
+                UPDATE likes SET rating = NULL
+                WHERE ("username", "recipesID") IN (
+                    SELECT l.username, l."recipesID" FROM users u
+                    JOIN likes l ON (u.username = l.username)
+                    WHERE u."userID" = :userID
+                    ORDER BY l."recipesID" DESC LIMIT 3
+                )
+                """,
+                {"userID": pg.userID},
+            )
+            cookbook = pg.query_cookbook(pg.userID)
+            assert sum(math.isnan(r.emissions) for r in cookbook) == 3
+            check_cookbook_pages(pg)
+        finally:
+            pg.session.rollback()
+
+    def test_query_cookbook_histogram(self, pg):
+
+        import numpy as np
+
+        # Same bins and counts as binning the cookbook in numpy, bins line
+        # up with the histogram of all recipes
+        cookbook = pg.query_cookbook(pg.userID, sort_by="Sustainability")
+        emissions = [row.emissions_log10 for row in cookbook]
+        counts, edges = np.histogram(emissions, bins=150, range=(-1.0, 2.0))
+        records = pg.query_cookbook_histogram(pg.userID, max_titles=1)
+        assert [record["count"] for record in records] == list(counts[counts > 0])
+        assert [record["bin_start"] for record in records] == pytest.approx(
+            list(edges[:-1][counts > 0])
+        )
+        background = pg.query_emissions_histogram()
+        assert set(record["bin_start"] for record in records) <= set(
+            background["bin_start"]
+        )
 
-        # un-bookmark url
-        pg.remove_from_cookbook(pg.userID, pg.url_bookmark)
-        df = pg.query_bookmarks(pg.userID, [pg.url_bookmark])
-        assert df.empty
+        # Titles and url of the recipe with the lowest emissions in a bin
+        lowest = min(cookbook, key=lambda row: (row.emissions_log10, row.recipesID))
+        assert records[0]["url"] == lowest.url
+        assert records[0]["titles"].split(", ")[0] == lowest.title
+        for record in records:
+            assert record["titles"].endswith(", ...") == (record["count"] > 1)
+        assert pg.query_cookbook_histogram(999999999) == []
+
+    def test_query_cookbook_summary(self, pg):
+
+        cookbook = pg.query_cookbook(pg.userID)
+        summary = pg.query_cookbook_summary(pg.userID, 3, 7)
+        assert summary["Nrecipes"] == len(cookbook)
+        assert summary["Nliked"] == sum(r.user_rating == 5 for r in cookbook)
+        assert summary["Ndisliked"] == sum(r.user_rating == 1 for r in cookbook)
+        assert summary["mean_emissions"] == pytest.approx(
+            sum(r.emissions for r in cookbook) / len(cookbook)
+        )
+        assert len(summary["favorites"]) <= 3
+        assert all(r.user_rating == 5 for r in summary["favorites"])
+        assert {r.url for r in summary["favorites"]} <= {r.url for r in cookbook}
+
+        # Category counts
+        counts = Counter(c for r in cookbook for c in r.categories.split(";"))
+        assert len(summary["categories"]) == min(7, len(counts))
+        for category, count in summary["categories"]:
+            assert counts[category] == count
+        assert [c for _, c in summary["categories"]] == [
+            c for _, c in counts.most_common(7)
+        ]
 
-        # bookmarked url
-        pg.add_to_cookbook(pg.userID, pg.url_bookmark)
-        df = pg.query_bookmarks(pg.userID, [pg.url_bookmark])
-        assert df["bookmarked"][0]
+        # Empty cookbook
+        summary = pg.query_cookbook_summary(999999999)
+        assert summary["Nrecipes"] == 0
+        assert summary["mean_emissions"] == 0
+        assert summary["favorites"] == []
+        assert summary["categories"] == []
+
+    def test_user_categories(self, pg):
+
+        from application.models import User
+        import application.main.helper_functions as hf
+
+        def counts(userID):
+            """Category counts of table user_categories and of the cookbook"""
+            summary = pg.query_cookbook_summary(userID, N_categories=1000)
+            cookbook = pg.query_cookbook(userID)
+            labels, cnts = hf.get_favorite_categories(cookbook, 1000)
+            return dict(summary["categories"]), dict(zip(labels, cnts))
+
+        # Table user_categories is built with "flask categories build",
+        # never by the tests
+        if not pg.has_user_categories():
+            pytest.skip("table user_categories does not exist")
+        table, expected = counts(pg.userID)
+        assert table == expected
+
+        # Incremental updates when adding, rating and removing recipes
+        create_dummy_account(pg)
+        user = User.query.filter_by(username=pg.dummy_name).first()
+        table, expected = counts(user.userID)
+        assert table == expected
+        pg.rate_recipe(user.userID, pg.urls_exist[1], 5)
+        pg.add_to_cookbook(user.userID, pg.urls_exist[1])
+        table, expected = counts(user.userID)
+        assert table == expected
+        pg.remove_from_cookbook(user.userID, pg.url)
+        pg.remove_from_cookbook(user.userID, pg.urls_exist[1])
+        table, expected = counts(user.userID)
+        assert table == expected == {}
+
+        # Deleting the account deletes its category counts
+        pg.add_to_cookbook(user.userID, pg.url)
+        pg.delete_account(user.userID)
+        assert pg.query_cookbook_summary(user.userID)["categories"] == []
+
+    def test_has_user_categories(self, pg, monkeypatch):
+
+        # The table is built after the worker started: a missing table is
+        # checked again, an existing one is remembered
+        class Bind:
+            checks = []
+
+            def has_table(self, name):
+                self.checks.append(name)
+                return len(self.checks) > 1
+
+        monkeypatch.setattr(pg.session, "get_bind", lambda: Bind())
+        pg.user_categories_exists = False
+        assert not pg.has_user_categories()
+        assert pg.has_user_categories()
+        assert pg.has_user_categories()
+        assert Bind.checks == ["user_categories", "user_categories"]
 
     def test_is_in_cookbook(self, pg):
 
@@ -267,38 +576,160 @@ class TestSqlQueries:
         result = pg.add_to_cookbook(pg.userID + 999999999, pg.url)
         assert result == "UserID or recipe url invalid"
 
-    def test_query_user_ratings(self, pg):
+    def test_likes_upsert(self, pg):
+        """Single statement and fallback write paths behave the same"""
+
+        from application.models import User
+
+        create_dummy_account(pg)
+        user = User.query.filter_by(username=pg.dummy_name).first()
+        url = pg.urls_exist[1]
+
+        for single_statement in write_paths(pg):
+            pg.likes_unique_index_exists = single_statement
+
+            # Bookmarks
+            assert pg.add_to_cookbook(user.userID, url) == (
+                "Cookbook entry added successfully"
+            )
+            assert pg.add_to_cookbook(user.userID, url) == (
+                "Cookbook entry already exists"
+            )
+            assert pg.add_to_cookbook(user.userID, url + "123") == (
+                "UserID or recipe url invalid"
+            )
+            assert pg.is_in_cookbook(user.userID, url)
+
+            # Ratings update the existing row
+            assert pg.rate_recipe(user.userID, url, 1)
+            assert user_likes(pg, user.userID, [url]) == {url: (1, True)}
+
+            # Removing
+            assert pg.remove_from_cookbook(user.userID, url) == (
+                "Removed recipe from cookbook successfully"
+            )
+            assert pg.remove_from_cookbook(user.userID, url) == (
+                "Recipe was not bookmarked to begin with"
+            )
+
+            # Ratings create a new row (without bookmark)
+            assert pg.rate_recipe(user.userID, url, 5)
+            assert user_likes(pg, user.userID, [url]) == {url: (5, False)}
+            assert not pg.rate_recipe(user.userID, url + "123", 5)
+            pg.remove_from_cookbook(user.userID, url)
+
+        pg.delete_account(user.userID)
+
+    def test_apply_likes_batch(self, pg):
+        """Batch writes, single statement and fallback path behave the same"""
 
-        # Query existing entries in likes table
-        df = pg.query_user_ratings(pg.userID, pg.urls_exist + pg.urls_dont_exist)
-        assert type(df) == pd.core.frame.DataFrame
-        assert not df.empty
+        from application.models import User
+        import application.main.helper_functions as hf
 
-        # Query non-existing entries in likes table
-        df = pg.query_user_ratings(pg.userID, pg.urls_dont_exist)
-        assert df.empty
+        create_dummy_account(pg)
+        user = User.query.filter_by(username=pg.dummy_name).first()
+        url, url2 = pg.urls_exist
+
+        for single_statement in write_paths(pg):
+            pg.likes_unique_index_exists = single_statement
+            pg.remove_from_cookbook(user.userID, url2)
+
+            # Rate one recipe (after bookmarking it), remove the other
+            result = pg.apply_likes_batch(
+                user.userID,
+                [
+                    (url2, None, True),
+                    (url2, 1, None),
+                    (url, 5, None),
+                    (url, None, False),
+                    (pg.urls_dont_exist[0], 5, None),
+                ],
+            )
+            assert result == {
+                "updated": 1,
+                "removed": 1,
+                "invalid": [pg.urls_dont_exist[0]],
+            }
+            assert user_likes(pg, user.userID, pg.urls_exist) == {url2: (1, True)}
+
+            # Category counts are kept up to date
+            summary = pg.query_cookbook_summary(user.userID, N_categories=1000)
+            labels, cnts = hf.get_favorite_categories(
+                pg.query_cookbook(user.userID), 1000
+            )
+            assert dict(summary["categories"]) == dict(zip(labels, cnts))
+
+            # Rating a bookmarked recipe keeps the bookmark, nothing to do
+            result = pg.apply_likes_batch(user.userID, [(url2, 5, None)])
+            assert result == {"updated": 1, "removed": 0, "invalid": []}
+            assert user_likes(pg, user.userID, [url2]) == {url2: (5, True)}
+
+            # Rows that already have the new values are not counted
+            result = pg.apply_likes_batch(
+                user.userID, [(url2, 5, True), (url2, None, True)]
+            )
+            assert result == {"updated": 0, "removed": 0, "invalid": []}
+            assert user_likes(pg, user.userID, [url2]) == {url2: (5, True)}
+            assert pg.apply_likes_batch(user.userID, []) == {
+                "updated": 0,
+                "removed": 0,
+                "invalid": [],
+            }
+
+            # Bookmarking a rated recipe keeps the rating
+            pg.rate_recipe(user.userID, url, 1)
+            result = pg.apply_likes_batch(user.userID, [(url, None, True)])
+            assert result == {"updated": 1, "removed": 0, "invalid": []}
+            assert user_likes(pg, user.userID, [url]) == {url: (1, True)}
+
+            # Removing a bookmark and rating keeps the rated row
+            result = pg.apply_likes_batch(user.userID, [(url, 5, False)])
+            assert result == {"updated": 1, "removed": 0, "invalid": []}
+            assert user_likes(pg, user.userID, [url]) == {url: (5, False)}
+            pg.add_to_cookbook(user.userID, url)
+
+        pg.delete_account(user.userID)
+
+    def test_query_user_overlay(self, pg):
+
+        # Same ratings as the cookbook (all likes rows of the user)
+        cookbook = pg.query_cookbook(pg.userID)
+        recipesIDs = [row.recipesID for row in cookbook]
+        overlay = pg.query_user_overlay(pg.userID, recipesIDs + [-1])
+        assert set(overlay) == set(recipesIDs)
+        for row in cookbook:
+            user_rating, bookmarked = overlay[row.recipesID]
+            if user_rating is None:
+                assert math.isnan(row.user_rating)
+            else:
+                assert user_rating == row.user_rating
+
+        # Bookmarks
+        pg.add_to_cookbook(pg.userID, pg.url_bookmark)
+        assert pg.query_user_overlay(pg.userID, [pg.recipesID])[pg.recipesID][1]
+
+        # No entries
+        assert pg.query_user_overlay(pg.userID, []) == {}
+        assert pg.query_user_overlay(999999999, [pg.recipesID]) == {}
 
     def test_rate_recipe(self, pg):
 
-        from application.models import User, Recipe
+        from application.models import User
 
         # Change recipe rating to 4
         pg.rate_recipe(pg.userID, pg.url, 4)
-        df = pg.query_user_ratings(pg.userID, [pg.url])
-        assert df.loc[df["recipesID"] == pg.recipesID, "user_rating"].values == 4
+        assert user_likes(pg, pg.userID, [pg.url])[pg.url][0] == 4
 
         # Change rating to 5
         pg.rate_recipe(pg.userID, pg.url, 5)
-        df = pg.query_user_ratings(pg.userID, [pg.url])
-        assert df.loc[df["recipesID"] == pg.recipesID, "user_rating"].values == 5
+        assert user_likes(pg, pg.userID, [pg.url])[pg.url][0] == 5
 
         # Add rating for new account (entry does not exist yet)
         create_dummy_account(pg)
         user = User.query.filter_by(username=pg.dummy_name).first()
         pg.rate_recipe(user.userID, pg.urls_exist[1], 5)
-        recipesID = Recipe.query.filter_by(url=pg.urls_exist[1]).first().recipesID
-        df = pg.query_user_ratings(user.userID, [pg.urls_exist[1]])
-        assert df.loc[df["recipesID"] == recipesID, "user_rating"].values == 5
+        url = pg.urls_exist[1]
+        assert user_likes(pg, user.userID, [url])[url][0] == 5
         pg.delete_account(user.userID)
 
     def test_delete_account(self, pg):
@@ -0,0 +1,45 @@
+"""
+Unit tests for trigram_index.py
+"""
+import pytest
+from application.trigram_index import TrigramIndex, trigrams
+
+
+# FIXTURES
+@pytest.fixture
+def index():
+    """Small trigram index over a handful of recipe urls"""
+    urls = [
+        "pineapple-shrimp-noodle-bowls",
+        "cold-sesame-noodles-12715",
+        "chicken-noodle-soup-5621",
+        "vegan-chocolate-cookies-231",
+    ]
+    return TrigramIndex(list(range(1, len(urls) + 1)), urls)
+
+
+# TESTS
+class TestTrigramIndex:
+    def test_trigrams(self):
+
+        assert trigrams("cat") == {"  c", " ca", "cat", "at "}
+        assert trigrams("Cat-CAT") == trigrams("cat")
+        assert trigrams("") == set()
+        assert trigrams("--") == set()
+
+    def test_candidates(self, index):
+
+        # typos still find the right recipe first
+        assert index.candidates("pinaple-shrim")[0] == 1
+        assert index.candidates("chiken noodle")[0] == 3
+
+        # only documents sharing trigrams are returned
+        assert set(index.candidates("noodle")) == {1, 2, 3}
+        assert len(index.candidates("xqzv")) == 0
+
+        # N limits the number of candidates
+        assert len(index.candidates("noodle", N=2)) == 2
+        assert len(index.candidates("noodle", N=10)) == 3
+
+
+# eof